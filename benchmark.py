@@ -0,0 +1,366 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import threading
+import psutil
+from contextlib import closing
+from csv_to_database import create_database
+from database_shards import open_database
+from json_to_sql import json_to_sql, execute_query
+from column_encoding import load_encoded_columns
+from time_columns import load_epoch_columns
+from planner_stats import DEFAULT_ANALYSIS_LIMIT, analyze_database, collect_query_plans, print_plan_report
+from canvas import export_query_results
+from to_spss_data import one_hot_encode_csv
+from synthetic_data import generate_dataset
+
+DEFAULT_SCALE_FACTOR = 0.001  # About 300 patients and 1.4 million rows
+MEMORY_SAMPLE_INTERVAL = 0.05  # Seconds between memory samples
+QUERY_REPEATS = 5  # Runs of each query, of which the fastest is reported
+
+# A benchmark regresses when its throughput drops or its peak memory grows by more than this
+# fraction of the baseline
+THRESHOLDS = {
+    "rows_per_s": 0.20,
+    "peak_rss_mb": 0.25,
+}
+
+
+def _select(*tables):
+    return [{"name": name, "columns": list(columns)} for name, columns in tables]
+
+
+def _filter(filter_type, table, column, *values):
+    if filter_type == "range":
+        return {"filter_type": "range", "table": table, "column": column, "min": values[0], "max": values[1]}
+    return {"filter_type": "value", "table": table, "column": column, "value": values[0]}
+
+
+def _query(operator, filters, subqueries=()):
+    return {"operator": operator, "filters": list(filters), "subqueries": list(subqueries)}
+
+
+# Cohorts of the kind the canvas builds, from a plain patient list to nested AND/OR trees over
+# the event tables. The names and codes are the anchors synthetic_data draws most often.
+BENCHMARK_QUERIES = {
+    "all_patients": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id", "gender", "anchor_age"])),
+        "query": _query("AND", []),
+    },
+    "age_range": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id", "gender", "anchor_age"]),
+                                 ("admissions", ["race", "admission_type"])),
+        "query": _query("AND", [_filter("range", "patients", "anchor_age", 65, 90)]),
+    },
+    "tachycardia": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("chartevents", ["charttime", "valuenum"])),
+        "query": _query("AND", [_filter("value", "chartevents_d_items", "label", "Heart Rate"),
+                                _filter("range", "chartevents", "valuenum", 100, 300)]),
+    },
+    "high_creatinine": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("labevents", ["charttime", "valuenum"])),
+        "query": _query("AND", [_filter("value", "labevents", "itemid", 50912),
+                                _filter("range", "labevents", "valuenum", 1.5, 20)]),
+    },
+    "hypertension": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("d_icd_diagnoses", ["long_title"])),
+        "query": _query("OR", [_filter("value", "d_icd_diagnoses", "long_title", "Essential (primary) hypertension"),
+                               _filter("value", "d_icd_diagnoses", "long_title", "Unspecified essential hypertension")]),
+    },
+    "abnormal_labs": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("labevents", ["charttime", "valueuom"])),
+        "query": _query("AND", [_filter("value", "labevents", "flag", "abnormal"),
+                                _filter("value", "admissions", "insurance", "Medicare")]),
+    },
+    "first_day_labs": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("labevents", ["charttime", "valuenum"])),
+        "query": _query("AND", [{"filter_type": "time", "table": "labevents", "column": "charttime",
+                                 "relative_to": {"table": "admissions", "column": "admittime"},
+                                 "start_hours": 0, "end_hours": 24}]),
+    },
+    "nested_cohort": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id", "anchor_age"])),
+        "query": _query("AND", [_filter("range", "patients", "anchor_age", 50, 80),
+                                _filter("value", "patients", "gender", "F")], [
+            _query("OR", [_filter("value", "d_icd_diagnoses", "long_title", "Pneumonia, unspecified organism"),
+                          _filter("value", "d_icd_diagnoses", "long_title", "Hyperlipidemia, unspecified")]),
+            _query("AND", [_filter("value", "labevents", "itemid", 50912)]),
+        ]),
+    },
+}
+
+# The query written to CSV by the export benchmark, and the columns one-hot encoded afterwards
+EXPORT_QUERY = {
+    "diagnosed_in": "hospital",
+    "select_tables": _select(("patients", ["subject_id", "gender"]),
+                             ("chartevents", ["charttime", "valuenum", "valueuom"])),
+    "query": _query("AND", [_filter("value", "chartevents_d_items", "category", "Routine Vital Signs")]),
+}
+ENCODE_COLUMNS = ["gender", "valueuom"]
+
+
+class MemorySampler:
+    """
+    Samples the resident memory of this process and all of its children, such as the parse
+    workers of a build, in a background thread and keeps the peak.
+    """
+
+    def __init__(self, interval=MEMORY_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def sample(self):
+        total = 0
+        for process in [self.process, *self.process.children(recursive=True)]:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                # A child may exit between being listed and being measured
+                pass
+        self.peak_bytes = max(self.peak_bytes, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def measure(function, repeats=1):
+    """
+    Runs function and measures its wall time and the peak memory of the process tree.
+
+    Args:
+        function (callable): Returns the number of rows it processed.
+        repeats (int): Number of runs. The fastest one is reported, which steadies the
+            timings of short queries.
+
+    Returns:
+        dict: rows, seconds, rows_per_s and peak_rss_mb.
+    """
+    with MemorySampler() as sampler:
+        seconds = None
+        for _ in range(repeats):
+            start_time = time.perf_counter()
+            rows = function()
+            elapsed = time.perf_counter() - start_time
+            seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return {
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_s": round(rows / seconds, 1) if seconds > 0 else None,
+        "peak_rss_mb": round(sampler.peak_bytes / (1024 * 1024), 1),
+    }
+
+
+def _count_query_rows(connection, query_object):
+    cursor = execute_query(connection, query_object)
+    rows = 0
+    while True:
+        chunk = cursor.fetchmany(10000)
+        if not chunk:
+            return rows
+        rows += len(chunk)
+
+
+def _count_csv_rows(file_path):
+    with open(file_path, "rb") as file:
+        return max(0, sum(1 for _ in file) - 1)
+
+
+def run_benchmarks(scale_factor=DEFAULT_SCALE_FACTOR, workers=None, seed=0, path_to_data=None,
+                   dictionary_encoding=False, analysis_limit=DEFAULT_ANALYSIS_LIMIT):
+    """
+    Times each stage a user goes through: building the database, running the standard
+    cohort queries, exporting a query from the canvas and one-hot encoding the export.
+
+    Args:
+        scale_factor (float): Size of the generated dataset, as a fraction of MIMIC-IV.
+        workers (int, optional): Number of parse processes of the build.
+        seed (int): Seed of the generated dataset.
+        path_to_data (str, optional): Existing CSVs to build from instead of generating them.
+        dictionary_encoding (bool): Build the database with dictionary encoding.
+        analysis_limit (int): The ANALYZE sampling limit. The queries are planned once before
+            ANALYZE and once after it, and both plans are kept under "query_plans".
+
+    Returns:
+        dict: The environment and, per benchmark, its rows, seconds, rows/s and peak memory.
+    """
+    results = {
+        "scale_factor": None if path_to_data else scale_factor,
+        "dictionary_encoding": dictionary_encoding,
+        "analysis_limit": analysis_limit,
+        "environment": {
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "benchmarks": {},
+    }
+    benchmarks = results["benchmarks"]
+    scratch_directory = tempfile.mkdtemp(prefix="mimic_benchmark_")
+    try:
+        if path_to_data is None:
+            path_to_data = os.path.join(scratch_directory, "data")
+            benchmarks["generate"] = measure(
+                lambda: sum(generate_dataset(path_to_data, scale_factor, seed).values())
+            )
+
+        database_path = os.path.join(scratch_directory, "MIMIC_Database.db")
+        build_report = {}
+
+        def build():
+            # Analyzed below, once the plans without statistics are recorded
+            create_database(path_to_data, workers=workers, database_path=database_path,
+                            build_report=build_report, resume=False, dictionary_encoding=dictionary_encoding,
+                            analysis_limit=None)
+            with closing(open_database(database_path)) as connection:
+                return sum(rows for rows, in connection.execute("SELECT rows_committed FROM _build_manifest"))
+
+        benchmarks["create_database"] = measure(build)
+        benchmarks["create_database"]["stages"] = {stage: round(seconds, 4) for stage, seconds in build_report.items()}
+        benchmarks["create_database"]["file_size_mb"] = round(os.path.getsize(database_path) / (1024 * 1024), 1)
+
+        with closing(open_database(database_path)) as connection:
+            encoded_columns = load_encoded_columns(connection)
+            epoch_columns = load_epoch_columns(connection)
+            query_objects = {
+                query_name: {**query_object, "encoded_columns": encoded_columns, "epoch_columns": epoch_columns}
+                for query_name, query_object in BENCHMARK_QUERIES.items()
+            }
+            statements = {query_name: json_to_sql(query_object) for query_name, query_object in query_objects.items()}
+            plans_before = collect_query_plans(connection, statements)
+            benchmarks["analyze"] = measure(lambda: analyze_database(connection, analysis_limit)["stat_rows"])
+
+        # A new connection, since SQLite only reads the statistics when it opens the file
+        with closing(open_database(database_path)) as connection:
+            plans_after = collect_query_plans(connection, statements)
+            results["query_plans"] = {query_name: {"before": plans_before[query_name], "after": plans_after[query_name]}
+                                      for query_name in statements}
+            for query_name, query_object in query_objects.items():
+                benchmarks[f"query_{query_name}"] = measure(
+                    lambda: _count_query_rows(connection, query_object), QUERY_REPEATS
+                )
+
+            export_path = os.path.join(scratch_directory, "output1.csv")
+            benchmarks["canvas_export"] = measure(
+                lambda: export_query_results(connection, database_path, EXPORT_QUERY, export_path, result_cache_mb=0) or 0
+            )
+
+        encoded_path = os.path.join(scratch_directory, "output1_encoded.csv")
+        benchmarks["one_hot_encode"] = measure(
+            lambda: _count_csv_rows(one_hot_encode_csv(export_path, ENCODE_COLUMNS, encoded_path))
+        )
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+    return results
+
+
+def compare_to_baseline(results, baseline, thresholds=THRESHOLDS):
+    """
+    Compares benchmark results with an earlier run.
+
+    Args:
+        results (dict): Output of run_benchmarks.
+        baseline (dict): Output of an earlier run_benchmarks, usually loaded from --save.
+        thresholds (dict): Largest allowed fractional change per metric.
+
+    Returns:
+        list: A message for every metric that regressed beyond its threshold.
+    """
+    regressions = []
+    for name, result in results["benchmarks"].items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous:
+            continue
+        old_rate, new_rate = previous.get("rows_per_s"), result.get("rows_per_s")
+        if old_rate and new_rate is not None and new_rate < old_rate * (1 - thresholds["rows_per_s"]):
+            regressions.append(f"{name}: {new_rate:,.0f} rows/s is {1 - new_rate / old_rate:.0%} below "
+                               f"the baseline's {old_rate:,.0f}")
+        old_memory, new_memory = previous.get("peak_rss_mb"), result.get("peak_rss_mb")
+        if old_memory and new_memory > old_memory * (1 + thresholds["peak_rss_mb"]):
+            regressions.append(f"{name}: peak memory {new_memory:,.1f} MB is {new_memory / old_memory - 1:.0%} "
+                               f"above the baseline's {old_memory:,.1f} MB")
+    return regressions
+
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<26} {'rows':>12} {'seconds':>9} {'rows/s':>12} {'peak MB':>9} {'vs baseline':>12}")
+    for name, result in results["benchmarks"].items():
+        previous = (baseline or {}).get("benchmarks", {}).get(name, {})
+        change = ""
+        if previous.get("rows_per_s") and result["rows_per_s"]:
+            change = f"{result['rows_per_s'] / previous['rows_per_s'] - 1:+.1%}"
+        rate = f"{result['rows_per_s']:,.0f}" if result["rows_per_s"] is not None else "-"
+        print(f"{name:<26} {result['rows']:>12,} {result['seconds']:>9.2f} {rate:>12} "
+              f"{result['peak_rss_mb']:>9,.1f} {change:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the database build, queries and exports.")
+    parser.add_argument("--scale", type=float, default=DEFAULT_SCALE_FACTOR,
+                        help="Size of the generated dataset as a fraction of MIMIC-IV.")
+    parser.add_argument("--data", help="Build from these CSVs instead of generating a dataset.")
+    parser.add_argument("--workers", type=int, help="Number of parse processes of the build.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated dataset.")
+    parser.add_argument("--dictionary-encoding", action="store_true",
+                        help="Build the database with low-cardinality text columns dictionary-encoded.")
+    parser.add_argument("--analysis-limit", type=int, default=DEFAULT_ANALYSIS_LIMIT,
+                        help="Rows ANALYZE reads from each index; 0, the default, reads every row.")
+    parser.add_argument("--baseline", help="Results of an earlier run to check for regressions.")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    arguments = parser.parse_args()
+
+    results = run_benchmarks(arguments.scale, arguments.workers, arguments.seed, arguments.data,
+                             arguments.dictionary_encoding, arguments.analysis_limit)
+    baseline = None
+    if arguments.baseline:
+        with open(arguments.baseline, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+
+    print_results(results, baseline)
+    print()
+    print_plan_report({name: plans["before"] for name, plans in results["query_plans"].items()},
+                      {name: plans["after"] for name, plans in results["query_plans"].items()})
+    if arguments.save:
+        with open(arguments.save, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=4)
+        print(f"Results written to {arguments.save}")
+
+    if baseline:
+        regressions = compare_to_baseline(results, baseline)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
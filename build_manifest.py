@@ -0,0 +1,170 @@
+import os
+import time
+import hashlib
+
+# Bytes read from each end of a source file for its content hash. Hashing the whole of
+# chartevents would take longer than loading it, so size + mtime + both ends is the fingerprint.
+HASH_SAMPLE_BYTES = 1024 * 1024
+
+# Stage recorded once every source table is fully loaded
+INSERT_STAGE = "insert"
+
+CREATE_MANIFEST_SQL = """
+CREATE TABLE IF NOT EXISTS _build_manifest (
+    table_name TEXT PRIMARY KEY,
+    source_path TEXT,
+    source_size INTEGER,
+    source_mtime REAL,
+    source_hash TEXT,
+    rows_committed INTEGER,
+    status TEXT
+);
+
+CREATE TABLE IF NOT EXISTS _build_stages (
+    stage TEXT PRIMARY KEY,
+    completed_at REAL
+);
+"""
+
+DROP_MANIFEST_SQL = """
+DROP TABLE IF EXISTS _build_manifest;
+DROP TABLE IF EXISTS _build_stages;
+"""
+
+
+def source_fingerprint(source_path):
+    """
+    Returns (size, mtime, hash) for a source file. The hash covers the first and last
+    HASH_SAMPLE_BYTES of the file together with its size.
+    """
+    stat = os.stat(source_path)
+    digest = hashlib.sha256(str(stat.st_size).encode())
+    with open(source_path, "rb") as file:
+        digest.update(file.read(HASH_SAMPLE_BYTES))
+        if stat.st_size > HASH_SAMPLE_BYTES:
+            file.seek(max(HASH_SAMPLE_BYTES, stat.st_size - HASH_SAMPLE_BYTES))
+            digest.update(file.read(HASH_SAMPLE_BYTES))
+    return stat.st_size, stat.st_mtime, digest.hexdigest()
+
+
+def manifest_exists(connection):
+    row = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '_build_manifest'"
+    ).fetchone()
+    return row is not None
+
+
+class BuildManifest:
+    """
+    Checkpoint record kept inside the database being built. Row counts are written in the
+    same transaction as the rows themselves, so after a crash the manifest always matches
+    what is actually in each table.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.connection.executescript(CREATE_MANIFEST_SQL)
+        self.connection.commit()
+
+    def reset(self):
+        """
+        Forgets every table and stage so the next build starts from scratch.
+        """
+        self.connection.executescript(DROP_MANIFEST_SQL + CREATE_MANIFEST_SQL)
+        self.connection.commit()
+
+    def get_table_state(self, table_name):
+        row = self.connection.execute(
+            "SELECT source_size, source_mtime, source_hash, rows_committed, status "
+            "FROM _build_manifest WHERE table_name = ?",
+            (table_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "fingerprint": (row[0], row[1], row[2]),
+            "rows_committed": row[3],
+            "status": row[4],
+        }
+
+    def plan_jobs(self, jobs, reload_table):
+        """
+        Decides what each source file still needs.
+
+        Args:
+            jobs (list): Pairs of (source_path, table_name).
+            reload_table (function): Called with a table name whose source changed since it
+                was loaded; it must leave the table empty and in its original shape.
+
+        Returns:
+            list: (source_path, table_name, rows_to_skip) for every table that is not
+                  already complete.
+        """
+        planned_jobs = []
+        for source_path, table_name in jobs:
+            fingerprint = source_fingerprint(source_path)
+            state = self.get_table_state(table_name)
+
+            if state is not None and state["fingerprint"] == fingerprint:
+                if state["status"] == "complete":
+                    print(f"Skipping {table_name}: already loaded from an unchanged source.")
+                    continue
+                print(f"Resuming {table_name} after {state['rows_committed']} committed rows.")
+                planned_jobs.append((source_path, table_name, state["rows_committed"]))
+                continue
+
+            if state is not None:
+                # The source file changed, so everything derived from the old data is stale too
+                print(f"Source for {table_name} changed, reloading it.")
+                reload_table(table_name)
+
+            self.connection.execute(
+                "INSERT OR REPLACE INTO _build_manifest "
+                "(table_name, source_path, source_size, source_mtime, source_hash, rows_committed, status) "
+                "VALUES (?, ?, ?, ?, ?, 0, 'loading')",
+                (table_name, source_path, *fingerprint)
+            )
+            planned_jobs.append((source_path, table_name, 0))
+
+        if planned_jobs:
+            # Every later stage is idempotent and has to see the new rows
+            self.clear_stages()
+        self.connection.commit()
+        return planned_jobs
+
+    def record_rows(self, table_name, rows_committed):
+        """
+        Stores the row count of a table. The caller commits it together with the rows.
+        """
+        self.connection.execute(
+            "UPDATE _build_manifest SET rows_committed = ? WHERE table_name = ?",
+            (rows_committed, table_name)
+        )
+
+    def mark_table_complete(self, table_name, rows_committed):
+        self.connection.execute(
+            "UPDATE _build_manifest SET rows_committed = ?, status = 'complete' WHERE table_name = ?",
+            (rows_committed, table_name)
+        )
+
+    def incomplete_tables(self):
+        rows = self.connection.execute(
+            "SELECT table_name FROM _build_manifest WHERE status != 'complete'"
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def is_stage_complete(self, stage):
+        row = self.connection.execute(
+            "SELECT 1 FROM _build_stages WHERE stage = ?", (stage,)
+        ).fetchone()
+        return row is not None
+
+    def mark_stage_complete(self, stage):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO _build_stages (stage, completed_at) VALUES (?, ?)",
+            (stage, time.time())
+        )
+        self.connection.commit()
+
+    def clear_stages(self):
+        self.connection.execute("DELETE FROM _build_stages")
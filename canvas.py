@@ -1,11 +1,58 @@
 import os
 import csv
 import json
-from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QSizePolicy, QMessageBox
+import sqlite3
+from PyQt5.QtWidgets import QWidget, QPushButton, QVBoxLayout, QHBoxLayout, QSizePolicy, QMessageBox, QLabel
 from PyQt5.QtGui import QPainter, QPen, QPolygon
-from PyQt5.QtCore import Qt, QPoint, QRect
+from PyQt5.QtCore import Qt, QPoint, QRect, QThread, pyqtSignal
 from draggable_item import DraggableItem
-from json_to_sql import json_to_sql
+from json_to_sql import COHORT_TABLE, json_to_sql, cohort_to_sql, execute_query
+from column_encoding import load_encoded_columns
+from time_columns import load_epoch_columns
+from parquet_cache import query_parquet_cache
+from result_cache import ResultCache, DEFAULT_RESULT_CACHE_MB
+from cohort_bitmaps import CohortBitmapEngine
+from query_controller import QueryController, QueryCancelled
+from database_shards import open_database
+from pragma_profiles import apply_reader_pragmas
+from plan_inspector import inspect_query, describe_filter
+from planner_stats import reload_statistics
+from query_plan_dialog import QueryPlanDialog
+
+# Filter items whose filters lead to a flagged step of the query plan
+ITEM_STYLE = "background-color: white; border: 1px solid black; padding: 0px; color: black;"
+FLAGGED_ITEM_STYLE = "background-color: #FFF3E0; border: 3px solid #FF5722; padding: 0px; color: black;"
+
+class QueryExportThread(QThread):
+    progress_updated = pyqtSignal(float, int, int)  # Emit the seconds, VM steps and rows so far
+    query_finished = pyqtSignal(object)  # Emit the rows written, or None if the query failed or was stopped
+
+    def __init__(self, database_path, query_object, filename, result_cache_mb, cohort_engine,
+                 time_budget=None, row_budget=None):
+        super().__init__()
+        self.database_path = database_path
+        self.query_object = query_object
+        self.filename = filename
+        self.result_cache_mb = result_cache_mb
+        self.cohort_engine = cohort_engine
+        self.controller = QueryController(time_budget, row_budget, self.progress_updated.emit)
+
+    def run(self):
+        # Runs on its own connection, so the window stays responsive, and closing it when the
+        # query ends frees its temporary tables and files
+        rows_written = None
+        try:
+            connection = open_database(self.database_path)
+            try:
+                apply_reader_pragmas(connection)
+                rows_written = export_query_results(connection, self.database_path, self.query_object, self.filename,
+                                                    result_cache_mb=self.result_cache_mb,
+                                                    cohort_engine=self.cohort_engine, controller=self.controller)
+            finally:
+                connection.close()
+        except Exception as e:
+            print(f"Error running the query: {e}")
+        self.query_finished.emit(rows_written)
 
 class Canvas(QWidget):
     def __init__(self, frontend, parent=None):
@@ -20,6 +67,11 @@ class Canvas(QWidget):
         self.selected_item = None 
         self.query_root = None
         self.diagnosed_in = "hospital"  # Default value
+        self.plan_dialog = None
+        # Keeps the bitsets of the filter groups run so far, so editing one branch of the
+        # tree re-runs only that branch
+        self.cohort_engine = CohortBitmapEngine()
+        self.query_thread = None
 
         self.layout = QVBoxLayout(self)
         self.button_row = QHBoxLayout()
@@ -67,6 +119,19 @@ class Canvas(QWidget):
         )
         self.run_query_button.clicked.connect(self.run_query)
 
+        self.cancel_query_button = QPushButton("⏹ Cancel Query")
+        self.cancel_query_button.setStyleSheet(
+            "font-size: 18px; font-weight: bold; padding: 15px 30px; background-color: #795548; color: white; border-radius: 10px;"
+        )
+        self.cancel_query_button.clicked.connect(self.cancel_query)
+        self.cancel_query_button.setEnabled(False)
+
+        self.analyze_query_button = QPushButton("🔍 Analyze Query")
+        self.analyze_query_button.setStyleSheet(
+            "font-size: 18px; font-weight: bold; padding: 15px 30px; background-color: #607D8B; color: white; border-radius: 10px;"
+        )
+        self.analyze_query_button.clicked.connect(self.analyze_query)
+
         self.button_row.addStretch()
         self.button_row.addWidget(self.add_or_button)
         self.button_row.addWidget(self.add_and_button)
@@ -75,10 +140,17 @@ class Canvas(QWidget):
         self.button_row.addWidget(self.mark_root_button)
         self.button_row.addWidget(self.diagnosis_toggle)  # Add the new toggle button
         self.button_row.addWidget(self.run_query_button)
+        self.button_row.addWidget(self.cancel_query_button)
+        self.button_row.addWidget(self.analyze_query_button)
         self.button_row.addStretch()
 
         self.layout.addLayout(self.button_row)
 
+        # Progress of the running query, and how the last one ended
+        self.query_status_label = QLabel("")
+        self.query_status_label.setStyleSheet("font-size: 14px; border: none;")
+        self.layout.addWidget(self.query_status_label)
+
         self.canvas_area = CanvasArea(self)
         self.canvas_area.setStyleSheet("background-color: white; border: 2px solid #555;")
         self.canvas_area.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
@@ -205,8 +277,10 @@ class Canvas(QWidget):
         """
         query = self._get_curr_sql_query()
         if query:
+            sql, parameters = query
             print("Generated SQL Query:")
-            print(query)
+            print(sql)
+            print(f"Parameters: {parameters}")
         else:
             print("Failed to build the query.")
 
@@ -215,24 +289,11 @@ class Canvas(QWidget):
         Executes the query starting from the root query, writes the results to a CSV file in chunks,
         and handles file naming conflicts by incrementing the file number.
         """
-        query = self._get_curr_sql_query()
-        if not query:
+        query_object = self._get_curr_query_object()
+        if not query_object:
             print("Failed to build the query.")
             return
 
-        # Generate the SQL query
-        print("Executing SQL Query:")
-        print(query)
-
-        # Execute the query using the database connection
-        try:
-            cursor = self.frontend.db_connection.cursor()
-            cursor.execute(query)
-            column_names = [desc[0] for desc in cursor.description]  # Get column names
-        except Exception as e:
-            print(f"Error executing query: {e}")
-            return
-
         # Load output path from YAML  
         output_path = self.frontend.output_path
         # Ensure output path is set
@@ -258,33 +319,104 @@ class Canvas(QWidget):
                 break
             file_number += 1
 
-        # Write the results to the CSV file in chunks
+        # config.yaml's result_cache_mb bounds the cache of earlier results, 0 turns it off, and
+        # query_timeout_s and query_row_limit stop a query that runs longer or returns more
+        config = getattr(self.frontend, "config", {})
+        result_cache_mb = config.get("result_cache_mb", DEFAULT_RESULT_CACHE_MB)
+        self.query_thread = QueryExportThread(self.frontend.db_path, query_object, filename, result_cache_mb,
+                                              self.cohort_engine, config.get("query_timeout_s"),
+                                              config.get("query_row_limit"))
+        self.query_thread.progress_updated.connect(self.update_query_progress)
+        self.query_thread.query_finished.connect(self.on_query_finished)
+        # One query at a time: the thread shares the canvas's bitsets
+        self.run_query_button.setEnabled(False)
+        self.cancel_query_button.setEnabled(True)
+        self.query_status_label.setText(f"Running the query into {filename}...")
+        self.query_thread.start()
+
+    def cancel_query(self):
+        """Stops the running query, which deletes its partial CSV file"""
+        if self.query_thread is not None and self.query_thread.isRunning():
+            self.query_thread.controller.cancel()
+            self.cancel_query_button.setEnabled(False)
+            self.query_status_label.setText("Cancelling the query...")
+
+    def wait_for_query(self):
+        """Cancels the running query and waits for its thread to close its connection"""
+        if self.query_thread is not None and self.query_thread.isRunning():
+            self.query_thread.controller.cancel()
+            self.query_thread.wait()
+
+    def update_query_progress(self, seconds, vm_steps, rows):
+        self.query_status_label.setText(f"Running the query: {seconds:.1f} s, {vm_steps:,} SQLite steps, "
+                                        f"{rows:,} rows written")
+
+    def on_query_finished(self, rows_written):
+        controller = self.query_thread.controller
+        if rows_written is not None:
+            self.query_status_label.setText(f"Wrote {rows_written:,} rows to {self.query_thread.filename} "
+                                            f"in {controller.elapsed():.1f} s")
+        elif controller.reason:
+            self.query_status_label.setText(f"The query {controller.reason} after {controller.elapsed():.1f} s; "
+                                            "its partial results were deleted")
+        else:
+            self.query_status_label.setText("The query failed; see the log for the error")
+        self.run_query_button.setEnabled(True)
+        self.cancel_query_button.setEnabled(False)
+
+    def analyze_query(self):
+        """
+        Shows the plan SQLite picks for the query starting from the root without running it.
+        Steps that read a whole table, sort into a temporary B-tree or build an automatic index
+        are flagged with the index that would avoid them, and the filter items they come from
+        are outlined on the canvas.
+        """
+        filter_items = {}
+        query_object = self._get_curr_query_object(filter_items)
+        if not query_object:
+            print("Failed to build the query.")
+            return
+
         try:
-            with open(filename, mode="w", newline="", encoding="utf-8") as file:
-                writer = csv.writer(file)
-                writer.writerow(column_names)  # Write column headers
-
-                # Fetch and write rows in chunks
-                chunk_size = 1000  # Number of rows to fetch and write at a time
-                while True:
-                    rows = cursor.fetchmany(chunk_size)
-                    if not rows:
-                        break
-                    writer.writerows(rows)  # Write the chunk of rows
-                    print(f"Wrote {len(rows)} rows to {filename}")
-
-            print(f"Query results written to {filename}")
-        except Exception as e:
-            print(f"Error writing to CSV file: {e}")
-        finally:
-            cursor.close()  # Ensure the cursor is closed
-            
-    def _build_query_from_item(self, item):
+            inspection = inspect_query(self.frontend.db_connection, query_object)
+        except sqlite3.Error as e:
+            QMessageBox.warning(None, "Query Plan", f"Could not plan the query: {e}")
+            return
+
+        # Outline the filter items behind each flagged step, with its advice as their tooltip
+        for item in filter_items.values():
+            if item is not self.query_root:
+                item.setStyleSheet(ITEM_STYLE)
+            item.setToolTip("")
+        flagged = {}
+        for step in inspection["steps"]:
+            if not step["issue"]:
+                continue
+            for filter_obj in step["filters"]:
+                item = filter_items.get(id(filter_obj))
+                if item is not None:
+                    flagged.setdefault(item, []).append(f"{step['issue']}: {step['detail']}\n{step['advice'] or ''}")
+        for item, notes in flagged.items():
+            item.setStyleSheet(FLAGGED_ITEM_STYLE)
+            item.setToolTip("\n\n".join(notes))
+        if flagged:
+            print("Filters behind flagged plan steps: " + "; ".join(
+                describe_filter(filter_obj) for step in inspection["steps"] if step["issue"]
+                for filter_obj in step["filters"]))
+
+        self.plan_dialog = QueryPlanDialog(inspection, self.frontend.db_path, self)
+        # The indexes are built on another connection, whose statistics this one has to reread
+        self.plan_dialog.indexes_created.connect(lambda: reload_statistics(self.frontend.db_connection))
+        self.plan_dialog.show()
+
+    def _build_query_from_item(self, item, filter_items=None):
         """
         Recursively builds the query structure starting from the given item.
 
         Args:
             item (DraggableItem): The current item to process.
+            filter_items (dict, optional): Filled with id(filter object) -> the item it was
+                built from.
 
         Returns:
             dict: A query object in the format expected by the backend.
@@ -300,9 +432,11 @@ class Canvas(QWidget):
                     child_filter = self._build_filter_from_item(child)
                     if child_filter:
                         filters.append(child_filter)
+                        if filter_items is not None:
+                            filter_items[id(child_filter)] = child
                 else:
                     # This is a subquery (another logical operator)
-                    child_query = self._build_query_from_item(child)
+                    child_query = self._build_query_from_item(child, filter_items)
                     if child_query:
                         subqueries.append(child_query)
 
@@ -315,9 +449,20 @@ class Canvas(QWidget):
 
         else:
             # This is a filter (range, equality, or readmission)
-            return self._build_filter_from_item(item)
+            filter_obj = self._build_filter_from_item(item)
+            if filter_obj and filter_items is not None:
+                filter_items[id(filter_obj)] = item
+            return filter_obj
 
     def _get_curr_sql_query(self):
+        query_object = self._get_curr_query_object()
+        if not query_object:
+            return query_object
+
+        # Convert the query object to SQL
+        return json_to_sql(query_object)
+
+    def _get_curr_query_object(self, filter_items=None):
         if not self.query_root:
             print("No query root has been set.")
             return
@@ -326,7 +471,7 @@ class Canvas(QWidget):
         select_tables = self.frontend.return_column_search_bar.get_selected_tables_and_columns()
 
         # Build the query structure starting from the root
-        query_structure = self._build_query_from_item(self.query_root)
+        query_structure = self._build_query_from_item(self.query_root, filter_items)
         
         if not query_structure:
             return ""
@@ -346,11 +491,19 @@ class Canvas(QWidget):
             "query": query_structure
         }
 
+        # Value filters on dictionary-encoded columns compare integer codes
+        encoded_columns = load_encoded_columns(self.frontend.db_connection)
+        if encoded_columns:
+            query_object["encoded_columns"] = encoded_columns
+        # and time filters compare epoch seconds where the database has them
+        epoch_columns = load_epoch_columns(self.frontend.db_connection)
+        if epoch_columns:
+            query_object["epoch_columns"] = epoch_columns
+
         # Print the query object for debugging
         print(json.dumps(query_object, indent=4))
 
-        # Convert the query object to SQL
-        return json_to_sql(query_object)
+        return query_object
     
     def _build_filter_from_item(self, item):
         """
@@ -463,4 +616,132 @@ class CanvasArea(QWidget):
 
         arrowhead = QPolygon([end, arrow_p1, arrow_p2])
         painter.setBrush(Qt.black)
-        painter.drawPolygon(arrowhead)
\ No newline at end of file
+        painter.drawPolygon(arrowhead)
+
+
+def export_query_results(connection, database_path, query_object, filename, chunk_size=1000,
+                         result_cache_mb=DEFAULT_RESULT_CACHE_MB, cohort_engine=None, controller=None):
+    """
+    Runs a query and writes its results to a CSV file in chunks. This is what the Run Query
+    button does once it has picked the output file. A query run before on the same build of
+    the database is served from the result cache instead.
+
+    Args:
+        connection (sqlite3.Connection): The open database connection.
+        database_path (str): Path of the database, used to find its Parquet and result caches.
+        query_object (dict): The query, in the format json_to_sql expects.
+        filename (str): The CSV file to write.
+        chunk_size (int): Number of rows to fetch and write at a time.
+        result_cache_mb (float): Disk space the result cache may take, 0 to bypass it.
+        cohort_engine (CohortBitmapEngine): Evaluates the queries it can with the bitsets it
+            keeps of earlier filter groups. None runs every query in SQL.
+        controller (QueryController): Cancels the query, or stops it at its time and row
+            budgets, and reports its progress. None runs it to the end.
+
+    Returns:
+        int: Rows written, or None if the query or the write failed or was stopped.
+    """
+    result_cache = None
+    if result_cache_mb:
+        try:
+            result_cache = ResultCache(connection, database_path, int(result_cache_mb * 1024 * 1024))
+            cached_rows = result_cache.fetch(query_object, filename)
+        except Exception as e:
+            print(f"Error reading the result cache, running the query: {e}")
+            result_cache = None
+            cached_rows = None
+        if cached_rows is not None:
+            print(f"Query results written to {filename} from the result cache")
+            return cached_rows
+
+    controller = controller or QueryController()
+    try:
+        with controller.running(connection):
+            rows_written = _write_query_results(connection, database_path, query_object, filename, chunk_size,
+                                                cohort_engine, controller)
+    except QueryCancelled as e:
+        # Ends the statement's transaction and drops its cohort table, so its temporary
+        # B-trees and pages are freed now, and the partial CSV goes with them
+        print(e)
+        connection.rollback()
+        connection.execute(f"DROP TABLE IF EXISTS temp.{COHORT_TABLE}")
+        if os.path.exists(filename):
+            os.remove(filename)
+        return None
+
+    if rows_written is not None and result_cache is not None:
+        try:
+            result_cache.store(query_object, filename, rows_written)
+        except Exception as e:
+            print(f"Error storing the result in the result cache: {e}")
+    return rows_written
+
+
+def _write_query_results(connection, database_path, query_object, filename, chunk_size, cohort_engine, controller):
+    """Runs a query for export_query_results and writes its rows, returning how many or None"""
+    cursor = None
+
+    # Selections over the large event tables are read from the Parquet cache when it has them
+    try:
+        cached_result = query_parquet_cache(connection, database_path, query_object, chunk_size)
+    except Exception as e:
+        controller.raise_if_stopped()
+        print(f"Error reading the Parquet cache, running the query in SQLite: {e}")
+        cached_result = None
+
+    if cached_result is not None:
+        column_names, row_chunks = cached_result
+    elif cohort_engine is not None and cohort_engine.get_level(query_object):
+        # The cohort is combined from the bitsets of its filter groups, and only its rows'
+        # columns are read with SQL
+        try:
+            cursor = cohort_engine.execute(connection, query_object)
+            column_names = [desc[0] for desc in cursor.description]
+        except Exception as e:
+            controller.raise_if_stopped()
+            print(f"Error executing query: {e}")
+            return None
+        row_chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+    else:
+        # Generate the SQL query. Its cohort's keys go to a TEMP table first when it has a phase one
+        phase_one, query, parameters = cohort_to_sql(query_object)
+        for statement in phase_one:
+            print("Cohort Statement:")
+            print(statement)
+        print("Executing SQL Query:")
+        print(query)
+        print(f"Parameters: {parameters}")
+
+        # Execute the query using the database connection
+        try:
+            cursor = execute_query(connection, query_object)
+            column_names = [desc[0] for desc in cursor.description]  # Get column names
+        except Exception as e:
+            controller.raise_if_stopped()
+            print(f"Error executing query: {e}")
+            return None
+        row_chunks = iter(lambda: cursor.fetchmany(chunk_size), [])
+
+    # Write the results to the CSV file in chunks
+    rows_written = 0
+    try:
+        with open(filename, mode="w", newline="", encoding="utf-8") as file:
+            writer = csv.writer(file)
+            writer.writerow(column_names)  # Write column headers
+
+            # Fetch and write rows in chunks, stopping between them once the query is stopped
+            for rows in row_chunks:
+                controller.add_rows(len(rows))
+                writer.writerows(rows)  # Write the chunk of rows
+                rows_written += len(rows)
+                print(f"Wrote {len(rows)} rows to {filename}")
+
+        print(f"Query results written to {filename}")
+        return rows_written
+    except Exception as e:
+        controller.raise_if_stopped()
+        print(f"Error writing to CSV file: {e}")
+        return None
+    finally:
+        if cursor is not None:
+            cursor.close()  # Ensure the cursor is closed
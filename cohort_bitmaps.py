@@ -0,0 +1,149 @@
+import json
+import time
+from collections import OrderedDict
+import numpy as np
+from json_to_sql import (COHORT_TABLE, ROW_KEYS, SEMI_JOIN_STRATEGY, CohortCompiler, get_select_columns, get_table_path,
+                         mark_filters, execute_query)
+from result_cache import database_fingerprint
+
+# The outer tables whose rows the bitsets can index, by their ROW_KEYS key
+BITMAP_LEVELS = ["patients", "admissions"]
+
+DEFAULT_MAX_BITSETS = 256  # Filter groups kept; a bitset over 300,000 patients takes 37 KB
+
+
+class CohortBitmapEngine:
+    """
+    Evaluates queries whose selection identifies each patient or admission row with bitsets
+    over a dense index of those rows. Each query node's own group of filters runs as one SQL
+    statement, and its result is kept as a packed bitset keyed by the group's JSON and the
+    database fingerprint. Nodes are then combined with NumPy's bitwise AND and OR, and only
+    the final projection goes back to SQLite, through the cohort table of CohortCompiler.
+    Changing one node of the canvas re-runs that node's filters only.
+
+    The filters of a group stay together because the filters of a group on the same table
+    must match the same row of it. Nodes combine like the semi_join strategy combines them
+    when the selection has unique rows, so results are the same rows.
+    """
+
+    def __init__(self, max_bitsets=DEFAULT_MAX_BITSETS):
+        self.max_bitsets = max_bitsets
+        self.fingerprint = None
+        self.indexes = {}  # (level, diagnosed_in) -> key columns, level keys in order, key rows
+        self.bitsets = OrderedDict()  # (level, diagnosed_in, group JSON) -> packed bitset, least recent first
+        self.evaluated_groups = 0
+        self.reused_groups = 0
+
+    def get_level(self, query_object):
+        """
+        Returns the outer table whose rows the query's bitsets index, or None when the
+        query has no filters, or its selection joins other tables or repeats rows.
+        """
+        query = query_object["query"]
+        if query_object.get("strategy", SEMI_JOIN_STRATEGY) != SEMI_JOIN_STRATEGY or not (query.get("filters") or query.get("subqueries")):
+            return None
+        compiler = CohortCompiler(query_object["select_tables"], get_select_columns(query_object),
+                                  query_object.get("diagnosed_in"))
+        for level in BITMAP_LEVELS:
+            if compiler.outer_tables == set(get_table_path(level, query_object.get("diagnosed_in"))):
+                return level if compiler.unique_rows else None
+        return None
+
+    def _index(self, connection, level, diagnosed_in):
+        """
+        Returns the key columns of the level's outer rows, the level's keys in order, and the
+        keys of every row in the same order.
+        """
+        if (level, diagnosed_in) not in self.indexes:
+            key_column = ROW_KEYS[level]
+            compiler = CohortCompiler([{"name": level, "columns": [key_column]}], f"{level}.{key_column}", diagnosed_in)
+            sql = ("SELECT " + ", ".join(f"{table_name}.{column}" for table_name, column in compiler.key_columns)
+                   + "\nFROM " + ", ".join(compiler.from_tables))
+            if compiler.join_conditions:
+                sql += "\nWHERE " + "\nAND ".join(compiler.join_conditions)
+            columns = [column for _, column in compiler.key_columns]
+            rows = np.array(connection.execute(sql).fetchall(), dtype=np.int64).reshape(-1, len(columns))
+            rows = rows[np.argsort(rows[:, columns.index(key_column)], kind="stable")]
+            self.indexes[(level, diagnosed_in)] = (columns, rows[:, columns.index(key_column)].copy(), rows)
+        return self.indexes[(level, diagnosed_in)]
+
+    def _group_bitset(self, connection, compiler, level, diagnosed_in, filters, operator):
+        cache_key = (level, diagnosed_in, json.dumps({"operator": operator, "filters": filters}, sort_keys=True))
+        if cache_key in self.bitsets:
+            self.bitsets.move_to_end(cache_key)
+            self.reused_groups += 1
+            return self.bitsets[cache_key]
+
+        _, level_keys, _ = self._index(connection, level, diagnosed_in)
+        sql, parameters = compiler.filter_group_sql(filters, operator, level)
+        keys = np.array([key for key, in connection.execute(sql, parameters)], dtype=np.int64)
+        mask = np.zeros(len(level_keys), dtype=bool)
+        mask[np.searchsorted(level_keys, keys)] = True
+        bitset = np.packbits(mask)
+        self.evaluated_groups += 1
+
+        self.bitsets[cache_key] = bitset
+        while len(self.bitsets) > self.max_bitsets:
+            self.bitsets.popitem(last=False)
+        return bitset
+
+    def _evaluate(self, connection, compiler, level, diagnosed_in, query):
+        """Returns the packed bitset of the rows a node keeps, or None when it keeps every row"""
+        operator = query.get("operator", "AND")
+        parts = []
+        if query.get("filters"):
+            parts.append(self._group_bitset(connection, compiler, level, diagnosed_in, query["filters"], operator))
+        parts.extend(self._evaluate(connection, compiler, level, diagnosed_in, subquery)
+                     for subquery in query.get("subqueries", []))
+        if operator == "OR" and any(part is None for part in parts):
+            return None
+        parts = [part for part in parts if part is not None]
+        if not parts:
+            return None
+        combine = np.bitwise_or if operator == "OR" else np.bitwise_and
+        return combine.reduce(parts) if len(parts) > 1 else parts[0]
+
+    def execute(self, connection, query_object):
+        """
+        Runs a query, with bitsets where get_level finds a level and with execute_query
+        otherwise.
+
+        Args:
+            connection (sqlite3.Connection): A connection to the database.
+            query_object (dict): The query, as for json_to_sql.
+
+        Returns:
+            sqlite3.Cursor: The cursor over the query's rows.
+        """
+        level = self.get_level(query_object)
+        if level is None:
+            return execute_query(connection, query_object)
+
+        # A rebuilt database invalidates every index and bitset
+        fingerprint = database_fingerprint(connection)
+        if fingerprint != self.fingerprint:
+            self.fingerprint = fingerprint
+            self.indexes.clear()
+            self.bitsets.clear()
+
+        start_time = time.perf_counter()
+        self.evaluated_groups = self.reused_groups = 0
+        diagnosed_in = query_object.get("diagnosed_in")
+        query = query_object["query"]
+        if query_object.get("encoded_columns") or query_object.get("epoch_columns"):
+            query = mark_filters(query, query_object.get("encoded_columns") or {}, query_object.get("epoch_columns") or {})
+        compiler = CohortCompiler(query_object["select_tables"], get_select_columns(query_object), diagnosed_in)
+        bitset = self._evaluate(connection, compiler, level, diagnosed_in, query)
+        columns, _, rows = self._index(connection, level, diagnosed_in)
+        if bitset is not None:
+            rows = rows[np.unpackbits(bitset, count=len(rows)).astype(bool)]
+        print(f"Evaluated {self.evaluated_groups} filter groups and reused {self.reused_groups} in "
+              f"{time.perf_counter() - start_time:.3f} s, {len(rows):,} {level} rows in the cohort")
+
+        connection.execute(f"DROP TABLE IF EXISTS temp.{COHORT_TABLE}")
+        connection.execute(compiler.cohort_table_sql())
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        connection.executemany(f"INSERT INTO {COHORT_TABLE} (part, {', '.join(columns)}) VALUES ({placeholders})",
+                               ((0, *row) for row in rows.tolist()))
+        connection.commit()
+        return connection.execute(compiler.projection_sql(0))
@@ -0,0 +1,268 @@
+import sqlite3
+import pandas as pd
+from table_schema import load_table_schemas
+from database_shards import get_schema_names
+
+# Text columns with few distinct values, stored as integer codes when a database is built
+# with dictionary_encoding. Each distinct value is stored once, in a lookup table.
+ENCODED_COLUMNS = {
+    "admissions": ["admission_type", "admission_location", "discharge_location", "insurance", "language",
+                   "marital_status", "race"],
+    "chartevents": ["valueuom"],
+    "emar": ["event_txt"],
+    "inputevents": ["amountuom", "rateuom", "ordercategoryname", "secondaryordercategoryname",
+                    "ordercomponenttypedescription", "ordercategorydescription", "totalamountuom",
+                    "statusdescription"],
+    "labevents": ["valueuom", "flag", "priority"],
+    "microbiologyevents": ["spec_type_desc", "test_name", "org_name", "ab_name", "interpretation"],
+    "outputevents": ["valueuom"],
+    "pharmacy": ["proc_type", "status", "route", "frequency", "infusion_type", "duration_interval",
+                 "expiration_unit"],
+    "poe": ["order_type", "order_subtype", "transaction_type", "order_status"],
+    "prescriptions": ["drug_type", "dose_unit_rx", "form_unit_disp", "route"],
+    "transfers": ["eventtype", "careunit"],
+}
+
+# An encoded table is stored under this prefix, and a view with the table's own name decodes
+# it, so queries, the column picker and the exports still see the original text columns.
+# Internal names start with an underscore so they stay out of the column picker.
+STORAGE_PREFIX = "_encoded_"
+REGISTRY_TABLE = "_encoded_columns"
+
+CREATE_REGISTRY_SQL = f"""
+CREATE TABLE IF NOT EXISTS {REGISTRY_TABLE} (
+    table_name TEXT,
+    column_name TEXT,
+    PRIMARY KEY (table_name, column_name)
+);
+"""
+
+
+def get_storage_name(table_name):
+    return f"{STORAGE_PREFIX}{table_name}"
+
+
+def get_values_table(table_name, column_name):
+    return f"_values_{table_name}_{column_name}"
+
+
+def get_code_column(column_name):
+    """
+    Returns the name the decoding view gives a column's integer codes, which equality
+    filters compare instead of the decoded text.
+    """
+    return f"_{column_name}_code"
+
+
+def get_encoded_columns(table_name, columns=None):
+    """
+    Returns the columns of a table that are encoded, out of the columns it is built with.
+    """
+    encoded_columns = ENCODED_COLUMNS.get(table_name, [])
+    if columns is not None:
+        encoded_columns = [column_name for column_name in encoded_columns if column_name in columns]
+    return encoded_columns
+
+
+def _table_exists(connection, name):
+    return connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def get_storage_table(connection, table_name):
+    """
+    Returns the table that holds a table's rows: its encoded table when it has one.
+    """
+    storage_name = get_storage_name(table_name)
+    return storage_name if _table_exists(connection, storage_name) else table_name
+
+
+def create_encoded_table(connection, table_name, columns=None):
+    """
+    Creates the encoded table of a table, with its encoded columns typed INTEGER, and one
+    lookup table per encoded column.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_name (str): A table in ENCODED_COLUMNS.
+        columns (tuple, optional): The columns a column profile keeps. Defaults to every
+            declared column.
+    """
+    encoded_columns = get_encoded_columns(table_name, columns)
+    column_lines = ",\n".join(
+        f"    {column_name} {'INTEGER' if column_name in encoded_columns else column_type}"
+        for column_name, column_type in load_table_schemas()[table_name]
+        if columns is None or column_name in columns
+    )
+    connection.execute(f"CREATE TABLE IF NOT EXISTS {get_storage_name(table_name)} (\n{column_lines}\n);")
+    connection.executescript(CREATE_REGISTRY_SQL)
+    for column_name in encoded_columns:
+        connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {get_values_table(table_name, column_name)} "
+            "(code INTEGER PRIMARY KEY, value TEXT UNIQUE)"
+        )
+        connection.execute(f"INSERT OR IGNORE INTO {REGISTRY_TABLE} (table_name, column_name) VALUES (?, ?)",
+                           (table_name, column_name))
+
+
+def drop_encoded_table(connection, table_name):
+    """
+    Drops the decoding view, the encoded table and the lookup tables of one table.
+    """
+    row = connection.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+    if row is not None and row[0] == "view":
+        connection.execute(f'DROP VIEW "{table_name}"')
+    connection.execute(f'DROP TABLE IF EXISTS "{get_storage_name(table_name)}"')
+    if not _table_exists(connection, REGISTRY_TABLE):
+        return
+    for (column_name,) in connection.execute(
+            f"SELECT column_name FROM {REGISTRY_TABLE} WHERE table_name = ?", (table_name,)).fetchall():
+        connection.execute(f'DROP TABLE IF EXISTS "{get_values_table(table_name, column_name)}"')
+    connection.execute(f"DELETE FROM {REGISTRY_TABLE} WHERE table_name = ?", (table_name,))
+
+
+def drop_encoded_tables(connection):
+    """
+    Drops every encoded table with its view and lookups, which drop_tables.sql does not know about.
+    """
+    if _table_exists(connection, REGISTRY_TABLE):
+        for (table_name,) in connection.execute(f"SELECT DISTINCT table_name FROM {REGISTRY_TABLE}").fetchall():
+            drop_encoded_table(connection, table_name)
+        connection.execute(f"DROP TABLE {REGISTRY_TABLE}")
+    connection.commit()
+
+
+def is_dictionary_encoded(connection):
+    """
+    Checks whether a database was built with dictionary encoding.
+    """
+    return _table_exists(connection, REGISTRY_TABLE) and connection.execute(
+        f"SELECT 1 FROM {REGISTRY_TABLE} LIMIT 1"
+    ).fetchone() is not None
+
+
+def load_value_codes(connection, table_name):
+    """
+    Reads the values each encoded column of a table already has codes for, so a resumed
+    load keeps giving every value the code it was first given.
+
+    Returns:
+        dict: Column name -> list of values, where a value's code is its position plus one.
+    """
+    value_codes = {}
+    for (column_name,) in connection.execute(
+            f"SELECT column_name FROM {REGISTRY_TABLE} WHERE table_name = ?", (table_name,)).fetchall():
+        value_codes[column_name] = [row[0] for row in connection.execute(
+            f"SELECT value FROM {get_values_table(table_name, column_name)} ORDER BY code")]
+    return value_codes
+
+
+def encode_chunk(chunk, value_codes):
+    """
+    Replaces the encoded columns of a parsed chunk with their integer codes, giving values
+    not seen before the next free codes in the order they appear. Runs in the parse workers.
+
+    Args:
+        chunk (pandas.DataFrame): A parsed chunk. Its encoded columns are replaced in place.
+        value_codes (dict): Column name -> values with codes so far, from load_value_codes.
+            New values are appended to it.
+
+    Returns:
+        dict: Column name -> (code, value) pairs first seen in this chunk.
+    """
+    new_values = {}
+    for column_name, values in value_codes.items():
+        if column_name not in chunk.columns:
+            continue
+        column = chunk[column_name]
+        known = set(values)
+        first_code = len(values) + 1
+        values.extend(value for value in column.dropna().unique().tolist() if value not in known)
+        if len(values) >= first_code:
+            new_values[column_name] = [(code, values[code - 1]) for code in range(first_code, len(values) + 1)]
+        # Missing values stay missing. Codes start at 1, so they arrive as float64 with NaN
+        # and the writer turns them back into ints like any other INTEGER column.
+        codes = pd.Categorical(column, categories=values).codes.astype("float64") + 1
+        codes[codes == 0] = float("nan")
+        chunk[column_name] = codes
+    return new_values
+
+
+def insert_new_values(connection, table_name, new_values):
+    """
+    Adds the values a batch introduced to the lookup tables, in the batch's transaction.
+    """
+    for column_name, pairs in new_values.items():
+        connection.executemany(
+            f"INSERT INTO {get_values_table(table_name, column_name)} (code, value) VALUES (?, ?)", pairs
+        )
+
+
+def create_decoding_views(connection):
+    """
+    Creates one view per encoded table under the table's own name. Each encoded column is
+    decoded by a lookup on its lookup table's primary key, which SQLite only runs for the
+    rows and columns a query returns, and its codes stay available as _<column>_code for
+    equality filters. The encoded table is read under its own name, so query plans say which
+    table a step scans. A LEFT JOIN per lookup table would decode slightly faster, but it
+    changes the join order SQLite picks for queries that never read the encoded columns.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+
+    Returns:
+        int: Number of views created.
+    """
+    if not _table_exists(connection, REGISTRY_TABLE):
+        return 0
+    views_created = 0
+    for (table_name,) in connection.execute(f"SELECT DISTINCT table_name FROM {REGISTRY_TABLE}").fetchall():
+        encoded_columns = [row[0] for row in connection.execute(
+            f"SELECT column_name FROM {REGISTRY_TABLE} WHERE table_name = ?", (table_name,))]
+        # The stored columns are read back rather than declared, since stay_id was renamed
+        stored_columns = [row[1] for row in connection.execute(
+            f'PRAGMA table_info("{get_storage_name(table_name)}")')]
+        storage_name = get_storage_name(table_name)
+        select_list = []
+        for column_name in stored_columns:
+            if column_name in encoded_columns:
+                select_list.append(f"(SELECT value FROM {get_values_table(table_name, column_name)} "
+                                   f"WHERE code = {storage_name}.{column_name}) AS {column_name}")
+            else:
+                select_list.append(f"{storage_name}.{column_name} AS {column_name}")
+        select_list.extend(f"{storage_name}.{column_name} AS {get_code_column(column_name)}"
+                           for column_name in encoded_columns)
+        connection.execute(f'DROP VIEW IF EXISTS "{table_name}"')
+        connection.execute(f"CREATE VIEW {table_name} AS SELECT {', '.join(select_list)} FROM {storage_name}")
+        views_created += 1
+    connection.commit()
+    return views_created
+
+
+def load_encoded_columns(connection):
+    """
+    Reads which columns are encoded in the main database and every attached shard.
+
+    Returns:
+        dict: Table name -> list of encoded column names. Empty for databases built without
+              dictionary encoding.
+    """
+    encoded_columns = {}
+    for schema in get_schema_names(connection):
+        try:
+            rows = connection.execute(f'SELECT table_name, column_name FROM "{schema}".{REGISTRY_TABLE}').fetchall()
+        except sqlite3.OperationalError:
+            continue
+        for table_name, column_name in rows:
+            encoded_columns.setdefault(table_name, []).append(column_name)
+    return encoded_columns
+
+
+def load_encoded_values(connection, table_name, column_name):
+    """
+    Reads the distinct values of an encoded column from its lookup table, in the order they
+    first appeared in the table, as a SELECT DISTINCT over the table returns them.
+    """
+    return [row[0] for row in connection.execute(
+        f"SELECT value FROM {get_values_table(table_name, column_name)} ORDER BY code")]
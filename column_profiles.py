@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import yaml
+from table_schema import load_table_schemas
+from omr_splitter import OMR_SPLIT_TABLES
+from json_to_sql import TABLE_RELATIONSHIPS
+
+# Declared next to config.yaml. Each profile lists the tables a build keeps, with either
+# "all" or the list of columns to keep for each one. Tables a profile leaves out are not built.
+COLUMN_PROFILES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "column_profiles.yaml")
+
+ALL_COLUMNS = "all"
+
+# Key columns kept in every table that declares them, because json_to_sql joins on them
+KEY_COLUMNS = {"subject_id", "hadm_id", "stay_id"}
+
+# Tables that are read whole after they are loaded: omr is split into the patient_* tables
+# and the d_items views select most of d_items
+WHOLE_TABLES = {"omr", "d_items"}
+
+# Records the profile a database was built with, so a resumed build never mixes two of them
+PROFILE_TABLE = "_build_profile"
+
+CREATE_PROFILE_SQL = f"""
+CREATE TABLE IF NOT EXISTS {PROFILE_TABLE} (
+    name TEXT,
+    definition TEXT
+);
+"""
+
+
+def _join_columns():
+    """
+    Returns table -> columns that TABLE_RELATIONSHIPS joins it on, besides the key columns.
+    """
+    join_columns = {}
+    for child_table, special_join in TABLE_RELATIONSHIPS["special_joins"].items():
+        parents = special_join.get("parents") or [special_join["parent"]]
+        for parent_table, (parent_column, child_column) in zip(parents, special_join["conditions"]):
+            join_columns.setdefault(parent_table, set()).add(parent_column)
+            join_columns.setdefault(child_table, set()).add(child_column)
+    return join_columns
+
+
+def load_column_profiles(profiles_path=COLUMN_PROFILES_PATH):
+    """
+    Reads every profile from column_profiles.yaml.
+
+    Returns:
+        dict: Profile name -> {"description": ..., "tables": {table: "all" or [columns]}}.
+    """
+    if not os.path.exists(profiles_path):
+        return {}
+    with open(profiles_path, "r") as file:
+        return yaml.safe_load(file) or {}
+
+
+def resolve_column_profile(profile_name, profiles_path=COLUMN_PROFILES_PATH):
+    """
+    Turns a profile into the columns each of its tables is built with. Join keys are always
+    kept, so every cohort query json_to_sql can build over the kept tables still runs.
+
+    Args:
+        profile_name (str): A profile from column_profiles.yaml, or None for the full build.
+        profiles_path (str): The profiles file.
+
+    Returns:
+        dict: Table name -> tuple of column names in declaration order, or None for the full build.
+
+    Raises:
+        ValueError: The profile does not exist or names a table or column create_tables.sql
+            does not declare.
+    """
+    if not profile_name:
+        return None
+    profiles = load_column_profiles(profiles_path)
+    if profile_name not in profiles:
+        raise ValueError(f"No column profile named {profile_name} in {profiles_path}")
+
+    schemas = load_table_schemas()
+    join_columns = _join_columns()
+    projection = {}
+    for table_name, kept_columns in (profiles[profile_name].get("tables") or {}).items():
+        if table_name not in schemas:
+            raise ValueError(f"Column profile {profile_name} names an unknown table: {table_name}")
+        declared = [column_name for column_name, _ in schemas[table_name]]
+        if kept_columns == ALL_COLUMNS or table_name in WHOLE_TABLES:
+            projection[table_name] = tuple(declared)
+            continue
+
+        unknown_columns = set(kept_columns) - set(declared)
+        if unknown_columns:
+            raise ValueError(f"Column profile {profile_name} names unknown columns of {table_name}: "
+                             f"{', '.join(sorted(unknown_columns))}")
+        keep = set(kept_columns) | KEY_COLUMNS | join_columns.get(table_name, set())
+        projection[table_name] = tuple(column_name for column_name in declared if column_name in keep)
+    return projection
+
+
+def get_profile_tables(projection):
+    """
+    Returns the tables a build with this projection creates, including the patient_* tables
+    that omr is split into.
+    """
+    table_names = list(projection)
+    if "omr" in projection:
+        table_names.extend(OMR_SPLIT_TABLES)
+    return table_names
+
+
+def get_projected_create_statement(table_name, columns):
+    """
+    Builds the CREATE TABLE statement of a table with only the given columns, in the layout
+    of create_tables.sql.
+    """
+    kept = set(columns)
+    column_lines = ",\n".join(f"    {column_name} {column_type}"
+                              for column_name, column_type in load_table_schemas()[table_name]
+                              if column_name in kept)
+    return f"CREATE TABLE IF NOT EXISTS {table_name} (\n{column_lines}\n);"
+
+
+def write_create_tables_script(projection, script_path):
+    """
+    Writes the create_tables.sql of a profile, for building or inspecting it outside the app.
+    """
+    with open(script_path, "w") as file:
+        for table_name, columns in projection.items():
+            file.write(get_projected_create_statement(table_name, columns) + "\n\n")
+
+
+def _definition(projection):
+    return json.dumps(projection and {table_name: list(columns) for table_name, columns in projection.items()},
+                      sort_keys=True)
+
+
+def record_column_profile(connection, profile_name, projection):
+    """
+    Stores the profile a build uses, replacing the one of any earlier build of the file.
+    """
+    connection.executescript(CREATE_PROFILE_SQL)
+    connection.execute(f"DELETE FROM {PROFILE_TABLE}")
+    connection.execute(f"INSERT INTO {PROFILE_TABLE} (name, definition) VALUES (?, ?)",
+                       (profile_name, _definition(projection)))
+    connection.commit()
+
+
+def built_with_profile(connection, projection):
+    """
+    Checks whether a database was built with the given projection. Databases built before
+    profiles existed count as full builds.
+    """
+    exists = connection.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (PROFILE_TABLE,)
+    ).fetchone()
+    row = connection.execute(f"SELECT definition FROM {PROFILE_TABLE}").fetchone() if exists else None
+    return (row[0] if row else _definition(None)) == _definition(projection)
+
+
+def print_profile_summary(profile_name, projection):
+    """
+    Prints how many of each table's declared columns a profile keeps.
+    """
+    schemas = load_table_schemas()
+    print(f"Column profile {profile_name}:")
+    for table_name, columns in projection.items():
+        print(f"  {table_name:<24} {len(columns):>3} of {len(schemas[table_name]):>3} columns")
+
+
+if __name__ == "__main__":
+    # column_profiles.py <profile> [output .sql] prints a profile and writes its create_tables.sql
+    if len(sys.argv) < 2:
+        print(f"Profiles in {COLUMN_PROFILES_PATH}: {', '.join(load_column_profiles()) or 'none'}")
+        sys.exit(0)
+    projection = resolve_column_profile(sys.argv[1])
+    print_profile_summary(sys.argv[1], projection)
+    if len(sys.argv) > 2:
+        write_create_tables_script(projection, sys.argv[2])
+        print(f"Wrote {sys.argv[2]}")
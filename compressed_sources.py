@@ -0,0 +1,241 @@
+import io
+import os
+import zlib
+import queue
+import threading
+
+try:
+    import zstandard
+except ImportError:  # zstd sources are optional; gzip works with the standard library
+    zstandard = None
+
+# Extensions a MIMIC source file may carry, mapped to their compression
+CSV_EXTENSIONS = {
+    ".csv": None,
+    ".csv.gz": "gzip",
+    ".csv.zst": "zstd",
+}
+
+DECOMPRESS_BLOCK_SIZE = 4 * 1024 * 1024  # Compressed bytes read per step
+DECOMPRESS_QUEUE_BLOCKS = 8  # Decompressed blocks buffered ahead of the parser
+ESTIMATE_SAMPLE_BYTES = 4 * 1024 * 1024  # Compressed bytes decompressed to estimate a file's ratio
+
+
+def split_csv_extension(file_name):
+    """
+    Splits a source file name into (stem, extension) for any supported CSV extension.
+    Returns (file_name, None) when the file is not a CSV source.
+    """
+    for extension in sorted(CSV_EXTENSIONS, key=len, reverse=True):
+        if file_name.endswith(extension):
+            return file_name[:-len(extension)], extension
+    return file_name, None
+
+
+def is_supported_source(file_name):
+    _, extension = split_csv_extension(file_name)
+    if extension is None:
+        return False
+    if CSV_EXTENSIONS[extension] == "zstd" and zstandard is None:
+        print(f"Skipping {file_name}: install the zstandard package to read .zst sources.")
+        return False
+    return True
+
+
+def _sample_decompressed_size(sample, compression):
+    """
+    Returns (compressed bytes used, decompressed bytes) for the start of a compressed file.
+    """
+    if compression == "gzip":
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        output_size = 0
+        data = sample
+        while data:
+            # max_length keeps memory flat however well the sample compresses
+            output_size += len(decompressor.decompress(data, DECOMPRESS_BLOCK_SIZE))
+            data = decompressor.unconsumed_tail
+            if decompressor.eof:
+                break
+        return len(sample) - len(decompressor.unused_data), output_size
+
+    decompressor = zstandard.ZstdDecompressor().decompressobj()
+    output_size = len(decompressor.decompress(sample))
+    return len(sample) - len(decompressor.unused_data), output_size
+
+
+def estimate_source_bytes(source_path):
+    """
+    Estimates how many CSV bytes a source holds once decompressed, which is what parsing it
+    costs. The ratio is measured on the start of the file rather than by decompressing it all.
+
+    Returns:
+        int: The file size for plain CSVs, otherwise the estimated decompressed size.
+    """
+    size = os.path.getsize(source_path)
+    _, extension = split_csv_extension(source_path)
+    compression = CSV_EXTENSIONS.get(extension)
+    if compression is None or size == 0 or (compression == "zstd" and zstandard is None):
+        return size
+
+    try:
+        with open(source_path, "rb") as file:
+            sample = file.read(ESTIMATE_SAMPLE_BYTES)
+        compressed_size, decompressed_size = _sample_decompressed_size(sample, compression)
+    except Exception:
+        # A sample that fails to decompress only costs the estimate; parsing reports the error
+        return size
+    if compressed_size <= 0 or decompressed_size <= 0:
+        return size
+    return int(size * decompressed_size / compressed_size)
+
+
+class PlainSource(io.FileIO):
+    """
+    An uncompressed CSV opened for the parser, reporting how far into the file it has read.
+    """
+
+    def bytes_consumed(self):
+        return self.tell()
+
+
+class ThreadedDecompressor(io.RawIOBase):
+    """
+    A read-only stream over a gzip or zstd file. A background thread reads and decompresses
+    the file into a bounded queue, so decompression overlaps with parsing and nothing is
+    ever written to disk. zlib and zstandard release the GIL while they work.
+    """
+
+    def __init__(self, source_path, compression, block_size=DECOMPRESS_BLOCK_SIZE,
+                 max_blocks=DECOMPRESS_QUEUE_BLOCKS):
+        super().__init__()
+        self._raw = open(source_path, "rb")
+        self._compression = compression
+        self._block_size = block_size
+        self._blocks = queue.Queue(maxsize=max_blocks)
+        self._pending = memoryview(b"")
+        self._finished = False
+        self._error = None
+        self._compressed_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._decompress, daemon=True)
+        self._thread.start()
+
+    def _read_compressed(self, size=None):
+        data = self._raw.read(size or self._block_size)
+        self._compressed_bytes += len(data)
+        return data
+
+    def _gzip_blocks(self):
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        while True:
+            data = self._read_compressed()
+            if not data:
+                break
+            while data:
+                block = decompressor.decompress(data)
+                if block:
+                    yield block
+                if decompressor.eof:
+                    # A gzip file may hold several members back to back
+                    data = decompressor.unused_data
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                else:
+                    data = b""
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+    def _zstd_blocks(self):
+        compressed_stream = io.BufferedReader(_CountingReader(self), self._block_size)
+        reader = zstandard.ZstdDecompressor().stream_reader(compressed_stream, read_across_frames=True)
+        while True:
+            block = reader.read(self._block_size)
+            if not block:
+                break
+            yield block
+
+    def _put(self, item):
+        # Waits for room in the queue but gives up once the reader has been closed
+        while not self._stop.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decompress(self):
+        try:
+            blocks = self._gzip_blocks() if self._compression == "gzip" else self._zstd_blocks()
+            for block in blocks:
+                if not self._put(block):
+                    return
+        except Exception as e:
+            self._error = e
+        self._put(None)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            if self._finished:
+                return 0
+            block = self._blocks.get()
+            if block is None:
+                self._finished = True
+                if self._error is not None:
+                    raise self._error
+                return 0
+            self._pending = memoryview(block)
+
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+    def bytes_consumed(self):
+        """
+        Compressed bytes read from disk so far.
+        """
+        return self._compressed_bytes
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._raw.close()
+        super().close()
+
+
+class _CountingReader(io.RawIOBase):
+    """
+    Feeds the compressed file to zstandard while counting bytes for ThreadedDecompressor.
+    """
+
+    def __init__(self, decompressor):
+        super().__init__()
+        self._decompressor = decompressor
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._decompressor._read_compressed(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def open_source(source_path):
+    """
+    Opens a CSV source for reading as bytes. Compressed sources are decompressed on the fly in
+    a background thread. The returned object's bytes_consumed() gives the number of on-disk
+    (compressed) bytes read so far.
+    """
+    _, extension = split_csv_extension(source_path)
+    compression = CSV_EXTENSIONS.get(extension)
+    if compression is None:
+        return PlainSource(source_path, "r")
+    if compression == "zstd" and zstandard is None:
+        raise RuntimeError(f"Install the zstandard package to read {source_path}")
+    return ThreadedDecompressor(source_path, compression)
@@ -1,23 +1,42 @@
 import os
 from PyQt5.QtWidgets import QPushButton, QFileDialog, QDialog, QLabel, QVBoxLayout, QProgressBar
-from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QThread, pyqtSignal
 from csv_to_database import create_database
+from planner_stats import DEFAULT_ANALYSIS_LIMIT
 
 class DatabaseCreationThread(QThread):
     task_done = pyqtSignal(str)  # Emit the path to the created database
     progress_updated = pyqtSignal(int)  # Emit progress updates
+    status_updated = pyqtSignal(str)  # Emit load rates and the ETA
+    swap_requested = pyqtSignal(str)  # Emit the database path once the new build is ready to replace it
 
-    def __init__(self, path_to_data):
+    def __init__(self, path_to_data, parquet_cache=False, sharded=False, column_profile=None,
+                 dictionary_encoding=False, epoch_columns=True, analysis_limit=DEFAULT_ANALYSIS_LIMIT):
         super().__init__()
         self.path_to_data = path_to_data
+        self.parquet_cache = parquet_cache
+        self.sharded = sharded
+        self.column_profile = column_profile
+        self.dictionary_encoding = dictionary_encoding
+        self.epoch_columns = epoch_columns
+        self.analysis_limit = analysis_limit
 
     def run(self):
-        db_path = create_database(self.path_to_data, self.progress_updated)  # Pass the progress signal
+        # The build goes to a file next to the database, and the window swaps it in once it
+        # has closed the old one, so it can keep querying the old database until then
+        db_path = create_database(self.path_to_data, self.progress_updated,  # Pass the progress signal
+                                  parquet_cache=self.parquet_cache, status_callback=self.status_updated,
+                                  sharded=self.sharded, column_profile=self.column_profile,
+                                  dictionary_encoding=self.dictionary_encoding,
+                                  epoch_columns=self.epoch_columns, analysis_limit=self.analysis_limit,
+                                  swap_callback=self.swap_requested.emit)
         self.task_done.emit(db_path)
 
 class DatabaseButton(QPushButton):
     # Signal to notify when the database is created and return its path
     database_created = pyqtSignal(str)  # Emit the path to the created database
+    # Signal asking the parent to close the old database and swap the new build in
+    swap_requested = pyqtSignal(str)
 
     def __init__(self, parent=None):
         super().__init__("Select Folder to Setup Database", parent)
@@ -33,7 +52,8 @@ class DatabaseButton(QPushButton):
         # Create a loading dialog
         self.loading_dialog = QDialog(self)
         self.loading_dialog.setWindowTitle("Creating Database")
-        self.loading_dialog.setModal(True)  # Make the dialog modal
+        # Not modal, so the current database can still be queried while the new one builds
+        self.loading_dialog.setModal(False)
 
         # Set up layout for the loading dialog
         layout = QVBoxLayout()
@@ -46,23 +66,52 @@ class DatabaseButton(QPushButton):
         self.progress_bar.setMaximum(100)
         layout.addWidget(self.progress_bar)
 
+        # Rows/s, MB/s and the time left while the CSVs load
+        self.status_label = QLabel("")
+        layout.addWidget(self.status_label)
+
         self.loading_dialog.setLayout(layout)
 
         # Start the database creation process in a separate thread
-        self.db_thread = DatabaseCreationThread(path_to_data)
+        # config.yaml can turn on the optional Parquet cache of the large event tables and
+        # the sharded build, which writes one file per MIMIC module, and pick a column profile
+        # from column_profiles.yaml to build only the tables and columns it lists. With
+        # dictionary_encoding, low-cardinality text columns are stored as integer codes, and
+        # epoch_columns adds the indexed epoch second columns that time filters compare.
+        # analysis_limit is the number of rows ANALYZE reads per index, 0 for all; null skips it.
+        config = getattr(self.parent, "config", {})
+        parquet_cache = bool(config.get("parquet_cache", False))
+        sharded = bool(config.get("sharded_build", False))
+        column_profile = config.get("column_profile") or None
+        dictionary_encoding = bool(config.get("dictionary_encoding", False))
+        epoch_columns = bool(config.get("epoch_columns", True))
+        analysis_limit = config.get("analysis_limit", DEFAULT_ANALYSIS_LIMIT)
+        self.db_thread = DatabaseCreationThread(path_to_data, parquet_cache, sharded, column_profile,
+                                                dictionary_encoding, epoch_columns, analysis_limit)
         self.db_thread.task_done.connect(self.on_database_created)  # Connect to the task_done signal
         self.db_thread.progress_updated.connect(self.update_progress)  # Connect to the progress_updated signal
+        self.db_thread.status_updated.connect(self.update_status)
+        # Blocks the build thread until the parent has swapped the new build in
+        self.db_thread.swap_requested.connect(self.on_swap_requested, Qt.BlockingQueuedConnection)
         self.db_thread.start()
 
-        # Show the loading dialog
-        self.loading_dialog.exec_()
+        # Show the loading dialog, and keep a second build from starting while this one runs
+        self.setEnabled(False)
+        self.loading_dialog.show()
 
     def update_progress(self, value):
         self.progress_bar.setValue(value)
 
+    def update_status(self, status):
+        self.status_label.setText(status)
+
+    def on_swap_requested(self, db_path):
+        self.swap_requested.emit(db_path)
+
     def on_database_created(self, db_path):
         # Close the loading dialog
         self.loading_dialog.accept()
+        self.setEnabled(True)
         # Notify the parent (MainWindow) that the database has been created and pass the path
         self.database_created.emit(db_path)
 
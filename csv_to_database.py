@@ -1,37 +1,71 @@
 import os
+import re
+import sys
+import time
+import queue
+import shutil
 import sqlite3
-import pandas as pd
+import tempfile
+import multiprocessing
+from contextlib import closing
 from typing import List
 from functools import cache
+from parallel_ingest import run_parallel_ingest, default_worker_count
+from compressed_sources import split_csv_extension, is_supported_source, estimate_source_bytes
+from build_manifest import BuildManifest, manifest_exists, INSERT_STAGE
+from table_schema import get_create_statement, CREATE_TABLES_PATH
+from omr_splitter import split_omr_rows, split_omr_table, clear_omr_split_tables
+from item_catalog import create_item_views, build_value_catalog, drop_item_views
+from index_builder import build_indexes, print_index_report
+from parquet_cache import build_parquet_cache
+from column_profiles import (resolve_column_profile, get_profile_tables, get_projected_create_statement,
+                             record_column_profile, built_with_profile, print_profile_summary)
+from column_encoding import (ENCODED_COLUMNS, create_encoded_table, drop_encoded_table, drop_encoded_tables,
+                             is_dictionary_encoded, load_value_codes, create_decoding_views, get_storage_table,
+                             get_storage_name)
+from time_columns import EPOCH_COLUMNS, add_epoch_columns, get_table_epoch_columns
+from planner_stats import DEFAULT_ANALYSIS_LIMIT, analyze_database
+from database_shards import (SHARD_TABLES, get_table_shard, get_shard_path, is_sharded, register_shards,
+                             forget_shards, open_database)
+from pragma_profiles import (begin_bulk_build, finish_bulk_build,
+                             BULK_BUILD_COMMIT_EVERY, DEFAULT_COMMIT_EVERY)
+from database_swap import (prepare_build_file, compact_database, swap_database, get_compacted_path,
+                           remove_database_file)
 
 @cache
 def get_file_name_from_path(csv_file_path: str) -> str:
     '''
     Gets the file name from the file's path by removing the path and extension
+    (including a .gz or .zst compression suffix)
     '''
     # Extract the file name from the full path
     file_name = os.path.basename(csv_file_path)
     
     # Remove the file extension
-    table_name, _ = os.path.splitext(file_name)
+    table_name, _ = split_csv_extension(file_name)
     
     return table_name
 
 @cache
 def get_csv_path_and_table_names(directory_to_search) -> List[tuple]:
     '''
-    Finds every csv file inside this directory and strips to its basename with no extension
+    Finds every csv file (plain, .csv.gz or .csv.zst) inside this directory and strips to its basename with no extension
     Returns a list of pairs of csv file name and the stripped name
     '''
     # Get current directory and find every csv file
     csv_files_paths = []
     for root, _, files in os.walk(directory_to_search):
         for file in files:
-            if file.endswith('.csv'):
+            if is_supported_source(file):
                 csv_files_paths.append(os.path.join(root, file))
 
+    # When a table exists both plain and compressed, read the plain file since it parses fastest
+    sources_by_table = {}
+    for csv_file_path in sorted(csv_files_paths, key=lambda path: path.endswith('.csv'), reverse=True):
+        sources_by_table.setdefault(get_file_name_from_path(csv_file_path), csv_file_path)
+
     # For every csv file strip the path and extension to get the table name
-    return [(csv_file_path, get_file_name_from_path(csv_file_path)) for csv_file_path in csv_files_paths]
+    return [(csv_file_path, table_name) for table_name, csv_file_path in sources_by_table.items()]
 
 def execute_script(connection, sql_script):
     """
@@ -64,6 +98,8 @@ def drop_all_tables(connection):
         with open(sql_file_path, 'r') as file:
             sql_script = file.read()
         print("Executing DROP TABLE script.")
+        drop_item_views(connection)
+        drop_encoded_tables(connection)
         execute_script(connection, sql_script)
         print("Tables dropped successfully.")
     except FileNotFoundError:
@@ -90,73 +126,637 @@ def create_all_tables(connection):
         print(f"Error: The file {sql_file_path} was not found.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
+
+
+def create_tables(connection, table_names, projection=None, encoded_tables=()):
+    """
+    Creates only the given tables, from their statements in create_tables.sql.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_names (list): The tables to create.
+        projection (dict, optional): Table name -> columns to create it with, from a column
+            profile. Tables not in it get every declared column.
+        encoded_tables (list): Tables to create dictionary-encoded (see create_encoded_tables).
+    """
+    for table_name in table_names:
+        if table_name in encoded_tables:
+            continue
+        if projection and table_name in projection:
+            create_statement = get_projected_create_statement(table_name, projection[table_name])
+        else:
+            create_statement = get_create_statement(table_name)
+        if create_statement is not None:
+            connection.execute(create_statement)
+    create_encoded_tables(connection, [table_name for table_name in table_names if table_name in encoded_tables],
+                          projection)
+    connection.commit()
+    print(f"Created {len(table_names)} tables.")
+
+
+def create_encoded_tables(connection, table_names, projection=None):
+    """
+    Creates the given tables dictionary-encoded: their low-cardinality text columns are stored
+    as integer codes in _encoded_<table>, with one lookup table per column. A view under the
+    table's own name decodes them once the rows are loaded (see decode_columns).
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_names (list): Tables in column_encoding.ENCODED_COLUMNS.
+        projection (dict, optional): The column profile the database is built with.
+    """
+    for table_name in table_names:
+        # create_tables.sql creates every table plainly; the empty plain table makes way for
+        # the view. A resumed build already has the view, which CREATE TABLE IF NOT EXISTS leaves.
+        row = connection.execute("SELECT type FROM sqlite_master WHERE name = ?", (table_name,)).fetchone()
+        if row is not None and row[0] == "table":
+            connection.execute(f'DROP TABLE "{table_name}"')
+        create_encoded_table(connection, table_name, (projection or {}).get(table_name))
+    connection.commit()
+
+
+def add_time_columns(connection, table_names, encoded_tables=()):
+    """
+    Adds the epoch second shadow columns of time_columns.EPOCH_COLUMNS to the given tables,
+    which the parse workers then fill as they load the rows. Tables loaded by an earlier build
+    without them have them filled from their timestamps.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_names (list): The tables of the build.
+        encoded_tables (list): The tables stored dictionary-encoded.
+    """
+    storage_tables = {table_name: get_storage_name(table_name) for table_name in encoded_tables}
+    columns_added = add_epoch_columns(connection, table_names, storage_tables)
+    if columns_added and encoded_tables:
+        # Decoding views made by an earlier build only show the new columns once recreated
+        create_decoding_views(connection)
+    print(f"Added {columns_added} epoch columns.")
+
+
+def recreate_table(connection, table_name, columns=None):
+    """
+    Drops one table and creates it again, empty, from its statement in create_tables.sql.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_name (str): The table to recreate.
+        columns (tuple, optional): Create it with only these columns, as a column profile does.
+    """
+    if columns is not None:
+        create_statement = get_projected_create_statement(table_name, columns)
+    else:
+        create_statement = get_create_statement(table_name)
+    if create_statement is None:
+        print(f"Error: No CREATE TABLE statement for {table_name} in {CREATE_TABLES_PATH}.")
+        return
+    connection.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+    connection.execute(create_statement)
+
+def reload_table(connection, table_name, projection=None, encoded_tables=(), epoch_columns=False):
+    """
+    Empties a table whose source changed, together with the tables filled from its rows
+    while it was inserted.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_name (str): The table to reload.
+        projection (dict, optional): The column profile the database is built with.
+        encoded_tables (list): The tables the database stores dictionary-encoded. Their
+            lookup tables are emptied too, so codes are given out again from 1.
+        epoch_columns (bool): Give the new table its epoch second shadow columns again.
+    """
+    if table_name in encoded_tables:
+        drop_encoded_table(connection, table_name)
+        create_encoded_table(connection, table_name, (projection or {}).get(table_name))
+    else:
+        recreate_table(connection, table_name, (projection or {}).get(table_name))
+    if epoch_columns:
+        add_epoch_columns(connection, [table_name], {table_name: get_storage_table(connection, table_name)})
+    if table_name == "omr":
+        clear_omr_split_tables(connection)
     
 
-def insert_all_data(connection, path_to_data, progress_callback=None):
+def insert_all_data(connection, path_to_data, progress_callback=None, workers=None,
+                    commit_every=DEFAULT_COMMIT_EVERY, manifest=None, status_callback=None,
+                    progress_log=None, tables=None, projection=None, encoded_tables=(), epoch_columns=False):
+    """
+    Loads every MIMIC CSV under path_to_data into its table. Files are parsed in parallel
+    worker processes while this connection stays the only writer.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        path_to_data (str): Directory that is searched for CSV files.
+        progress_callback (pyqtSignal, optional): Receives percent complete (0-100).
+        workers (int, optional): Number of parse processes. Defaults to one per spare core.
+        commit_every (int): Number of chunks written per transaction.
+        manifest (BuildManifest, optional): When given, tables that are already complete are
+            skipped, partly loaded ones resume after their last committed chunk and progress
+            is checkpointed with every commit.
+        status_callback (pyqtSignal, optional): Receives a status line with rows/s, MB/s and ETA.
+        progress_log (str, optional): JSON lines file the load's progress is appended to.
+        tables (list, optional): Load only these tables. Defaults to every MIMIC table.
+        projection (dict, optional): Table name -> the columns to load, from a column profile.
+        encoded_tables (list): Tables created dictionary-encoded by create_encoded_tables.
+        epoch_columns (bool): The database has epoch second shadow columns (see add_time_columns).
+    """
     csv_paths_and_table_names = get_csv_path_and_table_names(path_to_data)
     chunksize = 100000  # Size of each chunk
     
     work_set = set(['pyxis', 'vitalsign', 'medrecon', 'triage', 'edstays', 'diagnosis', 'poe_detail', 'provider', 'pharmacy', 'emar', 'microbiologyevents', 'labevents', 'admissions', 'd_labitems', 'prescriptions', 'procedures_icd', 'poe', 'd_hcpcs', 'omr', 'transfers', 'diagnoses_icd', 'services', 'hcpcsevents', 'drgcodes', 'patients', 'd_icd_diagnoses', 'd_icd_procedures', 'emar_detail', 'd_items', 'procedureevents', 'inputevents', 'datetimeevents', 'ingredientevents', 'chartevents', 'caregiver', 'outputevents', 'icustays', 'radiology', 'discharge'])
+    if tables is not None:
+        work_set &= set(tables)
     
-    total_files = len(work_set)
-    completed_files = 0
+    jobs = [(csv_file_path, table_name) for csv_file_path, table_name in csv_paths_and_table_names
+            if table_name in work_set]
     
-    for csv_file_path, table_name in csv_paths_and_table_names:
-        if table_name not in work_set:
-            continue
-        # Use pd.read_csv to read the CSV in chunks
-        for i, chunk in enumerate(pd.read_csv(csv_file_path, chunksize=chunksize, low_memory=False)):
-            # Insert each chunk into the corresponding table
-            chunk.to_sql(table_name, connection, if_exists="append", index=False)
-            print(f"{i} Inserted a chunk of data into {table_name} - rows complete: ({(i + 1) * chunksize})")
-            break
-        
-        completed_files += 1
-        if progress_callback:
-            progress = int((completed_files / total_files) * 100)
-            progress_callback.emit(progress)
-        
-        print(f"Inserted all data into {table_name}.")
+    if manifest:
+        jobs = manifest.plan_jobs(jobs, lambda table_name: reload_table(connection, table_name, projection,
+                                                                        encoded_tables, epoch_columns))
+    else:
+        jobs = [(csv_file_path, table_name, 0) for csv_file_path, table_name in jobs]
+    
+    # omr rows are routed to the patient_* tables batch by batch as they are inserted
+    batch_handlers = {"omr": split_omr_rows}
+    
+    # Codes continue from the ones a resumed table already gave out
+    table_encodings = {table_name: load_value_codes(connection, table_name)
+                       for _, table_name, _ in jobs if table_name in encoded_tables}
+    # The workers fill the shadow columns the tables were created with
+    table_epoch_columns = {table_name: get_table_epoch_columns(connection, table_name,
+                                                               get_storage_table(connection, table_name))
+                           for _, table_name, _ in jobs}
+    
+    run_parallel_ingest(connection, jobs, progress_callback, workers, chunksize,
+                        commit_every=commit_every, manifest=manifest, batch_handlers=batch_handlers,
+                        status_callback=status_callback, progress_log=progress_log,
+                        table_columns=projection, table_encodings=table_encodings,
+                        table_epoch_columns=table_epoch_columns)
+    
+    if manifest and not manifest.incomplete_tables():
+        manifest.mark_stage_complete(INSERT_STAGE)
+
+def run_stage(build_report, stage_name, stage_function, *args, **kwargs):
+    """
+    Runs one build stage and records how long it took in build_report.
+    """
+    start_time = time.perf_counter()
+    result = stage_function(*args, **kwargs)
+    build_report[stage_name] = time.perf_counter() - start_time
+    return result
+
+def print_build_report(build_report, title="Build report"):
+    """
+    Prints the time spent in each build stage.
+    """
+    print(f"{title}:")
+    for stage_name, seconds in build_report.items():
+        print(f"  {stage_name:<24} {seconds:10.2f} s")
+
+def create_database(path_to_data, progress_callback=None, workers=None, bulk_build=True,
+                    database_path=None, build_report=None, resume=True, parquet_cache=False,
+                    status_callback=None, sharded=False, shards=None, tables=None, column_profile=None,
+                    dictionary_encoding=False, epoch_columns=True, analysis_limit=DEFAULT_ANALYSIS_LIMIT,
+                    swap=True, swap_callback=None):
+    """
+    Builds the MIMIC database from every CSV found under path_to_data.
 
-def create_database(path_to_data, progress_callback=None):
-    database_path = os.path.join(path_to_data, "MIMIC_Database.db")
+    The build is written to a file next to database_path, compacted, and renamed over
+    database_path at the end (see database_swap), so the old database can be queried until
+    the new one replaces it.
+
+    Args:
+        path_to_data (str): Directory that is searched for CSV files.
+        progress_callback (pyqtSignal, optional): Receives percent complete (0-100).
+        workers (int, optional): Number of parse processes. Defaults to one per spare core.
+        bulk_build (bool): Load with the bulk build PRAGMA profile and switch the finished
+            file to WAL with durable settings afterwards.
+        database_path (str, optional): Where to write the database. Defaults to
+            MIMIC_Database.db inside path_to_data.
+        build_report (dict, optional): Filled with the seconds spent in each stage.
+        resume (bool): Continue from the build manifest of an earlier build of this file,
+            redoing only unfinished or changed tables and the stages after them. When False,
+            or when the file has no manifest, every table is dropped and rebuilt.
+        parquet_cache (bool): Also write the large event tables to a Parquet cache next to
+            the database, which the canvas reads instead of SQLite when it can. Needs pyarrow.
+        status_callback (pyqtSignal, optional): Receives a status line with rows/s, MB/s and
+            ETA while the CSVs load. Every batch is also logged to <database>_ingest_log.jsonl.
+        sharded (bool): Write each MIMIC module into its own file, built in parallel
+            processes (see create_sharded_database).
+        shards (list, optional): With sharded, the modules to build, such as ["ed"]. The
+            shards of the other modules are left as they are. Defaults to every module.
+        tables (list, optional): Build only these tables into the file. Used for shards.
+        column_profile (str, optional): A profile from column_profiles.yaml. Only its tables
+            and columns are created and read from the CSVs. Defaults to the full build.
+        dictionary_encoding (bool): Store the low-cardinality text columns listed in
+            column_encoding.ENCODED_COLUMNS as integer codes with lookup tables, behind views
+            that decode them. Queries and the column picker see the same columns either way.
+        epoch_columns (bool): Give the timestamps in time_columns.EPOCH_COLUMNS an indexed
+            shadow column of epoch seconds, which time window filters compare as integers.
+        analysis_limit (int, optional): Rows ANALYZE reads from each index once the indexes
+            are built, so the query planner has statistics to order joins by. 0, the default,
+            reads every row. None leaves the database unanalyzed.
+        swap (bool): Replace database_path with the finished build. When False the build
+            waits next to it until swap_database is called.
+        swap_callback (callable, optional): Called with database_path instead of
+            swap_database, so the app can close its connection to the old file, swap the
+            new one in and reopen it.
+
+    Returns:
+        str: The path to the created database.
+    """
+    if database_path is None:
+        database_path = os.path.join(path_to_data, "MIMIC_Database.db")
+    if build_report is None:
+        build_report = {}
+    if sharded:
+        return create_sharded_database(path_to_data, progress_callback, workers, bulk_build, database_path,
+                                       build_report, resume, parquet_cache, status_callback, shards,
+                                       column_profile, dictionary_encoding, epoch_columns, analysis_limit, swap,
+                                       swap_callback)
+    projection = resolve_column_profile(column_profile)
+    if projection is not None:
+        print_profile_summary(column_profile, projection)
+        profile_tables = get_profile_tables(projection)
+        tables = [table_name for table_name in (tables or profile_tables) if table_name in profile_tables]
+    encoded_tables = [table_name for table_name in ENCODED_COLUMNS if tables is None or table_name in tables]
+    if not dictionary_encoding:
+        encoded_tables = []
+    commit_every = BULK_BUILD_COMMIT_EVERY if bulk_build else DEFAULT_COMMIT_EVERY
+    build_start = time.perf_counter()
+    build_path = prepare_build_file(database_path, resume)
     
-    with sqlite3.connect(database_path) as connection:
-        drop_all_tables(connection)
-        create_all_tables(connection)
-        insert_all_data(connection, path_to_data, progress_callback)
-        split_omr(connection)
-        rename_stay_id_columns(connection)
-        split_d_items(connection)
+    with sqlite3.connect(build_path) as connection:
+        resuming = resume and manifest_exists(connection)
+        if resuming and not built_with_profile(connection, projection):
+            print(f"{database_path} was built with a different column profile, rebuilding it.")
+            resuming = False
+        if resuming and is_dictionary_encoded(connection) != bool(encoded_tables):
+            print(f"{database_path} was built with a different dictionary encoding setting, rebuilding it.")
+            resuming = False
+        if resuming:
+            print(f"Resuming the build recorded in {database_path}")
+        else:
+            run_stage(build_report, "drop_tables", drop_all_tables, connection)
+            forget_shards(connection)
+        if bulk_build:
+            run_stage(build_report, "bulk_profile", begin_bulk_build, connection, not resuming)
         
-        print("All tables processed successfully!")
+        manifest = BuildManifest(connection)
+        if not resuming:
+            manifest.reset()
+            record_column_profile(connection, column_profile, projection)
+        
+        if tables is None:
+            run_stage(build_report, "create_tables", create_all_tables, connection)
+            if encoded_tables:
+                run_stage(build_report, "create_encoded_tables", create_encoded_tables, connection, encoded_tables)
+        else:
+            run_stage(build_report, "create_tables", create_tables, connection, tables, projection, encoded_tables)
+        if epoch_columns:
+            run_stage(build_report, "epoch_columns", add_time_columns, connection,
+                      list(EPOCH_COLUMNS) if tables is None else tables, encoded_tables)
+        progress_log = os.path.splitext(database_path)[0] + "_ingest_log.jsonl"
+        run_stage(build_report, INSERT_STAGE, insert_all_data, connection, path_to_data,
+                  progress_callback, workers, commit_every, manifest, status_callback, progress_log,
+                  tables, projection, encoded_tables, epoch_columns)
+        
+        # omr was split into the patient_* tables while it was inserted
+        post_insert_stages = [("rename", rename_stay_id_columns)]
+        if encoded_tables:
+            post_insert_stages.append(("decode_views", decode_columns))
+        if tables is None or "d_items" in tables:
+            post_insert_stages.append(("split_d_items", split_d_items))
+        post_insert_stages.append(("build_indexes", create_indexes))
+        if analysis_limit is not None:
+            post_insert_stages.append(("analyze", lambda connection: analyze_database(connection, analysis_limit)))
+        if parquet_cache:
+            post_insert_stages.append(
+                ("parquet_cache", lambda connection: build_parquet_cache(connection, database_path))
+            )
+        for stage_name, stage_function in post_insert_stages:
+            if manifest.is_stage_complete(stage_name):
+                print(f"Skipping {stage_name}: already completed.")
+                continue
+            run_stage(build_report, stage_name, stage_function, connection)
+            manifest.mark_stage_complete(stage_name)
+        
+        if bulk_build:
+            run_stage(build_report, "durable_profile", finish_bulk_build, connection)
+        # Last, so a crash before it leaves the build file to resume from
+        run_stage(build_report, "compact", compact_database, connection, get_compacted_path(database_path))
+    connection.close()
+    remove_database_file(build_path)
+    if swap:
+        run_stage(build_report, "swap", swap_callback or swap_database, database_path)
+    build_report["total"] = time.perf_counter() - build_start
+    
+    print("All tables processed successfully!")
+    if swap:
         print(f"Database made at {database_path}")
-        print(f"Data taken from {path_to_data}")
+    else:
+        print(f"Database made at {get_compacted_path(database_path)}, waiting to replace {database_path}")
+    print(f"Data taken from {path_to_data}")
+    print_build_report(build_report)
     
     return database_path
 
+class ShardSignal:
+    """
+    Stands in for a pyqtSignal inside a shard build process and forwards every value it is
+    given to the parent process.
+    """
+
+    def __init__(self, messages, shard, kind):
+        self.messages = messages
+        self.shard = shard
+        self.kind = kind
+
+    def emit(self, value):
+        self.messages.put((self.shard, self.kind, value))
+
+def build_shard(path_to_data, shard, shard_path, workers, bulk_build, resume, messages, column_profile=None,
+                dictionary_encoding=False, epoch_columns=True, analysis_limit=DEFAULT_ANALYSIS_LIMIT):
+    """
+    Builds one shard in its own process. Runs in a child of create_sharded_database, which
+    swaps the finished shards in together.
+    """
+    try:
+        shard_report = {}
+        create_database(path_to_data, ShardSignal(messages, shard, "progress"), workers, bulk_build,
+                        shard_path, shard_report, resume, status_callback=ShardSignal(messages, shard, "status"),
+                        tables=SHARD_TABLES[shard], column_profile=column_profile,
+                        dictionary_encoding=dictionary_encoding, epoch_columns=epoch_columns,
+                        analysis_limit=analysis_limit, swap=False)
+        messages.put((shard, "done", shard_report))
+    except Exception as e:
+        messages.put((shard, "failed", f"{type(e).__name__}: {e}"))
+
+def create_sharded_database(path_to_data, progress_callback=None, workers=None, bulk_build=True,
+                            database_path=None, build_report=None, resume=True, parquet_cache=False,
+                            status_callback=None, shards=None, column_profile=None, dictionary_encoding=False,
+                            epoch_columns=True, analysis_limit=DEFAULT_ANALYSIS_LIMIT, swap=True,
+                            swap_callback=None):
+    """
+    Builds each MIMIC module (hosp, icu, ed, note) into its own SQLite file, with one process
+    per module. Every shard has its own writer, so the modules load and index side by side
+    instead of queueing behind a single connection. The parse workers are split between the
+    shards by the size of their sources.
+
+    database_path itself only records the shard files; database_shards.open_database
+    ATTACHes them, so queries see one schema. Rebuilding one module only rewrites its shard.
+
+    Args:
+        path_to_data (str): Directory that is searched for CSV files.
+        progress_callback (pyqtSignal, optional): Receives percent complete (0-100) over all shards.
+        workers (int, optional): Total number of parse processes. Defaults to one per spare core.
+        bulk_build (bool): Build every shard with the bulk build PRAGMA profile.
+        database_path (str, optional): The main database file. Defaults to MIMIC_Database.db
+            inside path_to_data; shards are written next to it as MIMIC_Database_<shard>.db.
+        build_report (dict, optional): Filled with the seconds each shard and stage took.
+        resume (bool): Let every shard continue from its own build manifest.
+        parquet_cache (bool): Write the Parquet cache once the shards are built.
+        status_callback (pyqtSignal, optional): Receives one status line per shard.
+        shards (list, optional): The shards to build. Defaults to every shard with sources.
+        column_profile (str, optional): The column profile every shard is built with. Shards
+            holding none of its tables are not built.
+        dictionary_encoding (bool): Build every shard with dictionary encoding.
+        epoch_columns (bool): Give every shard's timestamps their epoch second shadow columns.
+        analysis_limit (int, optional): The ANALYZE sampling limit of every shard.
+        swap (bool): Replace the shard files with the finished builds once every shard is
+            done. When False they wait for swap_database.
+        swap_callback (callable, optional): Called with database_path instead of swap_database.
+
+    Returns:
+        str: The path to the main database file.
+    """
+    if database_path is None:
+        database_path = os.path.join(path_to_data, "MIMIC_Database.db")
+    if build_report is None:
+        build_report = {}
+    build_start = time.perf_counter()
+
+    projection = resolve_column_profile(column_profile)
+    sources_by_shard = {}
+    for csv_file_path, table_name in get_csv_path_and_table_names(path_to_data):
+        if projection is not None and table_name not in projection:
+            continue
+        sources_by_shard.setdefault(get_table_shard(table_name), []).append(csv_file_path)
+    shards = [shard for shard in (shards or SHARD_TABLES) if shard in sources_by_shard]
+    if not shards:
+        print(f"No sources for the requested shards under {path_to_data}")
+        return database_path
+
+    # Tables in the main file would shadow the shards, so a single-file build there is replaced
+    # by a new main file, swapped in with the shards
+    replace_main_file = False
+    if os.path.exists(database_path):
+        with closing(sqlite3.connect(database_path)) as connection:
+            replace_main_file = not is_sharded(connection)
+        if replace_main_file:
+            print(f"Replacing the single-file database at {database_path} with a sharded one.")
+
+    # Parse workers are shared out by the amount of data each shard has to load
+    weights = {shard: max(1, sum(estimate_source_bytes(path) for path in sources_by_shard[shard]))
+               for shard in shards}
+    total_weight = sum(weights.values())
+    total_workers = workers or default_worker_count()
+    shard_workers = {shard: max(1, round(total_workers * weights[shard] / total_weight)) for shard in shards}
+
+    # Spawn rather than fork so the shard builds never inherit Qt's threads
+    context = multiprocessing.get_context("spawn")
+    messages = context.Queue()
+    processes = {}
+    for shard in shards:
+        shard_path = get_shard_path(database_path, shard)
+        print(f"Building shard {shard} into {shard_path} with {shard_workers[shard]} parse workers.")
+        processes[shard] = context.Process(
+            target=build_shard, name=f"build-{shard}",
+            args=(path_to_data, shard, shard_path, shard_workers[shard], bulk_build, resume, messages,
+                  column_profile, dictionary_encoding, epoch_columns, analysis_limit)
+        )
+        processes[shard].start()
+
+    percents = {shard: 0 for shard in shards}
+    statuses = {}
+    failed_shards = []
+    running = set(shards)
+    last_percent = None
+    while running:
+        try:
+            shard, kind, value = messages.get(timeout=1)
+        except queue.Empty:
+            # A shard process that died without reporting would otherwise leave us waiting forever
+            for shard in list(running):
+                if not processes[shard].is_alive():
+                    print(f"Shard {shard} exited without finishing.")
+                    failed_shards.append(shard)
+                    running.discard(shard)
+            continue
+
+        if kind == "progress":
+            percents[shard] = value
+            percent = int(sum(weights[name] * percents[name] for name in shards) / total_weight)
+            if progress_callback and percent != last_percent:
+                progress_callback.emit(percent)
+            last_percent = percent
+        elif kind == "status":
+            statuses[shard] = value
+            if status_callback:
+                status_callback.emit("\n".join(f"{name}: {statuses[name]}" for name in shards if name in statuses))
+        elif kind == "done":
+            running.discard(shard)
+            build_report[f"shard_{shard}"] = value.get("total", 0.0)
+            print(f"Shard {shard} built in {value.get('total', 0.0):.2f} s")
+        else:
+            running.discard(shard)
+            failed_shards.append(shard)
+            print(f"Error building shard {shard}: {value}")
+
+    for process in processes.values():
+        process.join()
+
+    # Every shard file next to the main file is attached, including ones from earlier builds
+    # and ones waiting to be swapped in
+    shard_paths = {shard: get_shard_path(database_path, shard) for shard in SHARD_TABLES}
+    built_shards = [shard for shard, shard_path in shard_paths.items()
+                    if os.path.exists(shard_path) or os.path.exists(get_compacted_path(shard_path))]
+    if projection is not None:
+        # Shards left over from a build with more tables are not part of this profile
+        profile_shards = {get_table_shard(table_name) for table_name in projection}
+        built_shards = [shard for shard in built_shards if shard in profile_shards]
+    if replace_main_file:
+        remove_database_file(get_compacted_path(database_path))
+        register_shards(database_path, built_shards, get_compacted_path(database_path))
+    else:
+        register_shards(database_path, built_shards)
+    if swap:
+        run_stage(build_report, "swap", swap_callback or swap_database, database_path)
+
+    # The cache is read from the shards in place, so it waits for them to be swapped in
+    if parquet_cache and swap:
+        with closing(open_database(database_path)) as connection:
+            run_stage(build_report, "parquet_cache", build_parquet_cache, connection, database_path)
+    elif parquet_cache:
+        print("Skipping the Parquet cache until the new shards are swapped in.")
+
+    build_report["total"] = time.perf_counter() - build_start
+    if failed_shards:
+        print(f"Shards that failed to build: {', '.join(failed_shards)}")
+    print(f"Sharded database made at {database_path} ({', '.join(built_shards)})")
+    print_build_report(build_report)
+    return database_path
+
+def compare_build_profiles(path_to_data, workers=None):
+    """
+    Builds the database twice into a scratch directory, once with the default PRAGMAs and one
+    transaction per chunk and once with the bulk build profile, then prints both stage timings
+    side by side.
+
+    Args:
+        path_to_data (str): Directory that is searched for CSV files.
+        workers (int, optional): Number of parse processes. Defaults to one per spare core.
+
+    Returns:
+        dict: The build report of each profile.
+    """
+    reports = {"default": {}, "bulk": {}}
+    scratch_directory = tempfile.mkdtemp(prefix="mimic_profile_")
+    try:
+        for profile_name, report in reports.items():
+            database_path = os.path.join(scratch_directory, f"{profile_name}.db")
+            create_database(path_to_data, workers=workers, bulk_build=profile_name == "bulk",
+                            database_path=database_path, build_report=report, resume=False)
+            report["file_size_mb"] = os.path.getsize(database_path) / (1024 * 1024)
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    print(f"{'stage':<24} {'default':>12} {'bulk':>12} {'speedup':>9}")
+    for stage_name in dict.fromkeys([*reports["default"], *reports["bulk"]]):
+        default_value = reports["default"].get(stage_name, 0.0)
+        bulk_value = reports["bulk"].get(stage_name, 0.0)
+        speedup = f"{default_value / bulk_value:8.2f}x" if bulk_value and stage_name != "file_size_mb" else ""
+        print(f"{stage_name:<24} {default_value:12.2f} {bulk_value:12.2f} {speedup:>9}")
+    
+    return reports
+
+def _table_sizes_mb(database_path):
+    """
+    Returns table name -> MB on disk with its indexes, or {} when SQLite lacks dbstat.
+    """
+    with closing(sqlite3.connect(database_path)) as connection:
+        try:
+            rows = connection.execute(
+                "SELECT COALESCE(m.tbl_name, s.name), SUM(s.pgsize) FROM dbstat s "
+                "LEFT JOIN sqlite_master m ON m.name = s.name GROUP BY 1"
+            ).fetchall()
+        except sqlite3.OperationalError:
+            return {}
+    return {table_name: size / (1024 * 1024) for table_name, size in rows}
+
+def compare_column_profile(path_to_data, column_profile, workers=None):
+    """
+    Builds the database twice into a scratch directory, once in full and once with a column
+    profile, then prints the disk and build time the profile saves, overall and per table.
+
+    Args:
+        path_to_data (str): Directory that is searched for CSV files.
+        column_profile (str): A profile from column_profiles.yaml.
+        workers (int, optional): Number of parse processes. Defaults to one per spare core.
+
+    Returns:
+        dict: The build report of each build, with the file size and per-table sizes.
+    """
+    reports = {"full": {}, column_profile: {}}
+    table_sizes = {}
+    scratch_directory = tempfile.mkdtemp(prefix="mimic_columns_")
+    try:
+        for profile_name, report in reports.items():
+            database_path = os.path.join(scratch_directory, "full.db" if profile_name == "full" else "profile.db")
+            create_database(path_to_data, workers=workers, database_path=database_path, build_report=report,
+                            resume=False, column_profile=None if profile_name == "full" else column_profile)
+            report["file_size_mb"] = os.path.getsize(database_path) / (1024 * 1024)
+            table_sizes[profile_name] = _table_sizes_mb(database_path)
+    finally:
+        shutil.rmtree(scratch_directory, ignore_errors=True)
+
+    full_report, profile_report = reports["full"], reports[column_profile]
+    print(f"{'stage':<24} {'full':>12} {column_profile:>12} {'saved':>9}")
+    for stage_name in dict.fromkeys([*full_report, *profile_report]):
+        full_value = full_report.get(stage_name, 0.0)
+        profile_value = profile_report.get(stage_name, 0.0)
+        saved = f"{1 - profile_value / full_value:8.1%}" if full_value >= 0.05 else ""
+        print(f"{stage_name:<24} {full_value:12.2f} {profile_value:12.2f} {saved:>9}")
+
+    if table_sizes["full"]:
+        print(f"{'table (MB)':<24} {'full':>12} {column_profile:>12} {'saved':>9}")
+        for table_name, full_size in sorted(table_sizes["full"].items(), key=lambda item: -item[1]):
+            profile_size = table_sizes[column_profile].get(table_name, 0.0)
+            if full_size >= 0.1:
+                print(f"{table_name:<24} {full_size:12.2f} {profile_size:12.2f} {1 - profile_size / full_size:8.1%}")
+    reports["table_sizes_mb"] = table_sizes
+    return reports
+
 def split_omr(connection):
     """
-    Reads the SQL commands from split_omr.sql and executes them to split the OMR table data into separate tables.
+    Splits the OMR table data into the separate patient_* tables. create_database does this
+    batch by batch while omr is inserted, so this is only needed for an omr table that was
+    loaded some other way.
 
     Args:
         connection (sqlite3.Connection): A connection to the SQLite database.
     """
-    sql_file_path = "./sql_scripts/split_omr.sql"
     try:
-        with open(sql_file_path, 'r') as file:
-            sql_script = file.read()
-        print("Executing SPLIT OMR script.")
-        execute_script(connection, sql_script)
+        print("Splitting OMR table.")
+        split_omr_table(connection)
         print("OMR table split successfully.")
-    except FileNotFoundError:
-        print(f"Error: The file {sql_file_path} was not found.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
 
 def rename_stay_id_columns(connection):
     """
     Reads the SQL commands from rename_stay_id.sql and executes them to rename stay_id columns.
+    Tables whose stay_id was already renamed by an earlier run are left alone.
 
     Args:
         connection (sqlite3.Connection): A connection to the SQLite database.
@@ -166,7 +766,16 @@ def rename_stay_id_columns(connection):
         with open(sql_file_path, 'r') as file:
             sql_script = file.read()
         print("Executing RENAME STAY_ID script.")
-        execute_script(connection, sql_script)
+        for table_name, old_column, new_column in re.findall(
+                r"ALTER TABLE (\w+) RENAME COLUMN (\w+) TO (\w+);", sql_script):
+            # Encoded tables are renamed in storage; decode_columns recreates their views afterwards
+            storage_table = get_storage_table(connection, table_name)
+            columns = [row[1] for row in connection.execute(f'PRAGMA table_info("{storage_table}")')]
+            if old_column in columns:
+                if storage_table != table_name:
+                    connection.execute(f'DROP VIEW IF EXISTS "{table_name}"')
+                connection.execute(f'ALTER TABLE "{storage_table}" RENAME COLUMN "{old_column}" TO "{new_column}"')
+        connection.commit()
         print("Stay ID columns renamed successfully.")
     except FileNotFoundError:
         print(f"Error: The file {sql_file_path} was not found.")
@@ -175,23 +784,48 @@ def rename_stay_id_columns(connection):
       
 def split_d_items(connection):
     """
-    Reads the SQL commands from split_d_items.sql and executes them to split the d_items table data into separate tables.
+    Creates the per-linksto views of d_items and the catalog of their filter values,
+    reading d_items once.
 
     Args:
         connection (sqlite3.Connection): A connection to the SQLite database.
     """
-    sql_file_path = "./sql_scripts/split_d_items.sql"
     try:
-        with open(sql_file_path, 'r') as file:
-            sql_script = file.read()
-        print("Executing SPLIT D_ITEMS script.")
-        execute_script(connection, sql_script)
-        print("D_ITEMS table split successfully.")
-    except FileNotFoundError:
-        print(f"Error: The file {sql_file_path} was not found.")
+        print("Creating D_ITEMS views.")
+        create_item_views(connection)
+        catalog_entries = build_value_catalog(connection)
+        print(f"D_ITEMS views created, {catalog_entries} filter values catalogued.")
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
     
+
+def decode_columns(connection):
+    """
+    Creates the views that decode the dictionary-encoded tables under their own names.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+    """
+    try:
+        print("Creating decoding views.")
+        views_created = create_decoding_views(connection)
+        print(f"{views_created} decoding views created.")
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+    
+
+def create_indexes(connection):
+    """
+    Builds the join and range filter indexes derived from json_to_sql.TABLE_RELATIONSHIPS
+    and prints the time and size of each one.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+    """
+    print("Building indexes.")
+    index_report = build_indexes(connection)
+    print_index_report(index_report)
+    return index_report
       
 def main():
     database_path = "./MINI_MIMIC_Database.db"
@@ -203,16 +837,33 @@ def main():
             create_all_tables(connection)
         if 1:
             insert_all_data(connection, os.getcwd())
-        if 1:
+        if 0:  # insert_all_data already splits omr as it loads it
             split_omr(connection)
         if 1:
             rename_stay_id_columns(connection)
         if 1:
             split_d_items(connection)
+        if 1:
+            create_indexes(connection)
+        if 1:
+            analyze_database(connection)
             
         print("All tables processed successfully!")
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) == 3 and sys.argv[1] == "--compare-profiles":
+        compare_build_profiles(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == "--compare-column-profile":
+        # --compare-column-profile <data directory> <profile> reports what the profile saves
+        compare_column_profile(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) == 4 and sys.argv[1] == "--column-profile":
+        create_database(sys.argv[2], column_profile=sys.argv[3])
+    elif len(sys.argv) == 3 and sys.argv[1] == "--dictionary-encoding":
+        create_database(sys.argv[2], dictionary_encoding=True, resume=False)
+    elif len(sys.argv) >= 3 and sys.argv[1] == "--sharded":
+        # --sharded <data directory> [shard ...] rebuilds only the listed shards, all by default
+        create_database(sys.argv[2], sharded=True, shards=sys.argv[3:] or None, resume=False)
+    else:
+        main()
 
 
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+from omr_splitter import OMR_SPLIT_TABLES
+
+# Tables of each MIMIC-IV module. A sharded build writes every module into its own file,
+# MIMIC_Database_<shard>.db, and the tables derived while building (the patient_* tables from
+# omr, the d_items views) live in the shard of the table they come from.
+SHARD_TABLES = {
+    "hosp": [
+        "admissions", "d_hcpcs", "d_icd_diagnoses", "d_icd_procedures", "d_labitems", "diagnoses_icd",
+        "drgcodes", "emar_detail", "emar", "hcpcsevents", "labevents", "microbiologyevents", "omr",
+        "patients", "pharmacy", "poe_detail", "poe", "prescriptions", "procedures_icd", "provider",
+        "services", "transfers", *OMR_SPLIT_TABLES,
+    ],
+    "icu": [
+        "caregiver", "chartevents", "d_items", "datetimeevents", "icustays", "ingredientevents",
+        "inputevents", "outputevents", "procedureevents",
+    ],
+    "ed": ["diagnosis", "edstays", "medrecon", "pyxis", "triage", "vitalsign"],
+    "note": ["discharge", "radiology"],
+}
+
+# Tables that are not part of any module go with the core hospital tables
+DEFAULT_SHARD = "hosp"
+
+# Prepared statements sqlite3 keeps per connection, keyed by their SQL. json_to_sql binds filter
+# values as parameters, so each query shape built on the canvas is prepared once and reused
+# however its values change.
+STATEMENT_CACHE_SIZE = 256
+
+# Kept in the main database file of a sharded build, which holds no MIMIC tables itself
+CREATE_SHARDS_SQL = """
+CREATE TABLE IF NOT EXISTS _shards (
+    shard TEXT PRIMARY KEY,
+    file_name TEXT
+);
+"""
+
+
+def get_table_shard(table_name):
+    for shard, table_names in SHARD_TABLES.items():
+        if table_name in table_names:
+            return shard
+    return DEFAULT_SHARD
+
+
+def get_shard_path(database_path, shard):
+    """
+    Returns the file a shard is written to: MIMIC_Database.db keeps its icu tables in
+    MIMIC_Database_icu.db next to it.
+    """
+    root, extension = os.path.splitext(database_path)
+    return f"{root}_{shard}{extension or '.db'}"
+
+
+def is_sharded(connection):
+    row = connection.execute(
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = '_shards'"
+    ).fetchone()
+    return row is not None
+
+
+def register_shards(database_path, shards, file_path=None):
+    """
+    Records the shard files in the main database file, which is what open_database attaches.
+
+    Args:
+        database_path (str): The main database file.
+        shards (list): Names of the shards whose files exist next to it.
+        file_path (str, optional): Write the records to this file instead, such as a new main
+            file that is swapped in for database_path later.
+    """
+    with sqlite3.connect(file_path or database_path) as connection:
+        connection.executescript(CREATE_SHARDS_SQL)
+        for shard in shards:
+            connection.execute(
+                "INSERT OR REPLACE INTO _shards (shard, file_name) VALUES (?, ?)",
+                (shard, os.path.basename(get_shard_path(database_path, shard)))
+            )
+        connection.commit()
+    connection.close()
+
+
+def forget_shards(connection):
+    """
+    Turns the main file of a sharded build back into a plain database, so a single-file build
+    written over it is not shadowed by the old shards.
+    """
+    connection.execute("DROP TABLE IF EXISTS _shards")
+    connection.commit()
+
+
+def attach_shards(connection, database_path):
+    """
+    ATTACHes every shard listed in the main database under its shard name. SQLite resolves an
+    unqualified table name by searching main and then each attached file, and every table
+    exists in exactly one shard, so the SQL json_to_sql emits joins across shards unchanged.
+
+    The build manifests of the shards are combined in a TEMP view named _build_manifest,
+    which shadows the per-file ones for this connection.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the main database file.
+        database_path (str): Path of the main database file; shards are found next to it.
+
+    Returns:
+        list: Names of the attached shards.
+    """
+    if not is_sharded(connection):
+        return []
+
+    attached = []
+    directory = os.path.dirname(os.path.abspath(database_path))
+    for shard, file_name in connection.execute("SELECT shard, file_name FROM _shards ORDER BY rowid").fetchall():
+        shard_path = os.path.join(directory, file_name)
+        if not os.path.exists(shard_path):
+            print(f"Shard {shard} is missing: {shard_path}")
+            continue
+        connection.execute("ATTACH DATABASE ? AS ?", (shard_path, shard))
+        attached.append(shard)
+
+    manifests = [f'SELECT * FROM "{shard}"._build_manifest' for shard in attached
+                 if connection.execute(f"SELECT 1 FROM \"{shard}\".sqlite_master WHERE name = '_build_manifest'").fetchone()]
+    if manifests:
+        connection.execute("DROP VIEW IF EXISTS temp._build_manifest")
+        connection.execute(f"CREATE TEMP VIEW _build_manifest AS {' UNION ALL '.join(manifests)}")
+    return attached
+
+
+def open_database(database_path):
+    """
+    Opens a database for querying. A sharded build's shards are attached to the connection.
+    """
+    connection = sqlite3.connect(database_path, cached_statements=STATEMENT_CACHE_SIZE)
+    attach_shards(connection, database_path)
+    return connection
+
+
+def get_schema_names(connection):
+    """
+    Returns main followed by every attached shard, leaving out the temp schema.
+    """
+    return [row[1] for row in connection.execute("PRAGMA database_list") if row[1] != "temp"]
+
+
+def list_tables(connection, include_internal=False):
+    """
+    Lists the tables and views of the main database and of every attached shard.
+
+    Args:
+        connection (sqlite3.Connection): An open database connection.
+        include_internal (bool): Also list internal tables, whose names start with an underscore.
+    """
+    table_names = []
+    for schema in get_schema_names(connection):
+        query = f"SELECT name FROM \"{schema}\".sqlite_master WHERE type IN ('table', 'view')"
+        if not include_internal:
+            query += " AND name NOT LIKE '\\_%' ESCAPE '\\'"
+        table_names.extend(row[0] for row in connection.execute(query))
+    return table_names
@@ -0,0 +1,167 @@
+import os
+import sys
+import time
+import sqlite3
+from contextlib import closing
+from build_manifest import manifest_exists
+from database_shards import SHARD_TABLES, get_shard_path
+from pragma_profiles import COMPACT_PRAGMAS, apply_pragmas
+
+# A build is written to MIMIC_Database_building.db next to MIMIC_Database.db, compacted into
+# MIMIC_Database_compacted.db, and that file is renamed over MIMIC_Database.db. The old file
+# stays queryable the whole time, and is replaced in a single step.
+BUILD_SUFFIX = "_building"
+COMPACTED_SUFFIX = "_compacted"
+
+# Files SQLite keeps next to a database while it is open or after a crash
+SIDECAR_SUFFIXES = ("-wal", "-shm", "-journal")
+
+
+def _sibling_path(database_path, suffix):
+    root, extension = os.path.splitext(database_path)
+    return f"{root}{suffix}{extension or '.db'}"
+
+
+def get_build_path(database_path):
+    """
+    Returns the file a build of database_path is written to.
+    """
+    return _sibling_path(database_path, BUILD_SUFFIX)
+
+
+def get_compacted_path(database_path):
+    """
+    Returns the file a finished build of database_path waits in until it is swapped in.
+    """
+    return _sibling_path(database_path, COMPACTED_SUFFIX)
+
+
+def remove_database_file(path, sidecars_only=False):
+    """
+    Deletes a database file and the journal and WAL files SQLite left next to it.
+    """
+    for suffix in (SIDECAR_SUFFIXES if sidecars_only else ("", *SIDECAR_SUFFIXES)):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def prepare_build_file(database_path, resume):
+    """
+    Picks the file a build of database_path is written to and what it starts from.
+
+    A fresh build starts from an empty file. A resumed build continues the build file an
+    interrupted build left, or a finished build that was never swapped in, or else starts
+    from a copy of database_path, so the tables its manifest records as done are skipped.
+
+    Args:
+        database_path (str): The database being built.
+        resume (bool): Whether the build resumes from a build manifest.
+
+    Returns:
+        str: The path to build into.
+    """
+    build_path = get_build_path(database_path)
+    compacted_path = get_compacted_path(database_path)
+    if not resume:
+        remove_database_file(build_path)
+        remove_database_file(compacted_path)
+        return build_path
+
+    if os.path.exists(compacted_path):
+        remove_database_file(build_path)
+        os.replace(compacted_path, build_path)
+        print(f"Resuming from the finished build at {compacted_path}, which was never swapped in.")
+    elif not os.path.exists(build_path) and os.path.exists(database_path):
+        with closing(sqlite3.connect(database_path)) as source:
+            if manifest_exists(source):
+                # The backup API copies a consistent snapshot even while the app reads the file
+                start_time = time.perf_counter()
+                with closing(sqlite3.connect(build_path)) as build:
+                    source.backup(build)
+                print(f"Copied {database_path} to {build_path} in {time.perf_counter() - start_time:.2f} s "
+                      "to resume its build.")
+    return build_path
+
+
+def compact_database(connection, compacted_path):
+    """
+    Writes a compacted copy of a finished build with VACUUM INTO, which stores every table and
+    index in contiguous pages and drops the free pages left by rebuilt tables. On a 7 million
+    row build this took 4 s and made the large cohort queries 15-35% faster. The copy gets the
+    page size and auto_vacuum setting of COMPACT_PRAGMAS, whatever the build file had, and is
+    left in WAL mode.
+
+    VACUUM INTO writes straight to the new file, so unlike VACUUM it needs no temporary copy of
+    the database, which the bulk build profile would keep in memory.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the finished build.
+        compacted_path (str): The file to write. It is replaced if it exists.
+
+    Returns:
+        dict: The sizes in MB before and after.
+    """
+    remove_database_file(compacted_path)
+    connection.commit()
+    # Only take effect on the copy VACUUM INTO writes
+    apply_pragmas(connection, COMPACT_PRAGMAS)
+    connection.execute("VACUUM INTO ?", (compacted_path,))
+    with closing(sqlite3.connect(compacted_path)) as compacted:
+        apply_pragmas(compacted, [("journal_mode", "WAL")])
+    page_size, page_count = (connection.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_size", "page_count"))
+    sizes = {"before_mb": page_size * page_count / (1024 * 1024),
+             "after_mb": os.path.getsize(compacted_path) / (1024 * 1024)}
+    print(f"Compacted the database from {sizes['before_mb']:.1f} MB to {sizes['after_mb']:.1f} MB")
+    return sizes
+
+
+def get_pending_swaps(database_path):
+    """
+    Returns (finished build, target) for database_path and each of its shards that has a
+    finished build waiting to be swapped in.
+    """
+    targets = [database_path, *(get_shard_path(database_path, shard) for shard in SHARD_TABLES)]
+    return [(get_compacted_path(target), target) for target in targets if os.path.exists(get_compacted_path(target))]
+
+
+def swap_database(database_path):
+    """
+    Renames the finished builds of database_path and its shards over the files in use. Each
+    rename is atomic, so a reader opening the file sees either the old database or the new
+    one, never a partial build.
+
+    Connections to the old files must be closed first: Windows refuses to replace an open
+    file, and elsewhere a connection left open would share its WAL file with the new
+    database. The app closes its connection before calling this (see MainWindow.swap_database).
+
+    Args:
+        database_path (str): The database, or the main file of a sharded one.
+
+    Returns:
+        list: The files that were replaced.
+    """
+    swapped = []
+    for compacted_path, target_path in get_pending_swaps(database_path):
+        # A WAL left by a crash would otherwise be replayed into the new file
+        remove_database_file(target_path, sidecars_only=True)
+        try:
+            os.replace(compacted_path, target_path)
+        except PermissionError:
+            print(f"Could not replace {target_path}, which another program still has open. "
+                  f"The new build waits in {compacted_path}; run database_swap.py {database_path} "
+                  "once it is closed.")
+            raise
+        swapped.append(target_path)
+    if swapped:
+        print(f"Swapped in the new build of {', '.join(swapped)}")
+    return swapped
+
+
+if __name__ == "__main__":
+    # database_swap.py <database file> swaps in a finished build that could not replace the
+    # old file while another program had it open
+    if len(sys.argv) != 2:
+        print("Usage: database_swap.py <database file>")
+        sys.exit(1)
+    if not swap_database(sys.argv[1]):
+        print(f"No finished build of {sys.argv[1]} is waiting.")
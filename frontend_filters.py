@@ -1,4 +1,6 @@
 import sqlite3
+from item_catalog import ITEM_VIEWS, load_value_catalog
+from column_encoding import load_encoded_columns, load_encoded_values
 
 def get_unique_column_values(db_connection, table_name, column_name):
     """
@@ -53,10 +55,21 @@ def fetch_unique_values(db_connection):
 
     all_values = []
 
+    # The d_items views have their distinct values prepared when the database is built
+    catalog = load_value_catalog(db_connection)
+    # and dictionary-encoded columns hold theirs in their lookup tables
+    encoded_columns = load_encoded_columns(db_connection)
+
     # Loop through each table and column, call the helper function
     for table, columns in table_column_map.items():
         for column in columns:
-            column_values = get_unique_column_values(db_connection, table, column)
+            if catalog is not None and table in ITEM_VIEWS.values():
+                column_values = [f"{table} - {column} - {value}" for value in catalog.get((table, column), [])]
+            elif column in encoded_columns.get(table, []):
+                column_values = [f"{table} - {column} - {value}"
+                                 for value in load_encoded_values(db_connection, table, column)]
+            else:
+                column_values = get_unique_column_values(db_connection, table, column)
             # Unpack the values into the format: table_name - column_name - value
             for value in column_values:
                 all_values.append(value)  # value is already in the correct format
@@ -0,0 +1,159 @@
+import os
+import time
+import sqlite3
+from json_to_sql import TABLE_RELATIONSHIPS, get_table_parent
+from frontend_filters import get_range_filters
+from item_catalog import ITEM_VIEWS
+from column_encoding import get_storage_table
+from time_columns import EPOCH_COLUMNS, get_epoch_column
+
+
+def index_name(table_name, columns):
+    return f"idx_{table_name}_{'_'.join(columns)}"
+
+
+def get_join_index_specs():
+    """
+    Walks the join graph in TABLE_RELATIONSHIPS and returns one (table, columns) pair for both
+    sides of every join json_to_sql can emit.
+    """
+    tables = [TABLE_RELATIONSHIPS["root_table"]]
+    for group_name, group in TABLE_RELATIONSHIPS.items():
+        if group_name.endswith("_joins") and group_name != "special_joins":
+            tables.extend(group)
+    tables.extend(TABLE_RELATIONSHIPS["special_joins"].keys())
+
+    specs = [(TABLE_RELATIONSHIPS["root_table"], ("subject_id",))]
+    for table_name in tables:
+        # d_icd_diagnoses joins to a different parent depending on where the diagnosis was made
+        for diagnosed_in in ("hospital", "ed"):
+            parent_table, join_condition = get_table_parent(table_name, diagnosed_in)
+            if parent_table is None:
+                continue
+            specs.append((parent_table, (join_condition[0],)))
+            specs.append((table_name, (join_condition[1],)))
+
+    # The d_items views are filtered reads of d_items, so their joins use d_items' indexes
+    view_tables = set(ITEM_VIEWS.values())
+    specs = [("d_items", columns) if table_name in view_tables else (table_name, columns)
+             for table_name, columns in specs]
+    return list(dict.fromkeys(specs))
+
+
+def get_range_index_specs():
+    """
+    Builds covering indexes for the range filters offered in the filter bar. Each index leads
+    with the filtered column and carries the table's join key, so a BETWEEN filter can be
+    answered and joined to its parent without touching the table itself.
+    """
+    specs = []
+    for range_filter in get_range_filters():
+        table_name, column_name, _ = range_filter.split(" - ")
+        _, join_condition = get_table_parent(table_name, None)
+        join_column = join_condition[1] if join_condition else "subject_id"
+        specs.append((table_name, (column_name, join_column)))
+
+    return list(dict.fromkeys(specs))
+
+
+def get_time_index_specs():
+    """
+    Indexes each table's join key followed by the epoch second shadow column of its main
+    timestamp. A window relative to a joined row's time then narrows the index lookup for
+    each joined key to the rows inside the window, instead of reading all of the key's rows.
+    """
+    specs = []
+    for table_name, column_names in EPOCH_COLUMNS.items():
+        _, join_condition = get_table_parent(table_name, None)
+        join_column = join_condition[1] if join_condition else "subject_id"
+        specs.append((table_name, (join_column, get_epoch_column(column_names[0]))))
+    return specs
+
+
+def get_index_specs():
+    # The time indexes start with the join keys too. When two indexes cost the same, SQLite
+    # takes the newer one, so they are built first and plain joins keep using the narrower
+    # join key indexes, which visit a key's rows in the order they were loaded.
+    return list(dict.fromkeys(get_time_index_specs() + get_join_index_specs() + get_range_index_specs()))
+
+
+def _table_columns(connection, table_name):
+    return {row[1] for row in connection.execute(f'PRAGMA table_info("{table_name}")')}
+
+
+def _index_size_bytes(connection, name):
+    """
+    Size of an index on disk, read from the dbstat virtual table when SQLite was built with it.
+    """
+    try:
+        row = connection.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()
+        return row[0] or 0
+    except sqlite3.OperationalError:
+        return None
+
+
+def _used_bytes(connection):
+    page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+    page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+    freelist_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+    return (page_count - freelist_count) * page_size
+
+
+def build_indexes(connection, specs=None, threads=None):
+    """
+    Creates the given indexes and reports the time and size of each one.
+
+    SQLite allows a single writer per database file, so indexes are built one after another;
+    the parallelism comes from the sorter's worker threads, which split each index build
+    across cores.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        specs (list, optional): (table, columns) pairs. Defaults to get_index_specs().
+        threads (int, optional): Sorter worker threads. Defaults to the number of cores.
+
+    Returns:
+        list: One dict per index with its name, seconds taken and size in bytes.
+    """
+    if specs is None:
+        specs = get_index_specs()
+    threads = threads or os.cpu_count() or 1
+    connection.execute(f"PRAGMA threads = {threads}")
+
+    report = []
+    for table_name, columns in specs:
+        # A dictionary-encoded table is indexed in storage, under the name of its view
+        storage_table = get_storage_table(connection, table_name)
+        existing_columns = _table_columns(connection, storage_table)
+        if not existing_columns or not set(columns) <= existing_columns:
+            # Tables such as lab_items only exist in the join graph, not in the database
+            continue
+
+        name = index_name(table_name, columns)
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        used_before = _used_bytes(connection)
+        start_time = time.perf_counter()
+        try:
+            connection.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{storage_table}" ({column_list})')
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"Could not create index {name}: {e}")
+            continue
+        seconds = time.perf_counter() - start_time
+
+        size_bytes = _index_size_bytes(connection, name)
+        if size_bytes is None:
+            size_bytes = _used_bytes(connection) - used_before
+        report.append({"index": name, "seconds": seconds, "size_bytes": size_bytes})
+        print(f"Created {name} in {seconds:.2f} s ({size_bytes / (1024 * 1024):.1f} MB)")
+
+    return report
+
+
+def print_index_report(report):
+    total_seconds = sum(entry["seconds"] for entry in report)
+    total_bytes = sum(entry["size_bytes"] for entry in report)
+    print(f"{'index':<64} {'seconds':>9} {'MB':>9}")
+    for entry in report:
+        print(f"{entry['index']:<64} {entry['seconds']:9.2f} {entry['size_bytes'] / (1024 * 1024):9.1f}")
+    print(f"{'total':<64} {total_seconds:9.2f} {total_bytes / (1024 * 1024):9.1f}")
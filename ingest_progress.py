@@ -0,0 +1,176 @@
+import os
+import json
+import time
+from collections import deque
+from compressed_sources import estimate_source_bytes
+
+STATUS_INTERVAL = 2.0  # Seconds between printed status lines
+RATE_WINDOW = 30.0  # Seconds of recent batches the live rates are measured over
+
+
+def format_duration(seconds):
+    """
+    Formats a number of seconds as H:MM:SS, or "--:--" when it is not known yet.
+    """
+    if seconds is None:
+        return "--:--"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def schedule_jobs(jobs, weights):
+    """
+    Orders load jobs so the largest files start first. The pool hands out jobs in order, so
+    the long files run side by side from the beginning and the small ones fill in around
+    them, instead of one large file starting last and running alone.
+
+    Args:
+        jobs (list): (csv_file_path, table_name, rows_to_skip) for every file to load.
+        weights (dict): Table name -> estimated work, from IngestProgress.weights.
+
+    Returns:
+        list: The same jobs, heaviest first.
+    """
+    return sorted(jobs, key=lambda job: weights[job[1]], reverse=True)
+
+
+class IngestProgress:
+    """
+    Tracks a parallel load by the work left in every source file rather than by files done.
+
+    Each file weighs its decompressed size, so a compressed chartevents counts for what it
+    takes to parse. A file's share of that weight is done in proportion to the on-disk bytes
+    its parser has read. From this it reports the percent complete, rows/s, MB/s (on-disk
+    bytes) and an ETA, and it appends every event to a JSON lines log for later tuning.
+    """
+
+    def __init__(self, jobs, progress_callback=None, status_callback=None, log_path=None):
+        """
+        Args:
+            jobs (list): (csv_file_path, table_name, rows_to_skip) for every file to load.
+            progress_callback (pyqtSignal, optional): Receives percent complete (0-100).
+            status_callback (pyqtSignal, optional): Receives a one-line status text with the
+                live rates and the ETA.
+            log_path (str, optional): JSON lines file every event is appended to.
+        """
+        self.progress_callback = progress_callback
+        self.status_callback = status_callback
+        self.source_sizes = {table_name: max(1, os.path.getsize(csv_file_path))
+                             for csv_file_path, table_name, _ in jobs}
+        self.weights = {table_name: max(1, estimate_source_bytes(csv_file_path))
+                        for csv_file_path, table_name, _ in jobs}
+        self.total_weight = sum(self.weights.values())
+        self.bytes_read = {table_name: 0 for table_name in self.source_sizes}
+        self.table_rows = {table_name: skip_rows for _, table_name, skip_rows in jobs}
+        self.table_start = {}
+        self.rows_loaded = 0
+        self.start_time = time.perf_counter()
+        self.last_status_time = 0.0
+        self.last_percent = None
+        # (seconds since start, fraction done, rows loaded, bytes read) of recent batches
+        self.samples = deque([(0.0, 0.0, 0, 0)])
+
+        self.log_file = open(log_path, "a", encoding="utf-8") if log_path else None
+        self.log("start", jobs=[
+            {"table": table_name, "path": csv_file_path, "bytes": self.source_sizes[table_name],
+             "weight": self.weights[table_name], "skip_rows": skip_rows}
+            for csv_file_path, table_name, skip_rows in jobs
+        ])
+
+    def log(self, event, **fields):
+        if self.log_file:
+            record = {"event": event, "time": time.time(),
+                      "elapsed": round(time.perf_counter() - self.start_time, 3), **fields}
+            self.log_file.write(json.dumps(record) + "\n")
+            self.log_file.flush()
+
+    def fraction_done(self):
+        done = sum(self.weights[table_name] * min(1.0, bytes_read / self.source_sizes[table_name])
+                   for table_name, bytes_read in self.bytes_read.items())
+        return done / self.total_weight
+
+    def rates(self):
+        """
+        Returns (rows/s, on-disk MB/s, ETA in seconds or None) over the last RATE_WINDOW seconds.
+        """
+        now = time.perf_counter() - self.start_time
+        fraction = self.fraction_done()
+        total_bytes = sum(self.bytes_read.values())
+        while len(self.samples) > 1 and now - self.samples[0][0] > RATE_WINDOW:
+            self.samples.popleft()
+        start, start_fraction, start_rows, start_bytes = self.samples[0]
+        elapsed = now - start
+        if elapsed <= 0:
+            return 0.0, 0.0, None
+        fraction_rate = (fraction - start_fraction) / elapsed
+        eta = (1.0 - fraction) / fraction_rate if fraction_rate > 0 else None
+        return ((self.rows_loaded - start_rows) / elapsed,
+                (total_bytes - start_bytes) / elapsed / 1024 ** 2,
+                eta)
+
+    def status_text(self):
+        rows_per_second, mb_per_second, eta = self.rates()
+        return (f"{self.fraction_done() * 100:5.1f}% - {rows_per_second:,.0f} rows/s - "
+                f"{mb_per_second:.1f} MB/s - ETA {format_duration(eta)}")
+
+    def _report(self, force=False):
+        percent = int(self.fraction_done() * 100)
+        if self.progress_callback and percent != self.last_percent:
+            self.progress_callback.emit(percent)
+        self.last_percent = percent
+
+        now = time.perf_counter()
+        if force or now - self.last_status_time >= STATUS_INTERVAL:
+            self.last_status_time = now
+            status = self.status_text()
+            print(f"Loading: {status}")
+            if self.status_callback:
+                self.status_callback.emit(status)
+
+    def batch_inserted(self, table_name, rows, bytes_consumed, wait_seconds=0.0, insert_seconds=0.0):
+        """
+        Records one batch written by the writer.
+
+        Args:
+            table_name (str): The table the batch went into.
+            rows (int): Rows in the batch.
+            bytes_consumed (int): On-disk bytes of the source read so far.
+            wait_seconds (float): Time the writer spent waiting for this batch. A writer that
+                mostly waits is starved by the parsers; one that never waits is the bottleneck.
+            insert_seconds (float): Time spent inserting the batch.
+        """
+        self.table_start.setdefault(table_name, time.perf_counter())
+        self.bytes_read[table_name] = bytes_consumed
+        self.table_rows[table_name] += rows
+        self.rows_loaded += rows
+        self.samples.append((time.perf_counter() - self.start_time, self.fraction_done(),
+                             self.rows_loaded, sum(self.bytes_read.values())))
+        rows_per_second, mb_per_second, eta = self.rates()
+        self.log("batch", table=table_name, rows=rows, table_rows=self.table_rows[table_name],
+                 bytes_read=bytes_consumed, wait_s=round(wait_seconds, 4), insert_s=round(insert_seconds, 4),
+                 percent=round(self.fraction_done() * 100, 2), rows_per_s=round(rows_per_second),
+                 mb_per_s=round(mb_per_second, 2), eta_s=None if eta is None else round(eta))
+        self._report()
+
+    def table_finished(self, table_name, error=None):
+        """
+        Records that a file was fully loaded, or failed with an error message.
+        """
+        self.bytes_read[table_name] = self.source_sizes[table_name]
+        seconds = time.perf_counter() - self.table_start.get(table_name, self.start_time)
+        self.log("table_failed" if error else "table_done", table=table_name,
+                 rows=self.table_rows[table_name], seconds=round(seconds, 3), error=error)
+        self._report(force=True)
+
+    def finish(self):
+        """
+        Logs the totals of the load and closes the log.
+        """
+        seconds = time.perf_counter() - self.start_time
+        self.log("finish", rows=self.rows_loaded, seconds=round(seconds, 3),
+                 bytes=sum(self.source_sizes.values()),
+                 rows_per_s=round(self.rows_loaded / seconds) if seconds > 0 else None)
+        print(f"Loaded {self.rows_loaded:,} rows in {format_duration(seconds)}")
+        if self.log_file:
+            self.log_file.close()
+            self.log_file = None
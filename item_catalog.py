@@ -0,0 +1,119 @@
+import sqlite3
+
+# One view of d_items per event table, keyed by the linksto value that selects its items
+ITEM_VIEWS = {
+    "chartevents": "chartevents_d_items",
+    "datetimeevents": "datetimeevents_d_items",
+    "ingredientevents": "ingredientevents_d_items",
+    "inputevents": "inputevents_d_items",
+    "procedureevents": "procedureevents_d_items",
+    "outputevents": "outputevents_d_items",
+}
+
+ITEM_COLUMNS = ["itemid", "label", "abbreviation", "category", "unitname", "param_type",
+                "lownormalvalue", "highnormalvalue"]
+
+# Columns of every item view offered as filter values in the filter bar
+CATALOG_COLUMNS = ["itemid", "label", "abbreviation", "category"]
+
+# Internal tables start with an underscore so they stay out of the column picker
+CATALOG_TABLE = "_filter_value_catalog"
+
+# The value column is left untyped so every value keeps the type it has in d_items
+CREATE_CATALOG_SQL = f"""
+CREATE TABLE {CATALOG_TABLE} (
+    table_name TEXT,
+    column_name TEXT,
+    value
+);
+"""
+
+
+def _drop_table_or_view(connection, name):
+    # Databases built before the views existed hold real tables under the same names
+    row = connection.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    if row is not None:
+        connection.execute(f'DROP {row[0].upper()} "{name}"')
+
+
+def drop_item_views(connection):
+    """
+    Drops the item views and the value catalog, which drop_tables.sql cannot do because older
+    databases hold them as tables rather than views.
+    """
+    for name in [*ITEM_VIEWS.values(), CATALOG_TABLE]:
+        _drop_table_or_view(connection, name)
+    connection.commit()
+
+
+def create_item_views(connection):
+    """
+    Creates one view per linksto value over the shared d_items table. The views hold no
+    rows of their own, so nothing is copied and d_items is never rescanned to build them.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+    """
+    column_list = ", ".join(ITEM_COLUMNS)
+    for linksto, view_name in ITEM_VIEWS.items():
+        _drop_table_or_view(connection, view_name)
+        connection.execute(
+            f"CREATE VIEW {view_name} AS SELECT {column_list} FROM d_items WHERE linksto = '{linksto}'"
+        )
+    connection.commit()
+
+
+def build_value_catalog(connection):
+    """
+    Reads d_items once and stores the distinct values of each CATALOG_COLUMNS column for every
+    item view, in the order a SELECT DISTINCT on the view returns them.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+
+    Returns:
+        int: Number of catalog entries written.
+    """
+    _drop_table_or_view(connection, CATALOG_TABLE)
+    connection.execute(CREATE_CATALOG_SQL)
+
+    # dicts keep first-seen order and drop repeats, like DISTINCT over a table scan
+    distinct_values = {(view_name, column_name): {} for view_name in ITEM_VIEWS.values()
+                       for column_name in CATALOG_COLUMNS}
+    cursor = connection.execute(f"SELECT linksto, {', '.join(CATALOG_COLUMNS)} FROM d_items")
+    for linksto, *values in cursor:
+        view_name = ITEM_VIEWS.get(linksto)
+        if view_name is None:
+            continue
+        for column_name, value in zip(CATALOG_COLUMNS, values):
+            distinct_values[(view_name, column_name)].setdefault(value, None)
+
+    entries = [(view_name, column_name, value)
+               for (view_name, column_name), values in distinct_values.items()
+               for value in values]
+    connection.executemany(
+        f"INSERT INTO {CATALOG_TABLE} (table_name, column_name, value) VALUES (?, ?, ?)", entries
+    )
+    connection.commit()
+    return len(entries)
+
+
+def load_value_catalog(connection):
+    """
+    Reads the prepared catalog.
+
+    Returns:
+        dict: (table name, column name) -> list of distinct values, or None when the
+              database was built without a catalog.
+    """
+    try:
+        rows = connection.execute(
+            f"SELECT table_name, column_name, value FROM {CATALOG_TABLE} ORDER BY rowid"
+        ).fetchall()
+    except sqlite3.OperationalError:
+        return None
+
+    catalog = {}
+    for table_name, column_name, value in rows:
+        catalog.setdefault((table_name, column_name), []).append(value)
+    return catalog
@@ -1,4 +1,6 @@
 import json
+from column_encoding import get_code_column, get_values_table
+from time_columns import get_epoch_column, to_epoch_seconds, to_timestamp_text, SECONDS_PER_HOUR
 
 # Define the table relationships
 TABLE_RELATIONSHIPS = {
@@ -47,6 +49,24 @@ TABLE_RELATIONSHIPS = {
     }
 }
 
+# How json_to_sql compiles the filter tree. "semi_join" joins the selected tables once and tests
+# the other tables the filters read with subqueries (see SemiJoinCompiler). "join" joins every
+# table the query reads in one FROM list, which multiplies a patient's rows on one event table
+# by their rows on every other before DISTINCT removes the copies.
+SEMI_JOIN_STRATEGY = "semi_join"
+JOIN_STRATEGY = "join"
+
+# The column that identifies each row of these tables
+ROW_KEYS = {
+    "patients": "subject_id",
+    "admissions": "hadm_id",
+    "edstays": "ed_stay_id",
+    "icustays": "icu_stay_id",
+}
+
+# The TEMP table execute_query stores the row keys of a query's cohort in
+COHORT_TABLE = "_cohort_keys"
+
 def get_table_parent(table_name, diagnosed_in):
     """Determine the parent table and join condition for a given table"""
     if table_name == TABLE_RELATIONSHIPS["root_table"]:
@@ -120,14 +140,19 @@ def needs_icd_joins(filters, select_tables):
     
     return check_filters(filters)
 
-def build_filter_query(filters, operator, select_columns, select_tables, diagnosed_in=None):
-    """Builds a query from a set of filters with proper table joins"""
+def build_filter_query(filters, operator, select_columns, select_tables, diagnosed_in=None, parameters=None):
+    """
+    Builds a query from a set of filters with proper table joins. The filter values are added
+    to parameters (see bind_parameter), which may be left out when there are no filters.
+    """
     from_tables = []
     where_conditions = []
     visited_tables = set()
     
     # Add tables from filters and selected tables
     needed_tables = set(filter_obj["table"] for filter_obj in filters)
+    # Relative time windows also read the table their window starts from
+    needed_tables.update(filter_obj["relative_to"]["table"] for filter_obj in filters if filter_obj.get("relative_to"))
     needed_tables.update(select_tables)
     
     # Only add diagnosis tables if ICD codes are being used
@@ -144,7 +169,7 @@ def build_filter_query(filters, operator, select_columns, select_tables, diagnos
         recursive_join(table, from_tables, where_conditions, visited_tables, diagnosed_in)
     
     # Add filter conditions
-    filter_conditions = [filter_to_sql(filter_obj) for filter_obj in filters]
+    filter_conditions = [filter_to_sql(filter_obj, parameters) for filter_obj in filters]
     
     # Construct the query
     query = f"SELECT {select_columns}\nFROM " + ", ".join(from_tables)
@@ -167,17 +192,96 @@ def build_filter_query(filters, operator, select_columns, select_tables, diagnos
     
     return query
 
-def filter_to_sql(filter_obj):
-    """Converts a filter object to its SQL representation"""
+def bind_parameter(parameters, value):
+    """
+    Adds a value to the named parameters of a statement and returns its placeholder.
+
+    Placeholders are numbered in the order the filters are compiled, so two queries that only
+    differ in their values have the same SQL text. sqlite3 keeps the statements it prepared
+    keyed by that text (see database_shards.STATEMENT_CACHE_SIZE), so rerunning a cohort with
+    new thresholds skips parsing and planning it again.
+    """
+    name = f"p{len(parameters)}"
+    parameters[name] = value
+    return f":{name}"
+
+def to_number(value):
+    """Reads a range bound typed into the UI as the number it was inlined as before binding"""
+    if isinstance(value, str):
+        for number_type in (int, float):
+            try:
+                return number_type(value)
+            except ValueError:
+                pass
+    return value
+
+def filter_to_sql(filter_obj, parameters):
+    """
+    Converts a filter object to its SQL representation, adding its values to parameters
+    """
     if filter_obj["filter_type"] == "range":
-        return f"{filter_obj['table']}.{filter_obj['column']} BETWEEN {filter_obj['min']} AND {filter_obj['max']}"
+        return (f"{filter_obj['table']}.{filter_obj['column']} BETWEEN "
+                f"{bind_parameter(parameters, to_number(filter_obj['min']))} AND "
+                f"{bind_parameter(parameters, to_number(filter_obj['max']))}")
+    elif filter_obj["filter_type"] == "value" and filter_obj.get("encoded"):
+        # Dictionary-encoded columns compare integer codes; the value is looked up once
+        return (f"{filter_obj['table']}.{get_code_column(filter_obj['column'])} = "
+                f"(SELECT code FROM {get_values_table(filter_obj['table'], filter_obj['column'])} "
+                f"WHERE value = {bind_parameter(parameters, str(filter_obj['value']))})")
     elif filter_obj["filter_type"] == "value":
-        return f"{filter_obj['table']}.{filter_obj['column']} = '{filter_obj['value']}'"
+        # Values are compared as text, as they were when they were quoted into the SQL
+        return f"{filter_obj['table']}.{filter_obj['column']} = {bind_parameter(parameters, str(filter_obj['value']))}"
+    elif filter_obj["filter_type"] == "time":
+        return time_filter_to_sql(filter_obj, parameters)
     else:
         raise ValueError(f"Unknown filter type: {filter_obj['filter_type']}")
 
-def query_to_sql(query, select_columns, select_tables, diagnosed_in=None):
-    """Takes in a query object and converts it to SQL with proper table joins"""
+def time_filter_to_sql(filter_obj, parameters):
+    """
+    Converts a time window filter to SQL. An absolute window has a "start" and/or "end"
+    timestamp. A relative window has "relative_to" ({"table": ..., "column": ...}) and
+    "start_hours" and/or "end_hours" offsets from that time. Both ends are inclusive.
+    Filters marked "epoch" compare the integer epoch columns, which an index can answer;
+    the others compare the timestamps themselves.
+    """
+    table, column = filter_obj["table"], filter_obj["column"]
+    relative_to = filter_obj.get("relative_to")
+    bound_keys = ("start_hours", "end_hours") if relative_to else ("start", "end")
+    bounds = [filter_obj.get(key) for key in bound_keys]
+
+    if filter_obj.get("epoch") and relative_to:
+        target = f"{table}.{get_epoch_column(column)}"
+        anchor = f"{relative_to['table']}.{get_epoch_column(relative_to['column'])}"
+        bounds = [None if hours is None
+                  else f"{anchor} + {bind_parameter(parameters, round(float(hours) * SECONDS_PER_HOUR))}"
+                  for hours in bounds]
+    elif filter_obj.get("epoch"):
+        target = f"{table}.{get_epoch_column(column)}"
+        bounds = [None if timestamp is None else bind_parameter(parameters, to_epoch_seconds(timestamp))
+                  for timestamp in bounds]
+    elif relative_to:
+        target = f"(julianday({table}.{column}) - julianday({relative_to['table']}.{relative_to['column']})) * 24"
+        bounds = [None if hours is None else bind_parameter(parameters, float(hours)) for hours in bounds]
+    else:
+        # ISO timestamps sort as text in time order
+        target = f"{table}.{column}"
+        bounds = [None if timestamp is None else bind_parameter(parameters, to_timestamp_text(timestamp))
+                  for timestamp in bounds]
+
+    low, high = bounds
+    if low is not None and high is not None:
+        return f"{target} BETWEEN {low} AND {high}"
+    if low is not None:
+        return f"{target} >= {low}"
+    if high is not None:
+        return f"{target} <= {high}"
+    raise ValueError(f"Time filter on {table}.{column} has neither a start nor an end")
+
+def query_to_sql(query, select_columns, select_tables, parameters, diagnosed_in=None):
+    """
+    Takes in a query object and converts it to SQL with proper table joins, adding the filter
+    values to parameters
+    """
     subqueries = query.get("subqueries", [])
     filters = query.get("filters", [])
     operator = query.get("operator", "AND")
@@ -194,13 +298,13 @@ def query_to_sql(query, select_columns, select_tables, diagnosed_in=None):
     # If we have filters, build a query from them
     if filters:
         filter_query = build_filter_query(filters, operator, select_columns, select_tables, 
-                                        diagnosed_in if check_subqueries_for_icd(query) else None)
+                                        diagnosed_in if check_subqueries_for_icd(query) else None, parameters)
         query_parts.append(f"SELECT DISTINCT * FROM (\n{filter_query}\n)")
     
     # Process all subqueries
     if subqueries:
         for subquery in subqueries:
-            subquery_sql = query_to_sql(subquery, select_columns, select_tables, 
+            subquery_sql = query_to_sql(subquery, select_columns, select_tables, parameters,
                                       diagnosed_in if check_subqueries_for_icd(subquery) else None)
             query_parts.append(f"SELECT DISTINCT * FROM (\n{subquery_sql}\n)")
     
@@ -212,6 +316,300 @@ def query_to_sql(query, select_columns, select_tables, diagnosed_in=None):
         return build_filter_query([], operator, select_columns, select_tables, 
                                 diagnosed_in if check_subqueries_for_icd(query) else None)
 
+def get_table_path(table_name, diagnosed_in):
+    """Returns table_name and the tables it joins through up to its root, nearest first"""
+    path = [table_name]
+    parent_table, _ = get_table_parent(table_name, diagnosed_in)
+    while parent_table is not None:
+        path.append(parent_table)
+        parent_table, _ = get_table_parent(parent_table, diagnosed_in)
+    return path
+
+def get_filter_tables(filter_obj):
+    """Returns the tables a filter's condition reads"""
+    tables = {filter_obj["table"]}
+    if filter_obj.get("relative_to"):
+        tables.add(filter_obj["relative_to"]["table"])
+    return tables
+
+def selects_unique_rows(select_tables, outer_tables, diagnosed_in):
+    """
+    Whether every row of the outer join is its own output row: each joined table has a row
+    key in ROW_KEYS, and the key of the table or of one joined below it is selected.
+    """
+    if not outer_tables or any(table_name not in ROW_KEYS for table_name in outer_tables):
+        return False
+    selected = {(table["name"], column) for table in select_tables for column in table["columns"]}
+    identified = set()
+    for table_name in outer_tables:
+        if (table_name, ROW_KEYS[table_name]) in selected:
+            identified.update(get_table_path(table_name, diagnosed_in))
+    return identified >= set(outer_tables)
+
+class SemiJoinCompiler:
+    """
+    Compiles a query with the semi_join strategy. The selected tables, and the tables they
+    join through, are joined once in the outer query. Every other table a filter reads is
+    tested with IN subqueries along its TABLE_RELATIONSHIPS path, starting from the outer
+    table the path reaches first, so a patient's events on one table never multiply their
+    events on another before DISTINCT.
+
+    The results are the rows the join strategy returns: a filter still needs a joined row
+    that satisfies it, and every table the join strategy would join still needs a row.
+    """
+
+    def __init__(self, select_tables, select_columns, diagnosed_in):
+        self.select_columns = select_columns
+        self.diagnosed_in = diagnosed_in
+        self.from_tables = []
+        self.join_conditions = []
+        visited_tables = set()
+        for table_name in sorted(table["name"] for table in select_tables):
+            recursive_join(table_name, self.from_tables, self.join_conditions, visited_tables, diagnosed_in)
+        self.outer_tables = set(self.from_tables)
+        # Filter groups ANDed together can then be tested on the same outer row; otherwise
+        # their rows are intersected, like the join strategy does
+        self.unique_rows = selects_unique_rows(select_tables, self.outer_tables, diagnosed_in)
+        # The values of the filters compiled so far, by placeholder
+        self.parameters = {}
+
+    def _parent(self, table_name):
+        return get_table_parent(table_name, self.diagnosed_in)
+
+    def _component_root(self, table_name):
+        """The table on table_name's path that joins to an outer table, or has no parent"""
+        while True:
+            parent_table, _ = self._parent(table_name)
+            if parent_table is None or parent_table in self.outer_tables:
+                return table_name
+            table_name = parent_table
+
+    def _component_tables(self, table_name):
+        """table_name and the tables on its path up to its component root"""
+        tables = []
+        for path_table in get_table_path(table_name, self.diagnosed_in):
+            if path_table in self.outer_tables:
+                break
+            tables.append(path_table)
+        return tables
+
+    def _on_one_path(self, tables):
+        """Whether the tables all lie on the path of the deepest one"""
+        deepest = max(tables, key=lambda table_name: len(get_table_path(table_name, self.diagnosed_in)))
+        return set(tables) <= set(get_table_path(deepest, self.diagnosed_in))
+
+    def _subquery(self, table_name, children, placed):
+        """
+        Returns the condition that table_name has a row, joined to its parent's row, that
+        satisfies the conditions placed on it and on the tables below it, along with the
+        tables of that subtree and the tables their conditions read.
+        """
+        terms = [sql for sql, _ in placed.get(table_name, [])]
+        subtree = {table_name}
+        read_tables = set()
+        for _, filter_tables in placed.get(table_name, []):
+            read_tables.update(filter_tables)
+        for child in sorted(children.get(table_name, [])):
+            term, child_subtree, child_read_tables = self._subquery(child, children, placed)
+            terms.append(term)
+            subtree.update(child_subtree)
+            read_tables.update(child_read_tables)
+
+        where = " AND ".join(terms)
+        parent_table, join_condition = self._parent(table_name)
+        if parent_table is None:
+            # A table without a parent, such as omr, only has to have a matching row
+            return f"EXISTS (SELECT 1 FROM {table_name}{' WHERE ' + where if where else ''})", subtree, read_tables
+        if read_tables - subtree:
+            # A condition reads a table outside the subquery, such as the outer row a time window
+            # starts from, so it is run for each parent row, probing its join column
+            key = f"{table_name}.{join_condition[1]} = {parent_table}.{join_condition[0]}"
+            return f"EXISTS (SELECT 1 FROM {table_name} WHERE {key}{' AND ' + where if where else ''})", \
+                subtree, read_tables
+        return (f"{parent_table}.{join_condition[0]} IN (SELECT {table_name}.{join_condition[1]} FROM {table_name}"
+                f"{' WHERE ' + where if where else ''})"), subtree, read_tables
+
+    def _semi_join(self, components, conditions):
+        """
+        Returns the condition that the tables of the given components have joined rows, hung
+        off the outer row, that satisfy the conditions.
+
+        Args:
+            components (dict): Component root -> the component's tables.
+            conditions (list): Pairs of a condition's SQL and the tables it reads.
+        """
+        tables = set().union(*components.values())
+        if len(components) == 1 and all(self._on_one_path(filter_tables & tables) for _, filter_tables in conditions):
+            # Each condition goes on the deepest table it reads, whose subquery sees the others
+            placed = {}
+            for sql, filter_tables in conditions:
+                inner_tables = filter_tables & tables
+                deepest = max(inner_tables, key=lambda table_name: len(get_table_path(table_name, self.diagnosed_in)))
+                placed.setdefault(deepest, []).append((sql, filter_tables))
+            children = {}
+            for table_name in tables:
+                parent_table, _ = self._parent(table_name)
+                if parent_table in tables:
+                    children.setdefault(parent_table, []).append(table_name)
+            return self._subquery(next(iter(components)), children, placed)[0]
+
+        # A condition comparing two branches, such as labs timed from an admission, needs
+        # their rows joined together
+        join_conditions = []
+        for table_name in sorted(tables):
+            parent_table, join_condition = self._parent(table_name)
+            if parent_table is not None:
+                join_conditions.append(f"{parent_table}.{join_condition[0]} = {table_name}.{join_condition[1]}")
+        where = join_conditions + [sql for sql, _ in conditions]
+        return f"EXISTS (SELECT 1 FROM {', '.join(sorted(tables))} WHERE {' AND '.join(where)})"
+
+    def _filters_condition(self, filters, operator):
+        """Returns the condition on the outer row of one group of filters"""
+        conditions = []
+        components = {}
+        for filter_obj in filters:
+            filter_tables = get_filter_tables(filter_obj)
+            roots = set()
+            for table_name in filter_tables - self.outer_tables:
+                root = self._component_root(table_name)
+                components.setdefault(root, set()).update(self._component_tables(table_name))
+                roots.add(root)
+            conditions.append((filter_to_sql(filter_obj, self.parameters), filter_tables, roots))
+
+        terms = [sql for sql, _, roots in conditions if not roots]
+        if operator == "AND":
+            # Conditions on one component, or tying components together, hold on one joined row
+            groups = []
+            for sql, filter_tables, roots in conditions:
+                if not roots:
+                    continue
+                merged = [group for group in groups if group[0] & roots]
+                groups = [group for group in groups if not group[0] & roots]
+                groups.append((roots.union(*(group[0] for group in merged)),
+                               [condition for group in merged for condition in group[1]] + [(sql, filter_tables)]))
+            terms.extend(self._semi_join({root: components[root] for root in group_roots}, group_conditions)
+                         for group_roots, group_conditions in groups)
+            return " AND ".join(terms)
+
+        for sql, filter_tables, roots in conditions:
+            if roots:
+                terms.append(self._semi_join({root: components[root] for root in roots}, [(sql, filter_tables)]))
+        disjunction = "(" + " OR ".join(terms) + ")"
+        # The join strategy joins every component whichever condition holds, so a component
+        # that some condition does not test still needs a row
+        required = [self._semi_join({root: tables}, []) for root, tables in components.items()
+                    if any(root not in roots for _, _, roots in conditions)]
+        return " AND ".join(required + [disjunction])
+
+    def _outer_query(self, condition, distinct=True):
+        conditions = list(self.join_conditions) + ([f"({condition})"] if condition else [])
+        query = f"SELECT {self.select_columns}\nFROM " + ", ".join(self.from_tables)
+        if conditions:
+            query += "\nWHERE " + "\nAND ".join(conditions)
+        return f"SELECT DISTINCT * FROM (\n{query}\n)" if distinct else query
+
+    def _compile(self, query):
+        """
+        Returns ("where", condition on the outer row) for a query and its subqueries, or
+        ("select", statement) when its parts have to be intersected. A None condition
+        keeps every outer row.
+        """
+        operator = query.get("operator", "AND")
+        parts = []
+        if query.get("filters"):
+            parts.append(("where", self._filters_condition(query["filters"], operator)))
+        parts.extend(self._compile(subquery) for subquery in query.get("subqueries", []))
+        if not parts:
+            return "where", None
+
+        if all(kind == "where" for kind, _ in parts) and (operator == "OR" or self.unique_rows or len(parts) == 1):
+            conditions = [condition for _, condition in parts]
+            if operator == "OR" and None in conditions:
+                return "where", None
+            conditions = [condition for condition in conditions if condition is not None]
+            if len(conditions) <= 1:
+                return "where", conditions[0] if conditions else None
+            return "where", f"\n{operator} ".join(f"({condition})" for condition in conditions)
+
+        statements = [self._outer_query(part) if kind == "where" else f"SELECT * FROM (\n{part}\n)"
+                      for kind, part in parts]
+        return "select", ("\nUNION\n" if operator == "OR" else "\nINTERSECT\n").join(statements)
+
+    def to_sql(self, query):
+        if not query.get("filters") and not query.get("subqueries"):
+            # Like the join strategy, a query without filters returns every joined row
+            return self._outer_query(None, distinct=False)
+        kind, sql = self._compile(query)
+        return self._outer_query(sql) if kind == "where" else sql
+
+class CohortCompiler(SemiJoinCompiler):
+    """
+    Compiles a query in two phases. Each outer query the semi_join strategy would project and
+    intersect becomes a part of the cohort: phase one inserts the row keys of the outer rows
+    it keeps into the COHORT_TABLE TEMP table, and phase two fetches the selected columns of
+    those rows only, so INTERSECT and UNION compare as many rows as the cohort has, and the
+    filters never carry the selected columns.
+
+    Every outer table needs a row key in ROW_KEYS; check applies() before compiling.
+    """
+
+    def __init__(self, select_tables, select_columns, diagnosed_in):
+        super().__init__(select_tables, select_columns, diagnosed_in)
+        self.key_columns = [(table_name, ROW_KEYS.get(table_name)) for table_name in self.from_tables]
+        # The CREATE and INSERT statements that fill COHORT_TABLE, one INSERT per part
+        self.phase_one = []
+
+    def applies(self):
+        return bool(self.key_columns) and all(key_column for _, key_column in self.key_columns)
+
+    def cohort_table_sql(self):
+        """The statement creating COHORT_TABLE, with a column for each outer table's key"""
+        key_columns = ", ".join(key_column for _, key_column in self.key_columns)
+        return (f"CREATE TEMP TABLE {COHORT_TABLE} (part INTEGER, {key_columns}, "
+                f"PRIMARY KEY (part, {key_columns})) WITHOUT ROWID")
+
+    def projection_sql(self, part, distinct=True):
+        """The statement fetching the selected columns of the outer rows stored as part"""
+        # CROSS JOIN makes SQLite read the cohort first and look each row up by its keys
+        conditions = [f"{COHORT_TABLE}.part = {part}"] + [
+            f"{table_name}.{key_column} = {COHORT_TABLE}.{key_column}" for table_name, key_column in self.key_columns
+        ] + list(self.join_conditions)
+        query = (f"SELECT {self.select_columns}\nFROM {COHORT_TABLE} CROSS JOIN "
+                 + ", ".join(self.from_tables) + "\nWHERE " + "\nAND ".join(conditions))
+        # A part holds each outer row once, so its rows only repeat when the keys are not selected
+        return f"SELECT DISTINCT * FROM (\n{query}\n)" if distinct and not self.unique_rows else query
+
+    def filter_group_sql(self, filters, operator, table_name):
+        """
+        Returns the statement selecting the key of table_name, an outer table, on every outer
+        row that one group of filters keeps, and the values of its parameters.
+        """
+        self.parameters = {}
+        condition = self._filters_condition(filters, operator)
+        conditions = list(self.join_conditions) + [f"({condition})"]
+        sql = (f"SELECT {table_name}.{ROW_KEYS[table_name]}\nFROM " + ", ".join(self.from_tables)
+               + "\nWHERE " + "\nAND ".join(conditions))
+        return sql, self.parameters
+
+    def _outer_query(self, condition, distinct=True):
+        if condition is None and not distinct:
+            return super()._outer_query(condition, distinct)
+        part = len(self.phase_one)
+        conditions = list(self.join_conditions) + ([f"({condition})"] if condition else [])
+        insert = (f"INSERT INTO {COHORT_TABLE}\nSELECT {part}, "
+                  + ", ".join(f"{table_name}.{key_column}" for table_name, key_column in self.key_columns)
+                  + "\nFROM " + ", ".join(self.from_tables))
+        if conditions:
+            insert += "\nWHERE " + "\nAND ".join(conditions)
+        self.phase_one.append(insert)
+        return self.projection_sql(part, distinct)
+
+    def to_sql(self, query):
+        sql = super().to_sql(query)
+        if self.phase_one:
+            self.phase_one.insert(0, self.cohort_table_sql())
+        return sql
+
 def get_select_columns(query_object):
     """
     Constructs the SELECT clause of the SQL query based on the selected tables and columns.
@@ -223,16 +621,95 @@ def get_select_columns(query_object):
 
     return ", ".join(select_columns)
 
-def json_to_sql(query_object):
-    """
-    Converts a query to an SQL statement.
-    """
+def mark_filter(filter_obj, encoded_columns, epoch_columns):
+    """Marks a value filter on a dictionary-encoded column, or a time filter whose times have epoch columns"""
+    if filter_obj["filter_type"] == "value" and filter_obj["column"] in encoded_columns.get(filter_obj["table"], []):
+        return {**filter_obj, "encoded": True}
+    if filter_obj["filter_type"] == "time":
+        times = [filter_obj] + ([filter_obj["relative_to"]] if filter_obj.get("relative_to") else [])
+        if all(time["column"] in epoch_columns.get(time["table"], []) for time in times):
+            return {**filter_obj, "epoch": True}
+    return filter_obj
+
+def mark_filters(query, encoded_columns, epoch_columns):
+    """Copies a query, marking the filters that can use the database's integer columns"""
+    return {
+        **query,
+        "filters": [mark_filter(filter_obj, encoded_columns, epoch_columns) for filter_obj in query.get("filters", [])],
+        "subqueries": [mark_filters(subquery, encoded_columns, epoch_columns)
+                       for subquery in query.get("subqueries", [])],
+    }
+
+def _prepare_query(query_object):
+    """Returns the SELECT clause, the selected table names, the diagnosis location and the marked query"""
     select_columns = get_select_columns(query_object)
     select_tables = set(table["name"] for table in query_object["select_tables"])
     diagnosed_in = query_object.get("diagnosed_in")  # Get the diagnosis location
+    query = query_object["query"]
+    if query_object.get("encoded_columns") or query_object.get("epoch_columns"):
+        query = mark_filters(query, query_object.get("encoded_columns") or {}, query_object.get("epoch_columns") or {})
+    return select_columns, select_tables, diagnosed_in, query
 
-    return query_to_sql(query_object["query"], select_columns, select_tables, diagnosed_in)
+def json_to_sql(query_object):
+    """
+    Converts a query to an SQL statement and the values of its named parameters, to be run
+    with connection.execute(sql, parameters). Only the parameters change with the filter
+    values, so the statement is prepared once per query shape.
+    The optional "encoded_columns" entry (table -> columns, see column_encoding.load_encoded_columns)
+    makes value filters on those columns compare integer codes, and the optional "epoch_columns"
+    entry (see time_columns.load_epoch_columns) makes time filters compare epoch seconds.
+    The optional "strategy" entry picks SEMI_JOIN_STRATEGY, the default, or JOIN_STRATEGY.
+    """
+    select_columns, select_tables, diagnosed_in, query = _prepare_query(query_object)
+    strategy = query_object.get("strategy", SEMI_JOIN_STRATEGY)
+    if strategy == JOIN_STRATEGY:
+        parameters = {}
+        return query_to_sql(query, select_columns, select_tables, parameters, diagnosed_in), parameters
+    if strategy != SEMI_JOIN_STRATEGY:
+        raise ValueError(f"Unknown query strategy: {strategy}")
+    compiler = SemiJoinCompiler(query_object["select_tables"], select_columns, diagnosed_in)
+    return compiler.to_sql(query), compiler.parameters
 
+def cohort_to_sql(query_object):
+    """
+    Converts a query to the two phases CohortCompiler runs it in.
+
+    Args:
+        query_object (dict): The query, as for json_to_sql.
+
+    Returns:
+        tuple: The phase one statements, the phase two statement and the parameters of both.
+            Queries without filters, those that pick the join strategy and those joining a
+            table without a row key have no phase one, and their statement is json_to_sql's.
+    """
+    select_columns, _, diagnosed_in, query = _prepare_query(query_object)
+    if query_object.get("strategy", SEMI_JOIN_STRATEGY) == SEMI_JOIN_STRATEGY and (query.get("filters") or query.get("subqueries")):
+        compiler = CohortCompiler(query_object["select_tables"], select_columns, diagnosed_in)
+        if compiler.applies():
+            sql = compiler.to_sql(query)
+            return compiler.phase_one, sql, compiler.parameters
+    return [], *json_to_sql(query_object)
+
+def execute_query(connection, query_object):
+    """
+    Runs a query, filling the cohort table first when it has a phase one (see cohort_to_sql).
+
+    Args:
+        connection (sqlite3.Connection): A connection to the database.
+        query_object (dict): The query, as for json_to_sql.
+
+    Returns:
+        sqlite3.Cursor: The cursor over the query's rows.
+    """
+    phase_one, sql, parameters = cohort_to_sql(query_object)
+    if phase_one:
+        # The TEMP table lives in the connection's own temporary database, so it never
+        # touches the database file, and only its connection sees it
+        connection.execute(f"DROP TABLE IF EXISTS temp.{COHORT_TABLE}")
+        for statement in phase_one:
+            connection.execute(statement, parameters)
+        connection.commit()
+    return connection.execute(sql, parameters)
 
 
 def main():
@@ -319,7 +796,9 @@ def main():
   }
 }
     """
-    print(json_to_sql(query_json))
+    sql, parameters = json_to_sql(json.loads(query_json))
+    print(sql)
+    print(parameters)
 
 
 if __name__ == "__main__":
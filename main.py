@@ -4,6 +4,7 @@ import yaml
 import os
 import pandas as pd
 import threading
+import multiprocessing
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QVBoxLayout, QWidget, 
                            QLabel, QFileDialog, QPushButton, QMessageBox,
                            QStackedWidget, QHBoxLayout, QCheckBox, QScrollArea,
@@ -15,6 +16,11 @@ from return_column_search_bar import ReturnColumnSearchBar
 from canvas import Canvas
 from to_spss_data import one_hot_encode_csv
 from update_checker import UpdateChecker
+from pragma_profiles import apply_reader_pragmas
+from planner_stats import optimize_on_open, optimize_on_close
+from database_shards import open_database
+from database_swap import swap_database
+from result_cache import clear_result_cache
 
 def get_config_path():
     """Get the path for the config.yaml file inside the PyInstaller dist folder."""
@@ -161,6 +167,7 @@ class MainWindow(QMainWindow):
         """Setup the initial UI with database setup buttons on page 1"""
         self.setup_button = create_database_button(self)
         self.setup_button.database_created.connect(self.on_database_created)
+        self.setup_button.swap_requested.connect(self.hot_swap_database)
         self.setup_button.setFixedWidth(400)
 
         self.specify_db_button = QPushButton("Specify Database Path")
@@ -463,8 +470,35 @@ class MainWindow(QMainWindow):
         self.db_path = db_path
         self.config["database_path"] = db_path
         save_config(self.config)  # Save the new database path to config
-        self.connect_database(db_path)  # Connect to the new database
+        # hot_swap_database already connected to the new build unless the swap failed
+        if self.db_connection is None:
+            self.connect_database(db_path)  # Connect to the new database
         self.setup_button.setVisible(False)  # Hide the button after database creation
+
+    def hot_swap_database(self, db_path):
+        """
+        Swap a finished build in without restarting. The connection to the old file is closed,
+        the new build renamed over it and opened, and the search bars are refilled from it;
+        the canvas keeps its items.
+        """
+        # A running query holds the old file open on its own connection
+        if getattr(self, "draggable_canvas", None):
+            self.draggable_canvas.wait_for_query()
+        if self.db_connection:
+            optimize_on_close(self.db_connection)
+            self.db_connection.close()
+            self.db_connection = None
+        try:
+            # Results cached from the old build would not match the new one
+            if swap_database(db_path):
+                clear_result_cache(db_path)
+        except OSError as e:
+            QMessageBox.critical(
+                self,
+                "Database Error",
+                f"Could not swap in the new database: {str(e)}"
+            )
+        self.connect_database(db_path, keep_canvas=True)
     
     def setup_main_ui(self):
         """Setup the main UI with search bars and canvas on page 1"""
@@ -492,6 +526,29 @@ class MainWindow(QMainWindow):
         for widget in self.search_widgets:
             self.page1_layout.addWidget(widget)
     
+    def refresh_search_bars(self):
+        """Rebuild the search bars from the current database, keeping the canvas"""
+        return_column_search_bar = ReturnColumnSearchBar(self.db_connection)
+        return_column_search_bar.setFixedHeight(250)
+
+        filter_search_bar = FilterSearchBar(self.db_connection)
+        filter_search_bar.setFixedHeight(250)
+        filter_search_bar.canvas = self.draggable_canvas
+
+        for old_widget, new_widget in ((self.return_column_search_bar, return_column_search_bar),
+                                       (self.filter_search_bar, filter_search_bar)):
+            self.page1_layout.replaceWidget(old_widget, new_widget)
+            old_widget.setParent(None)
+            old_widget.deleteLater()
+
+        self.return_column_search_bar = return_column_search_bar
+        self.filter_search_bar = filter_search_bar
+        self.search_widgets = [
+            self.return_column_search_bar,
+            self.filter_search_bar,
+            self.draggable_canvas
+        ]
+    
     def clear_main_ui(self):
         """Clear the main UI components"""
         if hasattr(self, 'search_widgets'):
@@ -513,15 +570,20 @@ class MainWindow(QMainWindow):
             self.connect_database(file_path)
             self.setup_button.setVisible(False)  # Hide the button after specifying a new database
     
-    def connect_database(self, db_path):
-        """Connect to the database and update UI"""
+    def connect_database(self, db_path, keep_canvas=False):
+        """Connect to the database and update UI, keeping the canvas items if asked to"""
         try:
             # Close existing connection if any
             if self.db_connection:
+                optimize_on_close(self.db_connection)
                 self.db_connection.close()
             
             # Try to connect to the database
-            self.db_connection = sqlite3.connect(db_path)
+            # The shards of a sharded build are attached under one schema
+            self.db_connection = open_database(db_path)
+            apply_reader_pragmas(self.db_connection)
+            # Keeps the planner statistics the build stored up to date as the file changes
+            optimize_on_open(self.db_connection)
             
             # Update config
             self.db_path = db_path
@@ -529,7 +591,10 @@ class MainWindow(QMainWindow):
             save_config(self.config)
             
             # Update UI
-            self.setup_main_ui()
+            if keep_canvas and getattr(self, "search_widgets", None):
+                self.refresh_search_bars()
+            else:
+                self.setup_main_ui()
             
         except sqlite3.Error as e:
             QMessageBox.critical(
@@ -540,11 +605,16 @@ class MainWindow(QMainWindow):
     
     def closeEvent(self, event):
         """Handle application closing"""
+        if getattr(self, "draggable_canvas", None):
+            self.draggable_canvas.wait_for_query()
         if self.db_connection:
+            optimize_on_close(self.db_connection)
             self.db_connection.close()
         event.accept()
 
 def main():
+    # Needed for the database build's parse workers in the frozen app
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     screen_rect = app.desktop().screenGeometry()
     window = MainWindow(screen_rect.width(), screen_rect.height())
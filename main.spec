@@ -9,6 +9,7 @@ a = Analysis(
         ('updater.py', '.'),
         ('./sql_scripts/*', './sql_scripts/'),
         ('./config.yaml', './'),
+        ('./column_profiles.yaml', './'),
     ],
     hiddenimports=['psutil._psutil_windows', 'psutil._psutil_common', 'psutil'],
     hookspath=[],
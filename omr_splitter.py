@@ -0,0 +1,83 @@
+# Tables holding a single numeric result: (table, value column) -> result_names that feed it
+VALUE_TABLES = {
+    ("patient_weight", "weight_lbs"): ["Weight (Lbs)", "Weight"],
+    ("patient_bmi", "bmi_value"): ["BMI (kg/m2)", "BMI"],
+    ("patient_height", "height_inches"): ["Height (Inches)", "Height"],
+    ("patient_eGFR", "eGFR"): ["eGFR"],
+}
+
+# Tables holding a "systolic/diastolic" reading, keyed by their result_name
+BLOOD_PRESSURE_TABLES = {
+    "Blood Pressure": "patient_blood_pressure",
+    "Blood Pressure Sitting": "patient_blood_pressure_sitting",
+    "Blood Pressure Standing (1 min)": "patient_blood_pressure_standing_1min",
+    "Blood Pressure Standing (3 mins)": "patient_blood_pressure_standing_3mins",
+    "Blood Pressure Standing": "patient_blood_pressure_standing",
+    "Blood Pressure Lying": "patient_blood_pressure_lying",
+}
+
+OMR_SPLIT_TABLES = [table_name for table_name, _ in VALUE_TABLES] + list(BLOOD_PRESSURE_TABLES.values())
+
+# A reading is split at its first slash; without one the systolic part is empty
+SYSTOLIC_SQL = "CAST(SUBSTR(result_value, 1, INSTR(result_value, '/') - 1) AS INTEGER)"
+DIASTOLIC_SQL = "CAST(SUBSTR(result_value, INSTR(result_value, '/') + 1) AS INTEGER)"
+
+
+def get_split_statements():
+    """
+    Builds one INSERT ... SELECT per split table that copies the omr rows after a given rowid.
+
+    Returns:
+        list: (statement, result_names) pairs. Each statement takes the rowid to start after
+              followed by its result_names as parameters.
+    """
+    statements = []
+    for (table_name, value_column), result_names in VALUE_TABLES.items():
+        placeholders = ", ".join("?" for _ in result_names)
+        statements.append((
+            f'INSERT INTO "{table_name}" (subject_id, chartdate, seq_num, "{value_column}") '
+            f'SELECT subject_id, chartdate, seq_num, CAST(result_value AS REAL) FROM omr '
+            f'WHERE rowid > ? AND result_name IN ({placeholders})',
+            result_names
+        ))
+    for result_name, table_name in BLOOD_PRESSURE_TABLES.items():
+        statements.append((
+            f'INSERT INTO "{table_name}" (subject_id, chartdate, seq_num, systolic, diastolic) '
+            f'SELECT subject_id, chartdate, seq_num, {SYSTOLIC_SQL}, {DIASTOLIC_SQL} FROM omr '
+            f'WHERE rowid > ? AND result_name = ?',
+            [result_name]
+        ))
+    return statements
+
+
+def split_omr_rows(connection, after_rowid=0):
+    """
+    Routes the omr rows after a rowid to the patient_* tables by result_name.
+
+    During a build the writer calls this for every omr batch right after inserting it, inside
+    the same transaction. The rowid range limits every statement to the new batch, whose
+    pages are still in the page cache, so omr is never scanned again once it is loaded.
+
+    Args:
+        connection (sqlite3.Connection): The connection that owns all writes.
+        after_rowid (int): The largest omr rowid that was already split.
+    """
+    for statement, result_names in get_split_statements():
+        connection.execute(statement, (after_rowid, *result_names))
+
+
+def clear_omr_split_tables(connection):
+    """
+    Empties every table derived from omr, for when omr itself is reloaded.
+    """
+    for table_name in OMR_SPLIT_TABLES:
+        connection.execute(f'DELETE FROM "{table_name}"')
+
+
+def split_omr_table(connection):
+    """
+    Rebuilds the split tables from an omr table that is already loaded.
+    """
+    clear_omr_split_tables(connection)
+    split_omr_rows(connection)
+    connection.commit()
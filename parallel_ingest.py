@@ -0,0 +1,269 @@
+import os
+import time
+import queue
+import pickle
+import multiprocessing
+import numpy as np
+import pandas as pd
+from compressed_sources import open_source
+from table_schema import get_read_options, get_integer_columns, insert_statement
+from ingest_progress import IngestProgress, schedule_jobs
+from column_encoding import encode_chunk, insert_new_values, get_storage_name
+from time_columns import add_epoch_values, get_epoch_column
+
+# Message kinds sent from the parse workers to the writer
+BATCH = "batch"
+DONE = "done"
+FAILED = "failed"
+
+DEFAULT_CHUNKSIZE = 100000  # Rows parsed per chunk
+DEFAULT_QUEUE_SIZE = 8  # Parsed chunks allowed in flight before workers block
+
+# The queue each worker process puts its parsed batches on (set by _init_parse_worker)
+_batch_queue = None
+
+
+def default_worker_count():
+    """
+    Leave one core for the writer, which owns the SQLite connection.
+    """
+    return max(1, (os.cpu_count() or 2) - 1)
+
+
+def _init_parse_worker(batch_queue):
+    """
+    Runs once in every pool process to hand it the shared batch queue.
+    """
+    global _batch_queue
+    _batch_queue = batch_queue
+
+
+def column_to_objects(series, is_integer=False):
+    """
+    Converts one parsed column into an object array of values sqlite3 can bind directly.
+    Missing values become None and numpy scalars become plain Python ints/floats/strs.
+    A column declared INTEGER arrives as float64 and is turned back into ints, unless it
+    actually holds fractional values, which are then left as floats.
+    """
+    if is_integer and series.dtype.kind == "f":
+        values = series.to_numpy()
+        missing = np.isnan(values)
+        present = values[~missing]
+        if np.isfinite(present).all() and np.array_equal(present, np.trunc(present)):
+            objects = np.where(missing, 0, values).astype(np.int64).astype(object)
+            objects[missing] = None
+            return objects
+    return series.to_numpy(dtype=object, na_value=None)
+
+
+def chunk_to_rows(chunk, integer_columns=frozenset()):
+    """
+    Converts a parsed DataFrame chunk into a list of row tuples that sqlite3 can bind directly.
+    """
+    columns = [column_to_objects(chunk[column], column in integer_columns) for column in chunk.columns]
+    return list(zip(*columns))
+
+
+def _read_chunks(source, csv_file_path, table_name, chunksize, skip_rows, strict, columns=None):
+    """
+    Starts a chunked pandas reader over a source that parses each column into its declared type.
+    """
+    read_options = {"chunksize": chunksize, **get_read_options(table_name, strict, columns)}
+    if not read_options.get("dtype"):
+        # Tables missing from create_tables.sql fall back to pandas' own type inference
+        read_options["low_memory"] = False
+    if skip_rows:
+        # The header is read separately so the parser can skip committed rows without
+        # converting them
+        with open_source(csv_file_path) as header_source:
+            header = list(pd.read_csv(header_source, nrows=0).columns)
+        read_options.update(header=None, names=header, skiprows=skip_rows + 1)
+    return pd.read_csv(source, **read_options)
+
+
+def parse_csv_file(csv_file_path, table_name, chunksize=DEFAULT_CHUNKSIZE, skip_rows=0, columns=None,
+                   value_codes=None, epoch_columns=None):
+    """
+    Parses one CSV file in chunks inside a pool process and puts each ready row batch on the queue.
+    Columns are parsed straight into the types create_tables.sql declares, and only declared
+    columns are read. Compressed sources are streamed through a decompression thread instead
+    of being unpacked.
+
+    Args:
+        csv_file_path (str): The CSV file to parse (.csv, .csv.gz or .csv.zst).
+        table_name (str): The table the rows belong to.
+        chunksize (int): Number of rows per batch.
+        skip_rows (int): Data rows already committed by an earlier, interrupted build.
+        columns (tuple, optional): The columns a column profile keeps. Defaults to every
+            declared column.
+        value_codes (dict, optional): For a dictionary-encoded table, column name -> the values
+            that already have codes (see column_encoding.load_value_codes). Those columns are
+            sent as integer codes, with every newly coded value in the batch that first has it.
+        epoch_columns (list, optional): Timestamps whose epoch second shadow columns are sent
+            along with them (see time_columns.add_epoch_values).
+    """
+    rows_parsed = 0
+    strict = True
+    integer_columns = (get_integer_columns(table_name) | set(value_codes or ())
+                       | {get_epoch_column(column_name) for column_name in epoch_columns or ()})
+    try:
+        while True:
+            try:
+                with open_source(csv_file_path) as source:
+                    for chunk in _read_chunks(source, csv_file_path, table_name, chunksize,
+                                              skip_rows + rows_parsed, strict, columns):
+                        new_values = encode_chunk(chunk, value_codes) if value_codes else None
+                        if epoch_columns:
+                            add_epoch_values(chunk, epoch_columns)
+                        rows = chunk_to_rows(chunk, integer_columns)
+                        rows_parsed += len(rows)
+                        # Batches wait in this process until the queue's feeder thread sends them.
+                        # Pickled they take a fraction of the memory of the boxed row tuples, which
+                        # keeps a worker's footprint flat however far the writer falls behind.
+                        payload = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+                        del rows
+                        # Blocks while the writer is behind, which bounds memory use
+                        _batch_queue.put((BATCH, table_name, list(chunk.columns), payload, source.bytes_consumed(),
+                                          new_values))
+                break
+            except (ValueError, TypeError) as e:
+                if not strict:
+                    raise
+                # A column holds values that do not fit its declared type. Everything already
+                # sent is kept and the rest of the file is read as text, which SQLite converts.
+                print(f"{table_name} does not match its declared types ({e}), reading the rest as text.")
+                strict = False
+        _batch_queue.put((DONE, table_name, rows_parsed))
+    except Exception as e:
+        _batch_queue.put((FAILED, table_name, f"{type(e).__name__}: {e}"))
+
+
+def insert_rows(connection, table_name, columns, rows):
+    """
+    Inserts a batch of row tuples into a table with a single prepared statement.
+    sqlite3 keeps the compiled statement in its cache, so every batch reuses it.
+    """
+    connection.executemany(insert_statement(table_name, columns), rows)
+
+
+def run_parallel_ingest(connection, jobs, progress_callback=None, workers=None,
+                        chunksize=DEFAULT_CHUNKSIZE, queue_size=DEFAULT_QUEUE_SIZE, commit_every=1,
+                        manifest=None, batch_handlers=None, status_callback=None, progress_log=None,
+                        table_columns=None, table_encodings=None, table_epoch_columns=None):
+    """
+    Parses several CSV files at once in a process pool and writes every batch through this
+    process's connection, so SQLite only ever sees a single writer.
+
+    Args:
+        connection (sqlite3.Connection): The connection that owns all writes.
+        jobs (list): (csv_file_path, table_name, rows_to_skip) for every file to load.
+        progress_callback (pyqtSignal, optional): Receives percent complete (0-100), with every
+            file weighted by its decompressed size (see ingest_progress.IngestProgress).
+        workers (int, optional): Number of parse processes. Defaults to one per spare core.
+        chunksize (int): Number of rows per parsed batch.
+        queue_size (int): Maximum number of parsed batches waiting for the writer.
+        commit_every (int): Number of batches written per transaction.
+        manifest (BuildManifest, optional): Checkpoint record updated inside every transaction.
+        batch_handlers (dict, optional): Table name -> function(connection, after_rowid),
+            called right after each batch of that table is inserted, inside the same
+            transaction, with the largest rowid the table had before the batch. Tables derived
+            from the batch are filled while its rows are still cached and stay consistent with
+            the manifest's checkpoints.
+        status_callback (pyqtSignal, optional): Receives a status line with rows/s, MB/s and ETA.
+        progress_log (str, optional): JSON lines file that every batch and table is logged to.
+        table_columns (dict, optional): Table name -> the columns to read, from a column profile.
+            Tables not in it are read with every declared column.
+        table_encodings (dict, optional): Table name -> the value codes of its encoded columns,
+            for tables built with dictionary encoding. Their rows go into the encoded table and
+            the values each batch introduces into the lookup tables, in the same transaction.
+        table_epoch_columns (dict, optional): Table name -> the timestamps whose epoch second
+            shadow columns the workers fill.
+
+    Returns:
+        dict: Rows inserted per table.
+    """
+    if not jobs:
+        return {}
+
+    workers = min(workers or default_worker_count(), len(jobs))
+    progress = IngestProgress(jobs, progress_callback, status_callback, progress_log)
+    jobs = schedule_jobs(jobs, progress.weights)
+    progress.log("schedule", workers=workers, order=[table_name for _, table_name, _ in jobs])
+    # Spawn rather than fork so the pool never inherits Qt's threads
+    context = multiprocessing.get_context("spawn")
+    batch_queue = context.Queue(maxsize=queue_size)
+
+    rows_inserted = {table_name: skip_rows for _, table_name, skip_rows in jobs}
+    table_encodings = table_encodings or {}
+    storage_tables = {table_name: get_storage_name(table_name) for table_name in table_encodings}
+    total_files = len(jobs)
+    completed_files = 0
+    uncommitted_batches = 0
+    uncommitted_tables = set()
+
+    def commit():
+        # Row counts go into the same transaction as the rows they describe
+        if manifest:
+            for uncommitted_table in uncommitted_tables:
+                manifest.record_rows(uncommitted_table, rows_inserted[uncommitted_table])
+        connection.commit()
+        uncommitted_tables.clear()
+
+    with context.Pool(processes=workers, initializer=_init_parse_worker, initargs=(batch_queue,)) as pool:
+        results = [pool.apply_async(parse_csv_file, (csv_file_path, table_name, chunksize, skip_rows,
+                                                     (table_columns or {}).get(table_name),
+                                                     table_encodings.get(table_name),
+                                                     (table_epoch_columns or {}).get(table_name)))
+                   for csv_file_path, table_name, skip_rows in jobs]
+
+        wait_start = time.perf_counter()
+        while completed_files < total_files:
+            try:
+                message = batch_queue.get(timeout=1)
+            except queue.Empty:
+                # A worker that died without reporting would otherwise leave us waiting forever
+                if all(result.ready() for result in results) and batch_queue.empty():
+                    print("Parse workers exited before reporting every file.")
+                    break
+                continue
+
+            kind, table_name = message[0], message[1]
+            if kind == BATCH:
+                wait_seconds = time.perf_counter() - wait_start
+                columns, rows = message[2], pickle.loads(message[3])
+                storage_table = storage_tables.get(table_name, table_name)
+                batch_handler = (batch_handlers or {}).get(table_name)
+                if batch_handler:
+                    after_rowid = connection.execute(f'SELECT MAX(rowid) FROM "{storage_table}"').fetchone()[0] or 0
+                if message[5]:
+                    insert_new_values(connection, table_name, message[5])
+                insert_rows(connection, storage_table, columns, rows)
+                if batch_handler:
+                    batch_handler(connection, after_rowid)
+                rows_inserted[table_name] += len(rows)
+                uncommitted_tables.add(table_name)
+                uncommitted_batches += 1
+                if uncommitted_batches >= commit_every:
+                    commit()
+                    uncommitted_batches = 0
+                print(f"Inserted a chunk of data into {table_name} - rows complete: ({rows_inserted[table_name]})")
+                insert_seconds = time.perf_counter() - wait_start - wait_seconds
+                progress.batch_inserted(table_name, len(rows), message[4], wait_seconds, insert_seconds)
+                wait_start = time.perf_counter()
+                continue
+
+            if kind == DONE and manifest:
+                manifest.mark_table_complete(table_name, rows_inserted[table_name])
+            commit()
+            uncommitted_batches = 0
+            if kind == DONE:
+                print(f"Inserted all data into {table_name}.")
+            else:
+                print(f"Error loading {table_name}: {message[2]}")
+
+            completed_files += 1
+            progress.table_finished(table_name, None if kind == DONE else message[2])
+            wait_start = time.perf_counter()
+
+    progress.finish()
+    return rows_inserted
@@ -0,0 +1,496 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import numpy as np
+from json_to_sql import TABLE_RELATIONSHIPS, get_table_parent, build_filter_query, filter_to_sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # the Parquet cache is optional; every query still runs in SQLite without it
+    pa = None
+
+# The event tables large enough for a columnar copy to pay off
+PARQUET_TABLES = ["chartevents", "labevents", "inputevents", "emar"]
+
+# Files are partitioned by subject_id // SUBJECT_BUCKET_SIZE, stored in the hive style
+# directory name subject_bucket=<n>. MIMIC subject_ids span 10000000-19999999, so about 100
+# partitions per table.
+SUBJECT_BUCKET_SIZE = 100000
+BUCKET_COLUMN = "subject_bucket"
+
+EXPORT_BATCH_ROWS = 100000  # Rows fetched from SQLite per Arrow record batch
+ROWS_PER_GROUP = 65536  # Smaller row groups give the column statistics finer ranges
+
+CACHE_MANIFEST = "cache_manifest.json"
+
+# A literal SQLite treats as a number when it is compared with a numeric column
+NUMERIC_LITERAL = re.compile(r"^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$")
+
+
+def parquet_available():
+    return pa is not None
+
+
+def get_cache_directory(database_path):
+    """
+    Returns the directory holding the Parquet cache of a database: MIMIC_Database.db keeps
+    its cache in MIMIC_Database_parquet next to it.
+    """
+    root, _ = os.path.splitext(database_path)
+    return f"{root}_parquet"
+
+
+def get_column_types(connection, table_name):
+    """
+    Returns (column name, declared type) pairs of a table as it exists in the database, after
+    the stay_id columns were renamed.
+    """
+    return [(row[1], row[2].upper()) for row in connection.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def _arrow_type(sql_type):
+    if sql_type == "INTEGER":
+        return pa.int64()
+    if sql_type == "REAL":
+        return pa.float64()
+    return pa.string()
+
+
+def _read_cache_manifest(cache_directory):
+    try:
+        with open(os.path.join(cache_directory, CACHE_MANIFEST), "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"bucket_size": SUBJECT_BUCKET_SIZE, "tables": {}}
+
+
+def _write_cache_manifest(cache_directory, cache_manifest):
+    manifest_path = os.path.join(cache_directory, CACHE_MANIFEST)
+    with open(manifest_path + ".tmp", "w") as file:
+        json.dump(cache_manifest, file, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def _source_hash(connection, table_name):
+    # The cache of a table is only valid for the source file the database was built from
+    try:
+        row = connection.execute(
+            "SELECT source_hash FROM _build_manifest WHERE table_name = ? AND status = 'complete'",
+            (table_name,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def export_table(connection, table_name, table_directory, bucket_size=SUBJECT_BUCKET_SIZE):
+    """
+    Streams one table out of SQLite into Parquet files partitioned by subject_id range.
+    Parquet stores min/max statistics for every column of every row group, which lets a
+    filtered read skip row groups whose range cannot match.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_name (str): The table to export. It must have a subject_id column.
+        table_directory (str): Directory the partitions are written into.
+        bucket_size (int): Number of subject_ids per partition.
+
+    Returns:
+        tuple: (rows written, column names)
+    """
+    column_types = get_column_types(connection, table_name)
+    column_names = [column_name for column_name, _ in column_types]
+    schema = pa.schema([(column_name, _arrow_type(column_type)) for column_name, column_type in column_types])
+    column_list = ", ".join(f'"{column_name}"' for column_name in column_names)
+
+    # Rows are buffered per partition until they fill a row group. MIMIC files are sorted by
+    # subject_id, so only one or two partitions hold rows at any time.
+    writers = {}
+    buffers = {}
+    rows_written = 0
+
+    def flush(bucket):
+        if bucket not in writers:
+            partition = "__HIVE_DEFAULT_PARTITION__" if bucket is None else bucket
+            partition_directory = os.path.join(table_directory, f"{BUCKET_COLUMN}={partition}")
+            os.makedirs(partition_directory, exist_ok=True)
+            writers[bucket] = pq.ParquetWriter(os.path.join(partition_directory, "part-0.parquet"), schema,
+                                               compression="zstd")
+        writers[bucket].write_table(pa.Table.from_batches(buffers.pop(bucket), schema),
+                                    row_group_size=ROWS_PER_GROUP)
+
+    try:
+        cursor = connection.execute(f'SELECT {column_list} FROM "{table_name}"')
+        while True:
+            rows = cursor.fetchmany(EXPORT_BATCH_ROWS)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            batch = pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, schema)], schema=schema
+            )
+            buckets = pc.divide(batch.column("subject_id"), bucket_size)
+            for bucket in pc.unique(buckets).to_pylist():
+                mask = pc.is_null(buckets) if bucket is None else pc.equal(buckets, bucket)
+                buffers.setdefault(bucket, []).append(batch.filter(mask))
+                if sum(part.num_rows for part in buffers[bucket]) >= ROWS_PER_GROUP:
+                    flush(bucket)
+            rows_written += len(rows)
+        for bucket in list(buffers):
+            flush(bucket)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return rows_written, column_names
+
+
+def build_parquet_cache(connection, database_path, tables=PARQUET_TABLES, bucket_size=SUBJECT_BUCKET_SIZE):
+    """
+    Writes the large event tables to a Parquet cache next to the database. Each table is
+    written into a temporary directory that replaces the old copy only once it is complete.
+    A table whose values do not fit its declared types is left out of the cache; queries on it
+    keep running in SQLite.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        database_path (str): Path of the database file, which decides where the cache goes.
+        tables (list): Tables to export.
+        bucket_size (int): Number of subject_ids per partition.
+
+    Returns:
+        dict: Table name -> (rows, seconds, bytes on disk) for every table that was written.
+    """
+    if pa is None:
+        print("Skipping the Parquet cache: install pyarrow to build it.")
+        return {}
+
+    cache_directory = get_cache_directory(database_path)
+    os.makedirs(cache_directory, exist_ok=True)
+    cache_manifest = _read_cache_manifest(cache_directory)
+    if cache_manifest.get("bucket_size") != bucket_size:
+        cache_manifest = {"bucket_size": bucket_size, "tables": {}}
+
+    report = {}
+    for table_name in tables:
+        if not get_column_types(connection, table_name):
+            print(f"Skipping the Parquet cache of {table_name}: the table does not exist.")
+            continue
+
+        table_directory = os.path.join(cache_directory, table_name)
+        temporary_directory = table_directory + ".tmp"
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        cache_manifest["tables"].pop(table_name, None)
+        _write_cache_manifest(cache_directory, cache_manifest)
+        start_time = time.perf_counter()
+        try:
+            rows_written, column_names = export_table(connection, table_name, temporary_directory, bucket_size)
+        except (pa.ArrowException, ValueError) as e:
+            print(f"Skipping the Parquet cache of {table_name}: {e}")
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+            shutil.rmtree(table_directory, ignore_errors=True)
+            continue
+
+        shutil.rmtree(table_directory, ignore_errors=True)
+        os.replace(temporary_directory, table_directory)
+        cache_manifest["tables"][table_name] = {
+            "rows": rows_written,
+            "columns": column_names,
+            "source_hash": _source_hash(connection, table_name),
+        }
+        _write_cache_manifest(cache_directory, cache_manifest)
+
+        size = sum(os.path.getsize(os.path.join(directory, file_name))
+                   for directory, _, file_names in os.walk(table_directory) for file_name in file_names)
+        report[table_name] = (rows_written, time.perf_counter() - start_time, size)
+        print(f"Wrote {rows_written} rows of {table_name} to the Parquet cache "
+              f"({size / 1024 ** 2:.1f} MB) in {report[table_name][1]:.2f} s")
+
+    _write_cache_manifest(cache_directory, cache_manifest)
+    return report
+
+
+class _NotCacheable(Exception):
+    """
+    Raised while planning a query the Parquet cache cannot answer exactly.
+    """
+
+
+def _child_tables(table_name):
+    # Lookup tables joined directly below a table, such as chartevents_d_items below chartevents
+    return {child: join["conditions"][0] for child, join in TABLE_RELATIONSHIPS["special_joins"].items()
+            if join.get("parent") == table_name}
+
+
+def _numeric_literal(value):
+    value = str(value)
+    if not NUMERIC_LITERAL.match(value):
+        return None
+    number = float(value)
+    return int(number) if number.is_integer() and abs(number) < 2 ** 53 else number
+
+
+class _CachedQuery:
+    """
+    Evaluates a json_to_sql query object over the Parquet files of one table.
+
+    json_to_sql joins every table up to patients and filters inside that join. Over a single
+    event table T this reduces to: rows of T whose parent key exists in the chain of parent
+    tables, whose lookup children (the d_items views) match, and that pass the filters. The
+    parent and lookup key sets are small and come from SQLite; the filters on T itself and the
+    selected columns are pushed down into the Parquet scan.
+    """
+
+    def __init__(self, connection, dataset, table_name, select_columns, diagnosed_in):
+        self.connection = connection
+        self.dataset = dataset
+        self.table_name = table_name
+        self.select_columns = select_columns
+        self.diagnosed_in = diagnosed_in
+        self.column_types = dict(get_column_types(connection, table_name))
+        self.children = _child_tables(table_name)
+        self.key_sets = {}
+
+    def _key_set(self, sql, parameters=None):
+        key = (sql, tuple(sorted((parameters or {}).items())))
+        if key not in self.key_sets:
+            self.key_sets[key] = [row[0] for row in self.connection.execute(sql, parameters or {}) if row[0] is not None]
+        return self.key_sets[key]
+
+    def _isin(self, column_name, keys):
+        # A key of another type can never equal a value of this column
+        value_type = self.dataset.schema.field(column_name).type
+        if pa.types.is_string(value_type):
+            keys = [key for key in keys if isinstance(key, str)]
+        elif pa.types.is_integer(value_type):
+            keys = [int(key) for key in keys if isinstance(key, int) or (isinstance(key, float) and key.is_integer())]
+        else:
+            keys = [float(key) for key in keys if isinstance(key, (int, float))]
+        expression = pc.field(column_name).isin(pa.array(keys, type=value_type))
+        if column_name == "subject_id":
+            # Lets the scan skip whole partitions, not just row groups
+            buckets = sorted({key // SUBJECT_BUCKET_SIZE for key in keys if isinstance(key, int)})
+            expression = expression & pc.field(BUCKET_COLUMN).isin(buckets)
+        return expression
+
+    def _parent_chain_sql(self):
+        # The parent keys that survive the joins up to patients, as (column, parent column, SQL)
+        parent_table, join_condition = get_table_parent(self.table_name, self.diagnosed_in)
+        if parent_table is None:
+            return None, None, None
+        parent_column, column_name = join_condition
+        return column_name, parent_column, build_filter_query([], "AND", f"{parent_table}.{parent_column}", {parent_table},
+                                               self.diagnosed_in)
+
+    def _parent_filter(self):
+        column_name, _, sql = self._parent_chain_sql()
+        if sql is None:
+            return None
+        return self._isin(column_name, self._key_set(sql))
+
+    def _scan_all_joined_rows(self):
+        """
+        Reads every row of the table as the join without DISTINCT returns it: a row appears
+        once for every parent chain row it joins to, which is once whenever the parent keys
+        are unique.
+        """
+        column_name, parent_column, sql = self._parent_chain_sql()
+        if sql is None:
+            return self.dataset.to_table(columns=self.select_columns)
+        key_counts = dict(self.connection.execute(
+            f"SELECT {parent_column}, COUNT(*) FROM ({sql}) WHERE {parent_column} IS NOT NULL GROUP BY {parent_column}"
+        ).fetchall())
+        columns = list(dict.fromkeys([*self.select_columns, column_name]))
+        table = self.dataset.to_table(columns=columns, filter=self._isin(column_name, list(key_counts)))
+        if all(count == 1 for count in key_counts.values()):
+            return table.select(self.select_columns)
+        keys = pa.array(list(key_counts), type=table.schema.field(column_name).type)
+        counts = pa.array(list(key_counts.values()), type=pa.int64())
+        repeats = pc.take(counts, pc.index_in(table[column_name], value_set=keys)).to_numpy()
+        return table.take(np.repeat(np.arange(table.num_rows), repeats)).select(self.select_columns)
+
+    def _child_filter(self, child_table, filters):
+        column_name, child_column = self.children[child_table]
+        sql = f"SELECT DISTINCT {child_table}.{child_column} FROM {child_table}"
+        parameters = {}
+        if filters:
+            sql += " WHERE " + " AND ".join(filter_to_sql(filter_obj, parameters) for filter_obj in filters)
+        return self._isin(column_name, self._key_set(sql, parameters))
+
+    def _column_filter(self, filter_obj):
+        column_name = filter_obj["column"]
+        column_type = self.column_types.get(column_name)
+        if column_type is None:
+            raise _NotCacheable(f"{self.table_name} has no column {column_name}")
+        field = pc.field(column_name)
+
+        if filter_obj["filter_type"] == "range":
+            low, high = _numeric_literal(filter_obj["min"]), _numeric_literal(filter_obj["max"])
+            if column_type not in ("INTEGER", "REAL") or low is None or high is None:
+                raise _NotCacheable("only numeric ranges over numeric columns are cached")
+            return (field >= low) & (field <= high)
+
+        if filter_obj["filter_type"] == "value":
+            value = filter_obj["value"]
+            if column_type not in ("INTEGER", "REAL"):
+                return field == str(value)
+            # SQLite compares a numeric column with the number a well-formed literal spells
+            number = _numeric_literal(value)
+            return field == number if number is not None else pc.scalar(False)
+
+        raise _NotCacheable(f"unknown filter type {filter_obj['filter_type']}")
+
+    def _group_filter(self, filters, operator):
+        """
+        Builds the dataset filter of one filter group, the WHERE clause of build_filter_query.
+        """
+        own_filters = []
+        child_filters = {}
+        for filter_obj in filters:
+            if filter_obj.get("relative_to"):
+                # A relative time window joins the table its window starts from
+                raise _NotCacheable("relative time windows")
+            if filter_obj["table"] == self.table_name:
+                own_filters.append(filter_obj)
+            elif filter_obj["table"] in self.children:
+                child_filters.setdefault(filter_obj["table"], []).append(filter_obj)
+            else:
+                raise _NotCacheable(f"filter on {filter_obj['table']}")
+
+        required = [self._parent_filter()]
+        if operator == "OR":
+            # Every joined child still needs a matching row, whichever condition holds
+            required += [self._child_filter(child_table, []) for child_table in child_filters]
+            alternatives = [self._column_filter(filter_obj) for filter_obj in own_filters]
+            alternatives += [self._child_filter(child_table, [filter_obj])
+                             for child_table, child_group in child_filters.items() for filter_obj in child_group]
+            if alternatives:
+                any_alternative = alternatives[0]
+                for alternative in alternatives[1:]:
+                    any_alternative = any_alternative | alternative
+                required.append(any_alternative)
+        else:
+            # Conditions on one child must hold for the same child row
+            required += [self._child_filter(child_table, child_group)
+                         for child_table, child_group in child_filters.items()]
+            required += [self._column_filter(filter_obj) for filter_obj in own_filters]
+
+        expression = None
+        for condition in required:
+            if condition is not None:
+                expression = condition if expression is None else expression & condition
+        return expression
+
+    def _scan(self, filters, operator):
+        return self.dataset.to_table(columns=self.select_columns, filter=self._group_filter(filters, operator))
+
+    def _distinct(self, table):
+        return table.group_by(self.select_columns, use_threads=False).aggregate([])
+
+    def _combine(self, parts, operator):
+        if len(parts) == 1:
+            return parts[0]
+        combined = pa.concat_tables(parts)
+        if operator == "OR":
+            return self._distinct(combined)
+        # A row is in the intersection when every distinct part holds it. Grouping treats
+        # NULLs as equal, as INTERSECT does.
+        counted = combined.group_by(self.select_columns, use_threads=False).aggregate(
+            [(self.select_columns[0], "count", pc.CountOptions(mode="all"))]
+        )
+        count_column = counted.column_names[-1]
+        return counted.filter(pc.equal(counted[count_column], len(parts))).select(self.select_columns)
+
+    def evaluate(self, query, top_level=True):
+        """
+        Mirrors json_to_sql.query_to_sql: every filter group and subquery is made distinct,
+        then the parts are combined with UNION for OR and INTERSECT for AND.
+        """
+        filters = query.get("filters", [])
+        subqueries = query.get("subqueries", [])
+        operator = query.get("operator", "AND")
+
+        parts = []
+        if filters:
+            parts.append(self._distinct(self._scan(filters, operator)))
+        for subquery in subqueries:
+            parts.append(self._distinct(self.evaluate(subquery, top_level=False)))
+        if parts:
+            return self._combine(parts, operator)
+        # A query with nothing in it selects every joined row, without DISTINCT at the top
+        if top_level:
+            return self._scan_all_joined_rows()
+        return self._distinct(self._scan([], operator))
+
+
+def _collect_filter_tables(query, tables):
+    for filter_obj in query.get("filters", []):
+        tables.add(filter_obj["table"])
+    for subquery in query.get("subqueries", []):
+        _collect_filter_tables(subquery, tables)
+    return tables
+
+
+def _row_chunks(table, chunk_size):
+    for batch in table.to_batches(max_chunksize=chunk_size):
+        if batch.num_rows:
+            yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def query_parquet_cache(connection, database_path, query_object, chunk_size=1000):
+    """
+    Answers a query from the Parquet cache when every selected column comes from one cached
+    table and every filter is on that table or on its d_items view. Only the selected columns
+    and the columns the filters need are read, and partitions and row groups whose statistics
+    rule out the filters are skipped.
+
+    Args:
+        connection (sqlite3.Connection): The open database, used for the small key lookups.
+        database_path (str): Path of the database file the cache belongs to.
+        query_object (dict): The query object json_to_sql takes.
+        chunk_size (int): Rows per chunk yielded.
+
+    Returns:
+        tuple: (column names, iterator of row lists) with the same rows the SQL query returns,
+               or None when the cache cannot answer the query and it has to run in SQLite.
+    """
+    if pa is None or not database_path:
+        return None
+
+    select_tables = query_object.get("select_tables", [])
+    table_names = {table["name"] for table in select_tables}
+    if len(table_names) != 1:
+        return None
+    table_name = table_names.pop()
+    select_columns = [column for table in select_tables for column in table["columns"]]
+    if table_name not in PARQUET_TABLES or not select_columns or len(set(select_columns)) != len(select_columns):
+        return None
+
+    # The cache must be a complete export of the table as it was built from its current source
+    cache_directory = get_cache_directory(database_path)
+    cached_table = _read_cache_manifest(cache_directory)["tables"].get(table_name)
+    source_hash = _source_hash(connection, table_name)
+    if cached_table is None or source_hash is None or cached_table.get("source_hash") != source_hash:
+        return None
+    if not set(select_columns) <= set(cached_table["columns"]):
+        return None
+
+    filter_tables = _collect_filter_tables(query_object["query"], set())
+    if not filter_tables <= {table_name, *_child_tables(table_name)}:
+        return None
+
+    dataset = ds.dataset(os.path.join(cache_directory, table_name), format="parquet", partitioning="hive")
+    cached_query = _CachedQuery(connection, dataset, table_name, select_columns, query_object.get("diagnosed_in"))
+    try:
+        result = cached_query.evaluate(query_object["query"])
+    except _NotCacheable as e:
+        print(f"Running the query in SQLite: {e}")
+        return None
+
+    print(f"Answered the query from the Parquet cache of {table_name}: {result.num_rows} rows.")
+    return select_columns, _row_chunks(result, chunk_size)
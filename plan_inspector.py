@@ -0,0 +1,349 @@
+import re
+import sys
+import time
+import sqlite3
+from contextlib import closing
+from json_to_sql import json_to_sql, get_table_parent, get_table_path, get_filter_tables, mark_filter
+from column_encoding import STORAGE_PREFIX
+from time_columns import get_epoch_column
+from item_catalog import ITEM_VIEWS
+from database_shards import open_database, get_schema_names
+from index_builder import build_indexes, index_name
+from planner_stats import get_query_plan_steps
+
+# What a plan step is flagged for
+FULL_SCAN = "full scan"
+AUTOMATIC_INDEX = "automatic index"
+TEMP_BTREE = "temp b-tree"
+
+# Tables with fewer rows than this, by their ANALYZE statistics, are cheap to read whole, so
+# scanning them is not flagged
+SMALL_TABLE_ROWS = 10000
+
+# SCAN or SEARCH, the table or alias, and how it is read
+STEP_PATTERN = re.compile(r"^(SCAN|SEARCH) (\S+)(?: USING (.*))?$")
+AUTOMATIC_INDEX_PATTERN = re.compile(r"AUTOMATIC (?:PARTIAL )?(?:COVERING )?INDEX \((.*?)\)")
+INDEX_NAME_PATTERN = re.compile(r"INDEX (\w+)")
+CONSTRAINT_COLUMN_PATTERN = re.compile(r"(\w+)\s*(?:=|>|<|IS\b|IN\b)")
+
+
+def _logical_table(table_name):
+    """The name queries use for a stored table: an encoded table is read through its view"""
+    return table_name[len(STORAGE_PREFIX):] if table_name.startswith(STORAGE_PREFIX) else table_name
+
+
+def _index_table(table_name):
+    """The table an index for table_name goes on: the d_items views are read from d_items"""
+    return "d_items" if table_name in ITEM_VIEWS.values() else table_name
+
+
+def load_indexes(connection):
+    """
+    Returns index name -> (table, columns) for every index of the database and its shards,
+    under the table names queries use.
+    """
+    indexes = {}
+    for schema in get_schema_names(connection):
+        for name, table_name in connection.execute(
+                f'SELECT name, tbl_name FROM "{schema}".sqlite_master WHERE type = \'index\'').fetchall():
+            columns = tuple(row[2] for row in connection.execute(f'PRAGMA "{schema}".index_info("{name}")'))
+            indexes[name] = (_logical_table(table_name), columns)
+    return indexes
+
+
+def load_row_counts(connection):
+    """
+    Returns table -> rows as ANALYZE last counted them. Tables never analyzed are left out.
+    """
+    row_counts = {}
+    for schema in get_schema_names(connection):
+        try:
+            rows = connection.execute(f'SELECT tbl, stat FROM "{schema}".sqlite_stat1').fetchall()
+        except sqlite3.OperationalError:
+            continue
+        for table_name, stat in rows:
+            table_name = _logical_table(table_name)
+            row_counts[table_name] = max(row_counts.get(table_name, 0), int(stat.split()[0]))
+    return row_counts
+
+
+def _walk_filters(query):
+    """Returns the filter objects of a query and its subqueries"""
+    filters = list(query.get("filters", []))
+    for subquery in query.get("subqueries", []):
+        filters.extend(_walk_filters(subquery))
+    return filters
+
+
+def describe_filter(filter_obj):
+    """Returns a filter the way the inspector lists it, such as labevents.valuenum 0 to 5"""
+    column = f"{filter_obj['table']}.{filter_obj['column']}"
+    if filter_obj["filter_type"] == "range":
+        return f"{column} {filter_obj['min']} to {filter_obj['max']}"
+    if filter_obj["filter_type"] == "value":
+        return f"{column} = {filter_obj['value']}"
+    relative_to = filter_obj.get("relative_to")
+    if relative_to:
+        return (f"{column} {filter_obj.get('start_hours', '')} to {filter_obj.get('end_hours', '')} h "
+                f"from {relative_to['table']}.{relative_to['column']}")
+    return f"{column} {filter_obj.get('start', '')} to {filter_obj.get('end', '')}"
+
+
+def _step_tables(name, detail, query_tables, encoded_tables, indexes):
+    """
+    Returns the tables of the query a SCAN or SEARCH step reads, or an empty list for the
+    lookup tables of encoded columns and the results of subqueries.
+    """
+    table_name = _logical_table(name)
+    if table_name == "d_items":
+        return [view for view in sorted(query_tables) if view in ITEM_VIEWS.values()] or ["d_items"]
+    if table_name in query_tables:
+        return [table_name]
+    # Decoding views built before they read their table under its own name call it t
+    match = INDEX_NAME_PATTERN.search(detail)
+    if match and match.group(1) in indexes:
+        return [indexes[match.group(1)][0]]
+    if name == "t":
+        return sorted(encoded_tables & query_tables)
+    return []
+
+
+def _filter_index(filter_obj, diagnosed_in):
+    """
+    Returns the index that lets SQLite find a filter's rows without reading its whole table:
+    the filtered column followed by the table's join key, which the subqueries and joins
+    json_to_sql writes read next. None for a window relative to another table's time, which
+    the join key and time indexes of index_builder already serve.
+    """
+    if filter_obj["filter_type"] == "time":
+        if filter_obj.get("relative_to"):
+            return None
+        column_name = get_epoch_column(filter_obj["column"]) if filter_obj.get("epoch") else filter_obj["column"]
+    else:
+        # An encoded table stores the codes in the column itself
+        column_name = filter_obj["column"]
+    _, join_condition = get_table_parent(filter_obj["table"], diagnosed_in)
+    columns = (column_name, join_condition[1]) if join_condition and join_condition[1] != column_name else (column_name,)
+    return _index_table(filter_obj["table"]), columns
+
+
+def _existing_index(indexes, table_name, columns):
+    """Returns an index on table_name that starts with columns, if there is one"""
+    for name, (index_table, index_columns) in indexes.items():
+        if index_table == table_name and index_columns[:len(columns)] == tuple(columns):
+            return name
+    return None
+
+
+def _reasons(table_name, select_tables, filter_tables, diagnosed_in):
+    """Returns why the query reads a table: its columns are selected, or it joins others to patients"""
+    reasons = ["selected columns"] if table_name in select_tables else []
+    reasons.extend(f"join to {other}" for other in sorted((select_tables | filter_tables) - {table_name})
+                   if table_name in get_table_path(other, diagnosed_in))
+    return reasons
+
+
+def _inspect_step(depth, detail, context):
+    step = {"depth": depth, "detail": detail, "tables": [], "issue": None, "rows": None,
+            "filters": [], "reasons": [], "advice": None, "index": None}
+    if "TEMP B-TREE" in detail:
+        step["issue"] = TEMP_BTREE
+        if "ORDER BY" in detail or "GROUP BY" in detail:
+            step["advice"] = "An index on the ordered columns would let SQLite read the rows in order."
+        else:
+            step["advice"] = ("Sorts the rows to remove duplicates. No index avoids it; selecting fewer "
+                              "columns, or ones that identify a row, makes it smaller.")
+        return step
+
+    match = STEP_PATTERN.match(detail)
+    if not match:
+        return step
+    operation, name, using = match.groups()
+    tables = _step_tables(name, detail, context["query_tables"], context["encoded_tables"], context["indexes"])
+    if not tables:
+        return step
+    step["tables"] = tables
+    step["rows"] = max((context["row_counts"].get(_index_table(table_name)) or 0 for table_name in tables),
+                       default=0) or None
+    step["filters"] = [filter_obj for filter_obj in context["filters"]
+                       if set(tables) & get_filter_tables(filter_obj)]
+    step["reasons"] = [reason for table_name in tables
+                       for reason in _reasons(table_name, context["select_tables"], context["filter_tables"],
+                                              context["diagnosed_in"])]
+
+    automatic_index = AUTOMATIC_INDEX_PATTERN.search(using or "")
+    if automatic_index:
+        step["issue"] = AUTOMATIC_INDEX
+        columns = tuple(dict.fromkeys(CONSTRAINT_COLUMN_PATTERN.findall(automatic_index.group(1))))
+        step["index"] = (_index_table(tables[0]), columns)
+        step["advice"] = ("SQLite builds this index every time the query runs. Creating it once "
+                          "saves that work.")
+        return step
+
+    if operation != "SCAN" or (using and "COVERING INDEX" not in using):
+        return step
+    if step["rows"] is not None and step["rows"] < SMALL_TABLE_ROWS:
+        return step
+    step["issue"] = FULL_SCAN
+    marked_filters = [mark_filter(filter_obj, context["encoded_columns"], context["epoch_columns"])
+                      for filter_obj in step["filters"]]
+    # Equality filters narrow the rows the most, so their index is suggested first
+    marked_filters.sort(key=lambda filter_obj: filter_obj["filter_type"] != "value")
+    for filter_obj in marked_filters:
+        if filter_obj["table"] not in tables:
+            continue
+        spec = _filter_index(filter_obj, context["diagnosed_in"])
+        if spec is None:
+            continue
+        existing = _existing_index(context["indexes"], *spec)
+        if existing:
+            step["advice"] = (f"{existing} could answer {describe_filter(filter_obj)}, but SQLite chose to "
+                              "read the whole table. Statistics from before the data changed can cause "
+                              "this; running ANALYZE refreshes them.")
+        else:
+            step["index"] = spec
+            step["advice"] = f"An index would find the rows of {describe_filter(filter_obj)} directly."
+        return step
+    step["advice"] = (f"No filter narrows {', '.join(tables)}, so every row is read. A filter on it, or "
+                      "on a table it joins to, would let SQLite look its rows up.")
+    return step
+
+
+def inspect_query(connection, query_object):
+    """
+    Plans the SQL json_to_sql writes for a query and explains each step of the plan: which
+    tables it reads and why, the filters that read them, and whether it reads a whole table,
+    sorts into a temporary B-tree or builds an automatic index, with the index that would
+    avoid it where there is one.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the database.
+        query_object (dict): The query object json_to_sql takes, with the encoded and epoch
+            columns of the database.
+
+    Returns:
+        dict: The SQL and its parameters, the steps, and the suggested indexes as
+            (table, columns) pairs for index_builder.build_indexes.
+    """
+    sql, parameters = json_to_sql(query_object)
+    filters = _walk_filters(query_object["query"])
+    diagnosed_in = query_object.get("diagnosed_in")
+    select_tables = {table["name"] for table in query_object["select_tables"]}
+    filter_tables = set().union(*(get_filter_tables(filter_obj) for filter_obj in filters))
+    query_tables = set()
+    for table_name in select_tables | filter_tables:
+        query_tables.update(get_table_path(table_name, diagnosed_in))
+    encoded_columns = query_object.get("encoded_columns") or {}
+    context = {
+        "filters": filters,
+        "diagnosed_in": diagnosed_in,
+        "select_tables": select_tables,
+        "filter_tables": filter_tables,
+        "query_tables": query_tables,
+        "encoded_tables": set(encoded_columns),
+        "encoded_columns": encoded_columns,
+        "epoch_columns": query_object.get("epoch_columns") or {},
+        "indexes": load_indexes(connection),
+        "row_counts": load_row_counts(connection),
+    }
+    steps = [_inspect_step(depth, detail, context)
+             for depth, detail in get_query_plan_steps(connection, sql, parameters)]
+    suggested_indexes = list(dict.fromkeys(step["index"] for step in steps if step["index"]))
+    return {"sql": sql, "parameters": parameters, "steps": steps, "suggested_indexes": suggested_indexes}
+
+
+def format_inspection(inspection):
+    """
+    Returns the plan of an inspect_query result as text, one line per step with the flagged
+    steps marked by ! and followed by what reads them and how to avoid them.
+    """
+    lines = []
+    for step in inspection["steps"]:
+        indent = "  " * step["depth"]
+        lines.append(f"{'!' if step['issue'] else ' '} {indent}{step['detail']}")
+        if not step["issue"]:
+            continue
+        rows = f", about {step['rows']:,} rows" if step["rows"] else ""
+        lines.append(f"  {indent}    {step['issue']}{rows}")
+        causes = [f"filter {describe_filter(filter_obj)}" for filter_obj in step["filters"]] + step["reasons"]
+        if causes:
+            lines.append(f"  {indent}    from: {'; '.join(causes)}")
+        if step["advice"]:
+            lines.append(f"  {indent}    {step['advice']}")
+        if step["index"]:
+            table_name, columns = step["index"]
+            lines.append(f"  {indent}    suggested: {index_name(table_name, columns)} ON {table_name} ({', '.join(columns)})")
+    if not any(step["issue"] for step in inspection["steps"]):
+        lines.append("No full scans, temporary B-trees or automatic indexes.")
+    return "\n".join(lines)
+
+
+def _table_file(connection, table_name):
+    """Returns the file of the main database or attached shard that stores a table"""
+    files = {row[1]: row[2] for row in connection.execute("PRAGMA database_list")}
+    for schema in get_schema_names(connection):
+        if connection.execute(f'SELECT 1 FROM "{schema}".sqlite_master WHERE type = \'table\' AND name IN (?, ?)',
+                              (table_name, f"{STORAGE_PREFIX}{table_name}")).fetchone():
+            return files[schema]
+    return None
+
+
+def create_suggested_indexes(database_path, specs):
+    """
+    Builds indexes, each in the file holding its table, and analyzes them so the planner
+    takes them into account. A sharded build's tables live in the shard files its main file
+    lists. Another connection can keep reading the database while they are built.
+
+    Args:
+        database_path (str): The database, or the main file of a sharded one.
+        specs (list): (table, columns) pairs, as inspect_query suggests them.
+
+    Returns:
+        list: One dict per index with its name, seconds taken and size in bytes.
+    """
+    specs_by_file = {}
+    with closing(open_database(database_path)) as connection:
+        for table_name, columns in specs:
+            file_path = _table_file(connection, table_name)
+            if file_path is None:
+                print(f"Skipping the index on {table_name}, which is not in {database_path}")
+                continue
+            specs_by_file.setdefault(file_path, []).append((table_name, columns))
+
+    report = []
+    for file_path, file_specs in specs_by_file.items():
+        with closing(sqlite3.connect(file_path)) as connection:
+            entries = build_indexes(connection, file_specs)
+            for entry in entries:
+                connection.execute(f'ANALYZE "{entry["index"]}"')
+            connection.commit()
+        report.extend(entries)
+    return report
+
+
+if __name__ == "__main__":
+    # plan_inspector.py <database> [--create] inspects the benchmark cohorts, and with
+    # --create builds the indexes they suggest
+    if len(sys.argv) not in (2, 3) or sys.argv[2:] not in ([], ["--create"]):
+        print("Usage: plan_inspector.py <database file> [--create]")
+        sys.exit(1)
+
+    from benchmark import BENCHMARK_QUERIES
+    from column_encoding import load_encoded_columns
+    from time_columns import load_epoch_columns
+
+    suggested_indexes = []
+    with closing(open_database(sys.argv[1])) as connection:
+        encoded_columns = load_encoded_columns(connection)
+        epoch_columns = load_epoch_columns(connection)
+        for query_name, query_object in BENCHMARK_QUERIES.items():
+            inspection = inspect_query(connection, {**query_object, "encoded_columns": encoded_columns,
+                                                    "epoch_columns": epoch_columns})
+            print(f"== {query_name}")
+            print(format_inspection(inspection))
+            suggested_indexes.extend(inspection["suggested_indexes"])
+    suggested_indexes = list(dict.fromkeys(suggested_indexes))
+    if "--create" in sys.argv and suggested_indexes:
+        start_time = time.perf_counter()
+        create_suggested_indexes(sys.argv[1], suggested_indexes)
+        print(f"Created {len(suggested_indexes)} suggested indexes in {time.perf_counter() - start_time:.2f} s")
@@ -0,0 +1,174 @@
+import sys
+import time
+import sqlite3
+from contextlib import closing
+from database_shards import get_schema_names
+
+# Rows ANALYZE reads from each index, 0 for every row. The build reads them all: it runs once,
+# takes a small fraction of the index build, and on a 7 million row dataset sampling 1000 rows
+# led the planner to a tachycardia plan 65% slower than the one full statistics give.
+DEFAULT_ANALYSIS_LIMIT = 0
+
+# The sample PRAGMA optimize takes when it refreshes statistics while the app opens or closes
+# a database, which has to stay quick
+OPTIMIZE_ANALYSIS_LIMIT = 1000
+
+# The tables ANALYZE stores its statistics in. sqlite_stat4 only exists when SQLite was
+# compiled with SQLITE_ENABLE_STAT4.
+STAT_TABLES = ("sqlite_stat1", "sqlite_stat4")
+
+
+def _existing_stat_tables(connection):
+    """
+    Returns the statistics tables of the main database and every attached shard, qualified
+    with their schema.
+    """
+    stat_tables = []
+    for schema in get_schema_names(connection):
+        stat_tables.extend(f'"{schema}".{row[0]}' for row in connection.execute(
+            f'SELECT name FROM "{schema}".sqlite_master WHERE type = \'table\' '
+            f"AND name IN ({', '.join('?' * len(STAT_TABLES))})", STAT_TABLES
+        ))
+    return stat_tables
+
+
+def analyze_database(connection, analysis_limit=DEFAULT_ANALYSIS_LIMIT):
+    """
+    Collects the table and index statistics the query planner picks join orders and indexes
+    with, and stores them in the database file. Without them SQLite assumes every table holds
+    about a million rows and every index matches ten, which makes it guess the order of the
+    wide joins build_filter_query writes.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        analysis_limit (int): Rows read from each index, 0 for all of them.
+
+    Returns:
+        dict: The seconds taken and the number of statistics rows stored.
+    """
+    connection.commit()
+    start_time = time.perf_counter()
+    connection.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+    connection.execute("ANALYZE")
+    connection.commit()
+    seconds = time.perf_counter() - start_time
+    stat_rows = sum(connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+                    for table_name in _existing_stat_tables(connection))
+    print(f"Analyzed the database in {seconds:.2f} s ({stat_rows} statistics rows, analysis_limit {analysis_limit})")
+    return {"seconds": seconds, "stat_rows": stat_rows}
+
+
+def optimize_on_open(connection):
+    """
+    Refreshes the statistics of tables that changed a lot since they were analyzed, as SQLite
+    recommends for connections that stay open. A sampling limit keeps it quick. Versions
+    before 3.46 ignore the 0x10000 flag and only act on tables queried earlier, so there it
+    does nothing and the refresh happens on close.
+    """
+    try:
+        connection.execute(f"PRAGMA analysis_limit = {OPTIMIZE_ANALYSIS_LIMIT}")
+        connection.execute("PRAGMA optimize = 0x10002")
+    except sqlite3.Error as e:
+        print(f"Could not optimize the database: {e}")
+
+
+def optimize_on_close(connection):
+    """
+    Lets SQLite analyze the tables this connection's queries would have planned better with
+    fresh statistics, such as tables given new indexes since the last ANALYZE. Call it just
+    before closing the connection.
+    """
+    try:
+        connection.execute(f"PRAGMA analysis_limit = {OPTIMIZE_ANALYSIS_LIMIT}")
+        connection.execute("PRAGMA optimize")
+    except sqlite3.Error as e:
+        print(f"Could not optimize the database: {e}")
+
+
+def reload_statistics(connection):
+    """
+    Makes a connection plan with statistics another connection stored since it opened. SQLite
+    only rereads them with the schema, and an ANALYZE elsewhere does not change the schema, but
+    ANALYZE on sqlite_master rereads them without analyzing anything.
+    """
+    for schema in get_schema_names(connection):
+        connection.execute(f'ANALYZE "{schema}".sqlite_master')
+
+
+def get_query_plan_steps(connection, sql, parameters=()):
+    """
+    Returns the steps of EXPLAIN QUERY PLAN for a statement as (depth, detail) pairs, in the
+    order SQLite lists them.
+    """
+    rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+    depths = {0: -1}
+    steps = []
+    for node_id, parent_id, _, detail in rows:
+        depths[node_id] = depths.get(parent_id, -1) + 1
+        steps.append((depths[node_id], detail))
+    return steps
+
+
+def get_query_plan(connection, sql, parameters=()):
+    """
+    Returns the steps of EXPLAIN QUERY PLAN for a statement, indented by their depth.
+    """
+    return ["  " * depth + detail for depth, detail in get_query_plan_steps(connection, sql, parameters)]
+
+
+def _time_query(connection, sql, parameters, repeats):
+    seconds = None
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        connection.execute(sql, parameters).fetchall()
+        elapsed = time.perf_counter() - start_time
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    return seconds
+
+
+def collect_query_plans(connection, statements, repeats=3):
+    """
+    Plans and times each statement with the statistics the connection loaded when it was
+    opened. SQLite keeps the row counts it read for as long as the connection lives, so plans
+    from before and after an ANALYZE need a connection opened on each side of it.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        statements (dict): Name -> SQL statement and its parameters, as json_to_sql returns them.
+        repeats (int): Runs of each statement, of which the fastest is reported.
+
+    Returns:
+        dict: Name -> its plan and seconds.
+    """
+    return {name: {"plan": get_query_plan(connection, sql, parameters),
+                   "seconds": _time_query(connection, sql, parameters, repeats)}
+            for name, (sql, parameters) in statements.items()}
+
+
+def print_plan_report(before, after):
+    """
+    Prints the timings of two collect_query_plans runs, without and with statistics, and
+    both plans of every statement whose plan the statistics changed.
+    """
+    print(f"{'query':<26} {'no stats s':>11} {'stats s':>9} {'speedup':>9}  plan")
+    for name in after:
+        speedup = f"{before[name]['seconds'] / after[name]['seconds']:8.2f}x" if after[name]["seconds"] > 0 else ""
+        changed = "changed" if before[name]["plan"] != after[name]["plan"] else "same"
+        print(f"{name:<26} {before[name]['seconds']:>11.4f} {after[name]['seconds']:>9.4f} {speedup:>9}  {changed}")
+    for name in after:
+        if before[name]["plan"] == after[name]["plan"]:
+            continue
+        print(f"\n{name} without statistics:")
+        print("\n".join(f"  {line}" for line in before[name]["plan"]))
+        print(f"{name} with statistics:")
+        print("\n".join(f"  {line}" for line in after[name]["plan"]))
+
+
+if __name__ == "__main__":
+    # planner_stats.py <database file> [analysis limit] analyzes a database, or one shard of a
+    # sharded database, built before the build did it, or again with a different sampling limit
+    if len(sys.argv) not in (2, 3):
+        print("Usage: planner_stats.py <database file> [analysis limit]")
+        sys.exit(1)
+    with closing(sqlite3.connect(sys.argv[1])) as connection:
+        analyze_database(connection, int(sys.argv[2]) if len(sys.argv) == 3 else DEFAULT_ANALYSIS_LIMIT)
@@ -0,0 +1,89 @@
+import sqlite3
+
+# Settings used while the database is being built. The file can always be rebuilt from the
+# CSVs, so durability is traded for speed: no fsyncs, a large page cache and a lock that keeps
+# other connections out for the duration of the load. The rollback journal stays on because
+# the build manifest's checkpoints must survive the app being killed mid-transaction; bulk
+# appends touch few existing pages, so it stays small.
+BULK_BUILD_PRAGMAS = [
+    ("journal_mode", "TRUNCATE"),
+    ("synchronous", "OFF"),
+    ("page_size", 16384),
+    ("auto_vacuum", "NONE"),  # Like page_size, only applies to a fresh file
+    ("cache_size", -512000),  # Negative means KiB, so roughly 500 MB
+    ("temp_store", "MEMORY"),
+    ("locking_mode", "EXCLUSIVE"),
+]
+
+# Settings the finished database is left with, and that every reader connection should use
+DURABLE_PRAGMAS = [
+    ("locking_mode", "NORMAL"),
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "DEFAULT"),
+]
+
+# Settings of the compacted copy a finished build is swapped in as. The database is only ever
+# rebuilt, never shrunk in place, so auto_vacuum would just add pointer map pages to maintain.
+COMPACT_PRAGMAS = [
+    ("page_size", 16384),
+    ("auto_vacuum", "NONE"),
+]
+
+# Number of parsed chunks written per transaction in each mode
+BULK_BUILD_COMMIT_EVERY = 50
+DEFAULT_COMMIT_EVERY = 1
+
+
+def apply_pragmas(connection, pragmas):
+    """
+    Sets each (name, value) PRAGMA on the connection and returns the values SQLite reports back.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        pragmas (list): Pairs of PRAGMA name and value.
+    """
+    applied = {}
+    for name, value in pragmas:
+        try:
+            row = connection.execute(f"PRAGMA {name} = {value}").fetchone()
+            applied[name] = row[0] if row else value
+        except sqlite3.Error as e:
+            print(f"Could not set PRAGMA {name}: {e}")
+    return applied
+
+
+def begin_bulk_build(connection, fresh=True):
+    """
+    Switches a connection to the bulk build profile. On a fresh build call this on an empty
+    database (after the old tables were dropped) so the larger page size can take effect.
+    A resumed build keeps the page size the file already has.
+    """
+    connection.commit()
+    applied = apply_pragmas(connection, BULK_BUILD_PRAGMAS)
+    if fresh:
+        # page_size only applies to a fresh file or after a VACUUM, which is cheap on an empty one
+        connection.execute("VACUUM")
+    print(f"Bulk build profile enabled: {applied}")
+    return applied
+
+
+def finish_bulk_build(connection):
+    """
+    Restores durable settings on a finished build and leaves the file in WAL mode.
+    """
+    connection.commit()
+    applied = apply_pragmas(connection, DURABLE_PRAGMAS)
+    # Leaving exclusive locking mode only releases the lock on the next access to the file
+    connection.execute("SELECT count(*) FROM sqlite_master").fetchone()
+    print(f"Durable profile restored: {applied}")
+    return applied
+
+
+def apply_reader_pragmas(connection):
+    """
+    Applies the durable settings to a connection opened on an existing database.
+    synchronous is per connection and per attached file, so readers have to set it themselves.
+    """
+    schemas = [row[1] for row in connection.execute("PRAGMA database_list") if row[1] != "temp"]
+    return apply_pragmas(connection, [(f'"{schema}".synchronous', "NORMAL") for schema in schemas])
@@ -0,0 +1,95 @@
+import time
+import threading
+from contextlib import contextmanager
+
+PROGRESS_STEPS = 100000  # SQLite VM instructions between calls of the progress handler
+PROGRESS_INTERVAL = 0.25  # Seconds between progress reports
+
+
+class QueryCancelled(Exception):
+    """Raised when a query is cancelled or runs over one of its budgets."""
+
+
+class QueryController:
+    """
+    Watches one run of a query. While it is installed on a connection, SQLite calls its
+    progress handler every PROGRESS_STEPS VM instructions, and the handler interrupts the
+    running statement once the query is cancelled or over its time budget. The interrupted
+    statement raises sqlite3.OperationalError, which raise_if_stopped turns into
+    QueryCancelled. Rows are counted as they are fetched, against the row budget.
+
+    cancel() may be called from any thread, such as the GUI's while a worker thread runs
+    the query; the statement stops within PROGRESS_STEPS instructions.
+    """
+
+    def __init__(self, time_budget=None, row_budget=None, progress_callback=None):
+        """
+        Args:
+            time_budget (float): Seconds the query may run, None or 0 for no limit.
+            row_budget (int): Rows the query may return, None or 0 for no limit.
+            progress_callback (callable): Called with the seconds elapsed, the VM steps run
+                and the rows fetched, at most every PROGRESS_INTERVAL seconds.
+        """
+        self.time_budget = time_budget
+        self.row_budget = row_budget
+        self.progress_callback = progress_callback
+        self.cancelled = threading.Event()
+        self.start_time = None
+        self.last_report = 0
+        self.vm_steps = 0
+        self.rows = 0
+        self.reason = None  # Why the query was stopped, once it was
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time if self.start_time is not None else 0
+
+    def _update_reason(self):
+        if self.reason is None:
+            if self.cancelled.is_set():
+                self.reason = "was cancelled"
+            elif self.time_budget and self.elapsed() > self.time_budget:
+                self.reason = f"ran over its time budget of {self.time_budget:g} s"
+            elif self.row_budget and self.rows > self.row_budget:
+                self.reason = f"returned more than its row budget of {self.row_budget:,} rows"
+        return self.reason
+
+    def _report(self, force=False):
+        now = time.perf_counter()
+        if self.progress_callback is not None and (force or now - self.last_report >= PROGRESS_INTERVAL):
+            self.last_report = now
+            self.progress_callback(self.elapsed(), self.vm_steps, self.rows)
+
+    def _progress_handler(self):
+        # A non-zero return interrupts the statement SQLite is running
+        self.vm_steps += PROGRESS_STEPS
+        self._report()
+        return 1 if self._update_reason() else 0
+
+    @contextmanager
+    def running(self, connection):
+        """Installs the progress handler on a connection for the statements run inside"""
+        if self.start_time is None:
+            self.start_time = time.perf_counter()
+        connection.set_progress_handler(self._progress_handler, PROGRESS_STEPS)
+        try:
+            yield self
+        finally:
+            connection.set_progress_handler(None, 0)
+            self._report(force=True)
+
+    def add_rows(self, rows):
+        """Counts fetched rows, and raises QueryCancelled once the query is stopped"""
+        self.rows += rows
+        self._report()
+        self.raise_if_stopped()
+
+    def raise_if_stopped(self):
+        """
+        Raises QueryCancelled if the query was cancelled or is over a budget. Called where a
+        statement failed too, since an interrupted statement fails like any other.
+        """
+        if self._update_reason():
+            raise QueryCancelled(f"The query {self.reason} after {self.elapsed():.1f} s and {self.rows:,} rows")
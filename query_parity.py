@@ -0,0 +1,193 @@
+import sys
+import time
+import sqlite3
+import argparse
+from collections import Counter
+from contextlib import closing
+from database_shards import open_database
+from json_to_sql import json_to_sql, execute_query, JOIN_STRATEGY, SEMI_JOIN_STRATEGY
+from column_encoding import load_encoded_columns
+from time_columns import load_epoch_columns
+from cohort_bitmaps import CohortBitmapEngine
+from benchmark import BENCHMARK_QUERIES, _select, _filter, _query
+
+DEFAULT_JOIN_TIMEOUT = 300  # Seconds a join strategy query may run before it is given up on
+
+# Query shapes whose semi_join SQL differs the most from the joined one. Together with the
+# benchmark cohorts they cover filters on selected and unselected tables, OR groups spanning
+# tables, subqueries over rows without a key, time windows across branches and tables outside
+# the join graph.
+PARITY_QUERIES = {
+    **BENCHMARK_QUERIES,
+    "two_event_tables": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id", "gender"])),
+        "query": _query("AND", [_filter("range", "chartevents", "valuenum", 100, 300),
+                                _filter("value", "labevents", "itemid", 50912)]),
+    },
+    "two_event_tables_selected": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("chartevents", ["charttime", "valuenum"])),
+        "query": _query("AND", [_filter("value", "chartevents_d_items", "label", "Heart Rate"),
+                                _filter("value", "labevents", "flag", "abnormal"),
+                                _filter("value", "prescriptions", "drug", "Furosemide")]),
+    },
+    "or_across_tables": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id", "anchor_age"])),
+        "query": _query("OR", [_filter("value", "microbiologyevents", "spec_type_desc", "SPUTUM"),
+                               _filter("value", "icustays", "first_careunit", "Coronary Care Unit (CCU)"),
+                               _filter("range", "patients", "anchor_age", 18, 30)]),
+    },
+    "or_within_admission": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("admissions", ["hadm_id", "insurance"])),
+        "query": _query("OR", [_filter("value", "d_icd_diagnoses", "long_title", "Hyperlipidemia, unspecified"),
+                               _filter("value", "prescriptions", "drug", "Furosemide")]),
+    },
+    "keyless_rows_intersected": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("labevents", ["charttime", "valuenum"])),
+        "query": _query("AND", [_filter("range", "labevents", "valuenum", 0, 5)], [
+            _query("OR", [_filter("value", "labevents", "itemid", 50912),
+                          _filter("value", "admissions", "insurance", "Medicaid")]),
+        ]),
+    },
+    "keyed_rows_nested": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("admissions", ["hadm_id", "admission_type"])),
+        "query": _query("AND", [_filter("value", "admissions", "insurance", "Medicare")], [
+            _query("OR", [_filter("value", "icustays", "first_careunit", "Medical Intensive Care Unit (MICU)"),
+                          _filter("value", "d_icd_diagnoses", "long_title", "Unspecified essential hypertension")]),
+            _query("AND", [_filter("value", "prescriptions", "drug", "Insulin")]),
+            _query("AND", []),
+        ]),
+    },
+    "first_day_labs_cohort": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"])),
+        "query": _query("AND", [{"filter_type": "time", "table": "labevents", "column": "charttime",
+                                 "relative_to": {"table": "admissions", "column": "admittime"},
+                                 "start_hours": 0, "end_hours": 24},
+                                _filter("value", "labevents", "itemid", 51221)]),
+    },
+    "early_icu_inputs": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"]), ("admissions", ["hadm_id"])),
+        "query": _query("AND", [{"filter_type": "time", "table": "inputevents", "column": "starttime",
+                                 "relative_to": {"table": "icustays", "column": "intime"},
+                                 "start_hours": 0, "end_hours": 6}]),
+    },
+    "outside_join_graph": {
+        "diagnosed_in": "hospital",
+        "select_tables": _select(("patients", ["subject_id"])),
+        "query": _query("AND", [_filter("value", "omr", "result_name", "BMI (kg/m2)"),
+                                _filter("value", "patients", "gender", "M")]),
+    },
+    "ed_diagnoses": {
+        "diagnosed_in": "ed",
+        "select_tables": _select(("patients", ["subject_id"]), ("edstays", ["intime"])),
+        "query": _query("OR", [_filter("value", "d_icd_diagnoses", "long_title", "Essential (primary) hypertension"),
+                               _filter("value", "d_icd_diagnoses", "long_title", "Hyperlipidemia, unspecified")]),
+    },
+}
+
+
+def _run(connection, run_query, timeout):
+    """
+    Runs a query and returns its rows, or None if it ran longer than timeout seconds.
+    run_query takes the connection and returns a cursor.
+    """
+    deadline = time.perf_counter() + timeout
+    connection.set_progress_handler(lambda: time.perf_counter() > deadline, 10000)
+    try:
+        return run_query(connection).fetchall()
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            return None
+        raise
+    finally:
+        connection.set_progress_handler(None, 0)
+
+
+def compare_strategies(connection, query_objects, join_timeout=DEFAULT_JOIN_TIMEOUT):
+    """
+    Runs each query with both strategies and checks they return the same rows, duplicates
+    included. Also checks that execute_query, which runs the cohort phases, and the bitmap
+    cohort engine, for the queries it evaluates, return the rows of the semi_join strategy.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the database.
+        query_objects (dict): Name -> query object.
+        join_timeout (float): Seconds after which a join strategy query is given up on. Its
+            parity is then unknown.
+
+    Returns:
+        dict: Name -> rows, the seconds of each strategy, of the cohort phases and of the
+            bitmap engine, and whether their results match.
+    """
+    encoded_columns = load_encoded_columns(connection)
+    epoch_columns = load_epoch_columns(connection)
+    cohort_engine = CohortBitmapEngine()
+    results = {}
+    for query_name, query_object in query_objects.items():
+        query_object = {**query_object, "encoded_columns": encoded_columns, "epoch_columns": epoch_columns}
+        result = {}
+        rows = {}
+        for strategy in (SEMI_JOIN_STRATEGY, JOIN_STRATEGY):
+            start_time = time.perf_counter()
+            sql, parameters = json_to_sql({**query_object, "strategy": strategy})
+            rows[strategy] = _run(connection, lambda connection: connection.execute(sql, parameters), join_timeout)
+            result[f"{strategy}_seconds"] = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        cohort_rows = _run(connection, lambda connection: execute_query(connection, query_object), join_timeout)
+        result["cohort_seconds"] = time.perf_counter() - start_time
+        result["rows"] = len(rows[SEMI_JOIN_STRATEGY])
+        result["match"] = None if rows[JOIN_STRATEGY] is None else Counter(rows[SEMI_JOIN_STRATEGY]) == Counter(rows[JOIN_STRATEGY])
+        result["cohort_match"] = None if cohort_rows is None else Counter(rows[SEMI_JOIN_STRATEGY]) == Counter(cohort_rows)
+        result["bitmap_seconds"] = result["bitmap_match"] = None
+        if cohort_engine.get_level(query_object):
+            start_time = time.perf_counter()
+            bitmap_rows = _run(connection, lambda connection: cohort_engine.execute(connection, query_object), join_timeout)
+            result["bitmap_seconds"] = time.perf_counter() - start_time
+            result["bitmap_match"] = None if bitmap_rows is None else Counter(rows[SEMI_JOIN_STRATEGY]) == Counter(bitmap_rows)
+        results[query_name] = result
+    return results
+
+
+def print_parity_report(results):
+    print(f"{'query':<28} {'rows':>9} {'join s':>9} {'semi_join s':>12} {'speedup':>9} {'cohort s':>9} {'bitmap s':>9}  parity")
+    for query_name, result in results.items():
+        join_seconds = f"{result['join_seconds']:9.3f}" if result["match"] is not None else "timed out"
+        speedup = f"{result['join_seconds'] / result['semi_join_seconds']:8.1f}x" if result["match"] is not None and result["semi_join_seconds"] > 0 else ""
+        parity = {True: "same rows", False: "DIFFERENT ROWS", None: "unknown"}[result["match"]]
+        if result["cohort_match"] is not True:
+            parity += ", cohort " + {False: "DIFFERENT ROWS", None: "timed out"}[result["cohort_match"]]
+        if result["bitmap_match"] is False or (result["bitmap_seconds"] is not None and result["bitmap_match"] is None):
+            parity += ", bitmap " + {False: "DIFFERENT ROWS", None: "timed out"}[result["bitmap_match"]]
+        bitmap_seconds = f"{result['bitmap_seconds']:9.3f}" if result["bitmap_seconds"] is not None else ""
+        print(f"{query_name:<28} {result['rows']:>9,} {join_seconds:>9} {result['semi_join_seconds']:>12.3f} "
+              f"{speedup:>9} {result['cohort_seconds']:>9.3f} {bitmap_seconds:>9}  {parity}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks that the semi_join strategy, the cohort phases and the bitmap cohort engine "
+                    "return the same rows as the join strategy.")
+    parser.add_argument("database", help="The database to run the parity queries on.")
+    parser.add_argument("--join-timeout", type=float, default=DEFAULT_JOIN_TIMEOUT,
+                        help="Seconds after which a join strategy query is given up on.")
+    parser.add_argument("--query", action="append", help="Run only this query. Can be repeated.")
+    arguments = parser.parse_args()
+
+    query_objects = {query_name: query_object for query_name, query_object in PARITY_QUERIES.items()
+                     if not arguments.query or query_name in arguments.query}
+    with closing(open_database(arguments.database)) as connection:
+        results = compare_strategies(connection, query_objects, arguments.join_timeout)
+    print_parity_report(results)
+    if any(False in (result["match"], result["cohort_match"], result["bitmap_match"]) for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+from PyQt5.QtWidgets import QDialog, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QPlainTextEdit
+from PyQt5.QtGui import QFont
+from PyQt5.QtCore import QThread, pyqtSignal
+from plan_inspector import create_suggested_indexes, format_inspection
+from index_builder import index_name
+
+class IndexCreationThread(QThread):
+    indexes_created = pyqtSignal(list)  # Emit the report of index_builder.build_indexes
+    creation_failed = pyqtSignal(str)  # Emit the error message
+
+    def __init__(self, database_path, specs):
+        super().__init__()
+        self.database_path = database_path
+        self.specs = specs
+
+    def run(self):
+        # Builds on its own connection; the window keeps reading through its WAL meanwhile
+        try:
+            self.indexes_created.emit(create_suggested_indexes(self.database_path, self.specs))
+        except Exception as e:
+            self.creation_failed.emit(str(e))
+
+class QueryPlanDialog(QDialog):
+    # Emitted once the suggested indexes exist, for the window to reload its statistics
+    indexes_created = pyqtSignal()
+
+    def __init__(self, inspection, database_path, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Query Plan")
+        # Not modal, so the canvas can be edited and analyzed again while it is open
+        self.setModal(False)
+        self.resize(900, 600)
+        self.database_path = database_path
+        self.specs = inspection["suggested_indexes"]
+        self.index_thread = None
+
+        layout = QVBoxLayout()
+        summary = QLabel("Steps marked ! read a whole table, sort into a temporary B-tree or build an "
+                         "automatic index. Filter items behind them are outlined on the canvas.")
+        summary.setWordWrap(True)
+        layout.addWidget(summary)
+
+        plan_text = QPlainTextEdit()
+        plan_text.setReadOnly(True)
+        plan_text.setFont(QFont("Monospace"))
+        plan_text.setPlainText(format_inspection(inspection))
+        layout.addWidget(plan_text, stretch=1)
+
+        self.status_label = QLabel(
+            "Suggested indexes: " + ", ".join(index_name(table_name, columns) for table_name, columns in self.specs)
+            if self.specs else "No indexes to suggest."
+        )
+        self.status_label.setWordWrap(True)
+        layout.addWidget(self.status_label)
+
+        button_row = QHBoxLayout()
+        self.create_button = QPushButton(f"Create Suggested Indexes ({len(self.specs)})")
+        self.create_button.setEnabled(bool(self.specs))
+        self.create_button.clicked.connect(self.create_indexes)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.close)
+        button_row.addStretch()
+        button_row.addWidget(self.create_button)
+        button_row.addWidget(close_button)
+        layout.addLayout(button_row)
+
+        self.setLayout(layout)
+
+    def create_indexes(self):
+        self.create_button.setEnabled(False)
+        self.status_label.setText(f"Creating {len(self.specs)} indexes in the background...")
+        self.index_thread = IndexCreationThread(self.database_path, self.specs)
+        self.index_thread.indexes_created.connect(self.on_indexes_created)
+        self.index_thread.creation_failed.connect(self.on_creation_failed)
+        self.index_thread.start()
+
+    def on_indexes_created(self, report):
+        seconds = sum(entry["seconds"] for entry in report)
+        megabytes = sum(entry["size_bytes"] for entry in report) / (1024 * 1024)
+        self.status_label.setText(f"Created {len(report)} indexes in {seconds:.1f} s ({megabytes:.1f} MB). "
+                                  "Analyze the query again to see its new plan.")
+        self.indexes_created.emit()
+
+    def on_creation_failed(self, message):
+        self.status_label.setText(f"Could not create the indexes: {message}")
+        self.create_button.setEnabled(True)
@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+
+# Disk space the cached results of a database may take before the least recently used are
+# evicted. config.yaml's result_cache_mb overrides it; 0 turns the cache off.
+DEFAULT_RESULT_CACHE_MB = 1024
+
+RESULT_MANIFEST = "result_manifest.json"
+
+
+def get_result_cache_directory(database_path):
+    """
+    Returns the directory holding the cached query results of a database: MIMIC_Database.db
+    keeps them in MIMIC_Database_results next to it.
+    """
+    root, _ = os.path.splitext(database_path)
+    return f"{root}_results"
+
+
+def database_fingerprint(connection):
+    """
+    Returns a hash identifying the data a connection reads. It covers, for the main file and
+    every attached shard, the file's inode, its tables and views, and its build manifest. A
+    rebuild renames a new file over the old one, so the inode changes even when the same
+    CSVs are loaded again; indexes and ANALYZE statistics change neither, since they do not
+    change any result. Rows written into the file in place are not noticed.
+    """
+    digest = hashlib.sha256()
+    for _, schema, file_path in connection.execute("PRAGMA database_list").fetchall():
+        if schema == "temp":
+            continue
+        inode = os.stat(file_path).st_ino if file_path else ""
+        digest.update(f"{schema}\0{file_path}\0{inode}\0".encode())
+        tables = connection.execute(
+            f"SELECT type, name, sql FROM \"{schema}\".sqlite_master WHERE type IN ('table', 'view') "
+            "AND name NOT LIKE 'sqlite\\_%' ESCAPE '\\' ORDER BY name"
+        ).fetchall()
+        for table in tables:
+            digest.update(repr(table).encode())
+        if any(name == "_build_manifest" for _, name, _ in tables):
+            for row in connection.execute(
+                f"SELECT table_name, source_hash, rows_committed, status FROM \"{schema}\"._build_manifest ORDER BY table_name"
+            ):
+                digest.update(repr(row).encode())
+    return digest.hexdigest()
+
+
+def query_key(query_object, fingerprint):
+    """
+    Returns the cache key of a query on the database with the given fingerprint. The query
+    object is serialized with sorted keys, so building the same canvas again finds it.
+    """
+    canonical_query = json.dumps(query_object, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{fingerprint}\0{canonical_query}".encode()).hexdigest()[:32]
+
+
+def clear_result_cache(database_path):
+    """
+    Deletes every cached result of a database. The app calls it once a new build is swapped in.
+    """
+    cache_directory = get_result_cache_directory(database_path)
+    if os.path.isdir(cache_directory):
+        shutil.rmtree(cache_directory)
+        print(f"Cleared the query result cache in {cache_directory}")
+
+
+class ResultCache:
+    """
+    CSV results of earlier queries, stored next to the database. Each entry is keyed by the
+    canonical query object and the database fingerprint, so a rebuilt database never serves
+    the results of the old one; entries of other fingerprints are deleted when the cache is
+    opened. Once the files pass max_bytes, the least recently used are evicted.
+
+    A result is stored by hard-linking its output file into the cache where they share a file
+    system, which takes no time or extra space whatever its size. It is served by a copy, so
+    the output files of two runs never share their contents. An output file edited in place
+    no longer matches the size and modification time its entry recorded, and the entry is
+    dropped instead of being served.
+    """
+
+    def __init__(self, connection, database_path, max_bytes=DEFAULT_RESULT_CACHE_MB * 1024 * 1024):
+        self.cache_directory = get_result_cache_directory(database_path)
+        self.max_bytes = max_bytes
+        self.fingerprint = database_fingerprint(connection)
+        self.manifest = self._read_manifest()
+        stale_keys = [key for key, entry in self.manifest["entries"].items() if entry["fingerprint"] != self.fingerprint]
+        if stale_keys:
+            for key in stale_keys:
+                self._drop_entry(key)
+            print(f"Dropped {len(stale_keys)} cached results of an earlier build of the database")
+            self._write_manifest()
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.cache_directory, RESULT_MANIFEST), "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {"entries": {}}
+
+    def _write_manifest(self):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        manifest_path = os.path.join(self.cache_directory, RESULT_MANIFEST)
+        with open(manifest_path + ".tmp", "w") as file:
+            json.dump(self.manifest, file, indent=2)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_directory, f"{key}.csv")
+
+    def _drop_entry(self, key):
+        self.manifest["entries"].pop(key, None)
+        if os.path.exists(self._entry_path(key)):
+            os.remove(self._entry_path(key))
+
+    def fetch(self, query_object, filename):
+        """
+        Writes the cached result of a query to filename.
+
+        Args:
+            query_object (dict): The query, in the format json_to_sql expects.
+            filename (str): The CSV file to write. It must not exist yet.
+
+        Returns:
+            int: Rows in the result, or None if the query has no cached result.
+        """
+        key = query_key(query_object, self.fingerprint)
+        entry = self.manifest["entries"].get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(self._entry_path(key))
+            if (stat.st_size, stat.st_mtime_ns) != (entry["size_bytes"], entry["mtime_ns"]):
+                raise OSError("The cached file was changed after it was stored")
+            shutil.copyfile(self._entry_path(key), filename)
+        except OSError as e:
+            print(f"Dropping the cached result {key}: {e}")
+            self._drop_entry(key)
+            self._write_manifest()
+            return None
+        entry["last_used"] = time.time()
+        self._write_manifest()
+        return entry["rows"]
+
+    def store(self, query_object, filename, rows):
+        """
+        Keeps the result of a query that was just written to filename, then evicts the least
+        recently used results while the cache is over max_bytes. Results larger than the
+        whole cache are not kept.
+
+        Args:
+            query_object (dict): The query the file holds the result of.
+            filename (str): The CSV file holding the result.
+            rows (int): Rows in the result.
+        """
+        size_bytes = os.path.getsize(filename)
+        if size_bytes > self.max_bytes:
+            return
+        key = query_key(query_object, self.fingerprint)
+        os.makedirs(self.cache_directory, exist_ok=True)
+        self._drop_entry(key)
+        try:
+            os.link(filename, self._entry_path(key))
+        except OSError:
+            shutil.copyfile(filename, self._entry_path(key))
+        now = time.time()
+        self.manifest["entries"][key] = {
+            "fingerprint": self.fingerprint,
+            "rows": rows,
+            "size_bytes": size_bytes,
+            "mtime_ns": os.stat(self._entry_path(key)).st_mtime_ns,
+            "created": now,
+            "last_used": now,
+        }
+
+        entries = self.manifest["entries"]
+        total_bytes = sum(entry["size_bytes"] for entry in entries.values())
+        for evicted_key in sorted(entries, key=lambda entry_key: entries[entry_key]["last_used"]):
+            if total_bytes <= self.max_bytes:
+                break
+            total_bytes -= entries[evicted_key]["size_bytes"]
+            self._drop_entry(evicted_key)
+        self._write_manifest()
+
+
+if __name__ == "__main__":
+    # result_cache.py <database file> deletes the cached query results of a database
+    if len(sys.argv) != 2:
+        print("Usage: result_cache.py <database file>")
+        sys.exit(1)
+    clear_result_cache(sys.argv[1])
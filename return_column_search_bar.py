@@ -7,6 +7,7 @@ from PyQt5.QtWidgets import (
     QLabel,
 )
 from PyQt5.QtCore import Qt, QAbstractListModel, QVariant
+from database_shards import list_tables
 
 
 class ColumnListModel(QAbstractListModel):
@@ -110,17 +111,20 @@ class ReturnColumnSearchBar(QWidget):
     def load_tables_and_columns(self):
         # Query the database to get all tables and their columns using sqlite3
         cursor = self.db_connection.cursor()
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+        # Views are listed too (the d_items views), internal tables starting with _ are not.
+        # The tables of every attached shard are included.
+        tables = list_tables(self.db_connection)
 
         # For each table, get the columns and format them as "table_name - column_name"
         self.original_columns = []  # Clear the original list
-        for table in tables:
-            table_name = table[0]
+        for table_name in tables:
             cursor.execute(f"PRAGMA table_info({table_name});")
             columns = cursor.fetchall()
             for column in columns:
                 column_name = column[1]
+                # The decoding views of dictionary-encoded tables also expose the raw codes
+                if column_name.startswith("_"):
+                    continue
                 self.original_columns.append(f"{table_name} - {column_name}")
 
         # Initialize the filtered list (starts as a copy of the original columns)
@@ -277,7 +277,7 @@ CREATE TABLE IF NOT EXISTS provider (
 
 CREATE TABLE IF NOT EXISTS services (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     transfertime DATETIME,
     prev_service TEXT,
     curr_service TEXT
@@ -285,7 +285,7 @@ CREATE TABLE IF NOT EXISTS services (
 
 CREATE TABLE IF NOT EXISTS transfers (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     transfer_id INTEGER,
     eventtype TEXT,
     careunit TEXT,
@@ -299,12 +299,12 @@ CREATE TABLE IF NOT EXISTS caregiver (
 
 CREATE TABLE IF NOT EXISTS chartevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id INTEGER,
     charttime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     value TEXT,
     valuenum REAL,
     valueuom TEXT,
@@ -312,7 +312,7 @@ CREATE TABLE IF NOT EXISTS chartevents (
 );
 
 CREATE TABLE IF NOT EXISTS d_items (
-    itemid TEXT,
+    itemid INTEGER,
     label TEXT,
     abbreviation TEXT,
     linksto TEXT,
@@ -325,12 +325,12 @@ CREATE TABLE IF NOT EXISTS d_items (
 
 CREATE TABLE IF NOT EXISTS datetimeevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id TEXT,
     charttime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     value TEXT,
     valueuom TEXT,
     warning TEXT
@@ -338,7 +338,7 @@ CREATE TABLE IF NOT EXISTS datetimeevents (
 
 CREATE TABLE IF NOT EXISTS icustays (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     first_careunit TEXT,
     last_careunit TEXT,
@@ -349,13 +349,13 @@ CREATE TABLE IF NOT EXISTS icustays (
 
 CREATE TABLE IF NOT EXISTS ingredientevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id TEXT,
     starttime DATETIME,
     endtime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     amount REAL,
     amountuom TEXT,
     rate REAL,
@@ -369,13 +369,13 @@ CREATE TABLE IF NOT EXISTS ingredientevents (
 
 CREATE TABLE IF NOT EXISTS inputevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id TEXT,
     starttime DATETIME,
     endtime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     amount REAL,
     amountuom TEXT,
     rate REAL,
@@ -398,25 +398,25 @@ CREATE TABLE IF NOT EXISTS inputevents (
 
 CREATE TABLE IF NOT EXISTS outputevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id TEXT,
     charttime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     value REAL,
     valueuom TEXT
 );
 
 CREATE TABLE IF NOT EXISTS procedureevents (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     caregiver_id TEXT,
     starttime DATETIME,
     endtime DATETIME,
     storetime DATETIME,
-    itemid TEXT,
+    itemid INTEGER,
     value REAL,
     valueuom TEXT,
     location TEXT,
@@ -444,7 +444,7 @@ CREATE TABLE IF NOT EXISTS diagnosis (
 
 CREATE TABLE IF NOT EXISTS edstays (
     subject_id INTEGER,
-    hadm_id TEXT,
+    hadm_id INTEGER,
     stay_id INTEGER,
     intime DATETIME,
     outtime DATETIME,
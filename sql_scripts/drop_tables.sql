@@ -46,10 +46,4 @@ DROP TABLE IF EXISTS patient_blood_pressure_standing_1min;
 DROP TABLE IF EXISTS patient_blood_pressure_standing_3mins;
 DROP TABLE IF EXISTS patient_blood_pressure_standing;
 DROP TABLE IF EXISTS patient_blood_pressure_lying;
-DROP TABLE IF EXISTS patient_blood_pressure;
-DROP TABLE IF EXISTS chartevents_d_items;
-DROP TABLE IF EXISTS datetimeevents_d_items;
-DROP TABLE IF EXISTS ingredientevents_d_items;
-DROP TABLE IF EXISTS inputevents_d_items;
-DROP TABLE IF EXISTS procedureevents_d_items;
-DROP TABLE IF EXISTS outputevents_d_items;
\ No newline at end of file
+DROP TABLE IF EXISTS patient_blood_pressure;
\ No newline at end of file
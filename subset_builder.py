@@ -0,0 +1,419 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+import multiprocessing
+from contextlib import closing
+import pandas as pd
+from json_to_sql import TABLE_RELATIONSHIPS, get_table_parent
+from item_catalog import ITEM_VIEWS
+from compressed_sources import open_source
+from column_encoding import STORAGE_PREFIX
+from database_shards import is_sharded
+from parallel_ingest import default_worker_count
+from csv_to_database import get_csv_path_and_table_names, create_database
+from pragma_profiles import begin_bulk_build, finish_bulk_build
+from planner_stats import analyze_database
+
+ROOT_TABLE = TABLE_RELATIONSHIPS["root_table"]
+
+# The CSVs name both kinds of stay stay_id; the build renames them (see rename_stay_id.sql)
+CSV_COLUMN_NAMES = {"ed_stay_id": "stay_id", "icu_stay_id": "stay_id"}
+
+# Build bookkeeping that describes the full build, not the subset
+SKIPPED_TABLES = {"_build_manifest", "_build_stages", "_shards"}
+
+CHUNKSIZE = 200000  # Rows read at a time from each CSV
+
+
+def subject_hash(subject_id, seed=0):
+    """
+    Returns a stable 64-bit hash of a subject_id. Patients are sampled in hash order, so the
+    same seed always picks the same patients, whether the ids come from the CSVs as text or
+    from the database as integers, and a smaller sample is part of every larger one.
+    """
+    digest = hashlib.blake2b(f"{seed}:{subject_id}".encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def sample_subject_ids(patients, fraction=None, count=None, stratify_by=(), seed=0):
+    """
+    Picks the patients of a subset.
+
+    Args:
+        patients (pandas.DataFrame): subject_id and the columns to stratify by, one row per patient.
+        fraction (float, optional): Share of the patients to keep, such as 0.01.
+        count (int, optional): Number of patients to keep, instead of fraction.
+        stratify_by (list): patients columns, such as gender or anchor_year_group. Each group
+            keeps its share of the sample, so a small subset has the full data's mix.
+        seed (int): Changes which patients are picked.
+
+    Returns:
+        set: The sampled subject_ids, as they appear in patients.
+    """
+    if count is None:
+        count = round(len(patients) * fraction)
+    count = min(count, len(patients))
+    ranked = patients.assign(_hash=patients["subject_id"].map(lambda subject_id: subject_hash(subject_id, seed)))
+    if not stratify_by:
+        return set(ranked.nsmallest(count, "_hash")["subject_id"])
+
+    stratify_by = list(stratify_by)
+    ranked[stratify_by] = ranked[stratify_by].fillna("")
+    groups = ranked.groupby(stratify_by)
+    sizes = groups.size()
+    # Largest remainder, so the group quotas add up to exactly count
+    exact = sizes * count / len(ranked)
+    quotas = exact.astype(int)
+    leftover = count - int(quotas.sum())
+    quotas[(exact - quotas).sort_values(ascending=False).index[:leftover]] += 1
+    sampled = set()
+    # groupby iterates its groups in the order of sizes
+    for (_, group), quota in zip(groups, quotas):
+        sampled.update(group.nsmallest(int(quota), "_hash")["subject_id"])
+    return sampled
+
+
+def is_dictionary_table(table_name):
+    """
+    Dictionary tables, such as d_icd_diagnoses and the d_items views, are copied whole: they
+    are small, and the filter bar lists their values.
+    """
+    return table_name.startswith("d_") or table_name in ITEM_VIEWS.values()
+
+
+def get_subset_filter(table_name, columns, available_tables):
+    """
+    Decides which rows of a table belong to a subset, following TABLE_RELATIONSHIPS: a table
+    keeps the rows that join to a kept row of its parent, so every row a query can reach
+    through the joins json_to_sql writes has its parent rows too.
+
+    Args:
+        table_name (str): The table.
+        columns (list): The table's columns.
+        available_tables (set): The tables the source has.
+
+    Returns:
+        tuple: (parent table, parent column, column), or None to copy the table whole.
+            patients, the root, is filtered by the sampled subject_ids instead.
+    """
+    parent_table, join_condition = get_table_parent(table_name, None)
+    if parent_table in available_tables and not is_dictionary_table(table_name):
+        return parent_table, join_condition[0], join_condition[1]
+    # Tables outside the join graph, such as omr, still belong to their patient
+    if table_name != ROOT_TABLE and "subject_id" in columns:
+        return ROOT_TABLE, "subject_id", "subject_id"
+    return None
+
+
+def _order_tables(filters):
+    """
+    Orders tables so every parent is subset before its children.
+    """
+    def depth(table_name):
+        subset_filter = filters.get(table_name)
+        return 0 if subset_filter is None else 1 + depth(subset_filter[0])
+    return sorted(filters, key=lambda table_name: (table_name != ROOT_TABLE, depth(table_name)))
+
+
+def print_subset_report(report):
+    print(f"{'table':<36} {'source rows':>14} {'subset rows':>14}")
+    for table_name, (source_rows, subset_rows) in report.items():
+        print(f"{table_name:<36} {source_rows:>14,} {subset_rows:>14,}")
+
+
+# Subsetting the CSVs
+
+def subset_csv_file(csv_file_path, output_path, column=None, keys=None, key_columns=(), chunksize=CHUNKSIZE):
+    """
+    Streams one CSV into a subset CSV, keeping the rows whose column holds one of keys, and
+    collects the values of key_columns the kept rows hold, which their child tables are
+    subset by. Runs in a pool process.
+
+    Returns:
+        tuple: Rows read, rows kept and column -> set of kept values.
+    """
+    kept_keys = {key_column: set() for key_column in key_columns}
+    rows_read = rows_kept = 0
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open_source(csv_file_path) as header_source:
+        header = pd.read_csv(header_source, nrows=0, dtype=str)
+    # Every field is read as text and written back as it was, so the subset parses like the source
+    with open_source(csv_file_path) as source, open(output_path, "w", newline="", encoding="utf-8") as output:
+        header.to_csv(output, index=False)
+        for chunk in pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=chunksize):
+            rows_read += len(chunk)
+            if column is not None:
+                chunk = chunk[chunk[column].isin(keys)]
+            for key_column in key_columns:
+                kept_keys[key_column].update(chunk[key_column])
+            chunk.to_csv(output, header=False, index=False)
+            rows_kept += len(chunk)
+    for values in kept_keys.values():
+        values.discard("")
+    return rows_read, rows_kept, kept_keys
+
+
+def subset_csvs(path_to_data, output_directory, fraction=None, count=None, stratify_by=(), seed=0, workers=None):
+    """
+    Writes a referentially complete subset of the MIMIC CSVs under path_to_data to
+    output_directory, in the same folder layout, ready for create_database. Files are
+    streamed in chunks, the files of each level of the join graph in parallel processes.
+
+    Args:
+        path_to_data (str): Directory that is searched for CSV files.
+        output_directory (str): Where the subset CSVs are written.
+        fraction, count, stratify_by, seed: Which patients to keep (see sample_subject_ids).
+        workers (int, optional): Number of processes. Defaults to one per spare core.
+
+    Returns:
+        dict: Table name -> (source rows, subset rows). Tables copied whole are not counted.
+    """
+    sources = {table_name: csv_file_path for csv_file_path, table_name in get_csv_path_and_table_names(path_to_data)}
+    if ROOT_TABLE not in sources:
+        raise FileNotFoundError(f"No {ROOT_TABLE} CSV under {path_to_data}")
+    headers = {}
+    for table_name, csv_file_path in sources.items():
+        with open_source(csv_file_path) as source:
+            headers[table_name] = list(pd.read_csv(source, nrows=0).columns)
+
+    filters = {}
+    for table_name in sources:
+        subset_filter = get_subset_filter(table_name, headers[table_name], set(sources))
+        if subset_filter is not None:
+            parent_table, parent_column, column = subset_filter
+            subset_filter = (parent_table, CSV_COLUMN_NAMES.get(parent_column, parent_column),
+                             CSV_COLUMN_NAMES.get(column, column))
+        filters[table_name] = subset_filter
+    # The columns each table's children are subset by
+    key_columns = {table_name: set() for table_name in sources}
+    for subset_filter in filters.values():
+        if subset_filter is not None:
+            key_columns[subset_filter[0]].add(subset_filter[1])
+
+    stratify_by = list(stratify_by)
+    with open_source(sources[ROOT_TABLE]) as source:
+        patients = pd.read_csv(source, dtype=str, usecols=["subject_id", *stratify_by])
+    kept_keys = {ROOT_TABLE: {"subject_id": sample_subject_ids(patients, fraction, count, stratify_by, seed)}}
+    print(f"Sampled {len(kept_keys[ROOT_TABLE]['subject_id']):,} of {len(patients):,} patients.")
+
+    def output_path(table_name, file_name):
+        relative_directory = os.path.relpath(os.path.dirname(sources[table_name]), path_to_data)
+        return os.path.join(output_directory, relative_directory, file_name)
+
+    report = {}
+    levels = {}
+    for table_name in _order_tables(filters):
+        subset_filter = filters[table_name]
+        level = 0 if subset_filter is None else 1 + next(
+            level for level, tables in levels.items() if subset_filter[0] in tables)
+        levels.setdefault(level, []).append(table_name)
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=workers or default_worker_count()) as pool:
+        for level in sorted(levels):
+            pending = {}
+            for table_name in levels[level]:
+                subset_filter = filters[table_name]
+                if subset_filter is None and table_name != ROOT_TABLE:
+                    # Copied whole, compression and all
+                    destination = output_path(table_name, os.path.basename(sources[table_name]))
+                    os.makedirs(os.path.dirname(destination), exist_ok=True)
+                    shutil.copyfile(sources[table_name], destination)
+                    continue
+                if table_name == ROOT_TABLE:
+                    column, keys = "subject_id", kept_keys[ROOT_TABLE]["subject_id"]
+                else:
+                    parent_table, parent_column, column = subset_filter
+                    keys = kept_keys[parent_table][parent_column]
+                pending[table_name] = pool.apply_async(subset_csv_file, (
+                    sources[table_name], output_path(table_name, f"{table_name}.csv"), column, keys,
+                    sorted(key_columns[table_name] - {"subject_id"} if table_name == ROOT_TABLE
+                           else key_columns[table_name])
+                ))
+            for table_name, result in pending.items():
+                rows_read, rows_kept, table_keys = result.get()
+                kept_keys.setdefault(table_name, {}).update(table_keys)
+                report[table_name] = (rows_read, rows_kept)
+                print(f"{table_name}: kept {rows_kept:,} of {rows_read:,} rows")
+    return report
+
+
+# Subsetting a built database
+
+def _attach_source(connection, database_path):
+    """
+    ATTACHes the source database as "source", and each shard of a sharded source as
+    source_<shard>.
+
+    Returns:
+        list: The attached schema names.
+    """
+    connection.execute("ATTACH DATABASE ? AS source", (database_path,))
+    schemas = ["source"]
+    if connection.execute("SELECT 1 FROM source.sqlite_master WHERE type = 'table' AND name = '_shards'").fetchone():
+        directory = os.path.dirname(os.path.abspath(database_path))
+        for shard, file_name in connection.execute("SELECT shard, file_name FROM source._shards").fetchall():
+            connection.execute("ATTACH DATABASE ? AS ?", (os.path.join(directory, file_name), f"source_{shard}"))
+            schemas.append(f"source_{shard}")
+    return schemas
+
+
+def _column_names(connection, schema, table_name):
+    return [row[1] for row in connection.execute(f'PRAGMA "{schema}".table_info("{table_name}")')]
+
+
+def subset_database(database_path, subset_path, fraction=None, count=None, stratify_by=(), seed=0):
+    """
+    Copies a referentially complete subset of a built database, or of every shard of a
+    sharded one, into a single new file. The schema is copied as it is, so the subset keeps
+    the source's column profile, dictionary encoding, epoch columns, views and indexes; rows
+    are copied with INSERT ... SELECT, without leaving SQLite.
+
+    Args:
+        database_path (str): The full database.
+        subset_path (str): The file to write. It is replaced if it exists.
+        fraction, count, stratify_by, seed: Which patients to keep (see sample_subject_ids).
+
+    Returns:
+        dict: Table name -> (source rows, subset rows).
+    """
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(subset_path + suffix):
+            os.remove(subset_path + suffix)
+
+    report = {}
+    with closing(sqlite3.connect(subset_path)) as connection:
+        begin_bulk_build(connection)
+        schemas = _attach_source(connection, database_path)
+        objects = []
+        for schema in schemas:
+            objects.extend((schema, object_type, name, sql) for object_type, name, sql in connection.execute(
+                f'SELECT type, name, sql FROM "{schema}".sqlite_master WHERE sql IS NOT NULL '
+                "AND name NOT LIKE 'sqlite%'"
+            ) if name not in SKIPPED_TABLES)
+        tables = {name: schema for schema, object_type, name, _ in objects if object_type == "table"}
+        for schema, object_type, name, sql in objects:
+            if object_type == "table" and connection.execute(
+                    "SELECT 1 FROM main.sqlite_master WHERE name = ?", (name,)).fetchone() is None:
+                connection.execute(sql)
+
+        # MIMIC tables by the name queries use; an encoded table's rows are in its storage table
+        storage = {name[len(STORAGE_PREFIX):] if name.startswith(STORAGE_PREFIX) else name: name
+                   for name in tables if not name.startswith("_") or name.startswith(STORAGE_PREFIX)}
+        filters = {table_name: get_subset_filter(table_name, _column_names(connection, "main", storage_table),
+                                                 set(storage))
+                   for table_name, storage_table in storage.items()}
+
+        stratify_by = list(stratify_by)
+        patients = pd.read_sql_query(
+            f'SELECT {", ".join(["subject_id", *stratify_by])} FROM "{tables[storage[ROOT_TABLE]]}".'
+            f'"{storage[ROOT_TABLE]}"', connection)
+        subject_ids = sample_subject_ids(patients, fraction, count, stratify_by, seed)
+        print(f"Sampled {len(subject_ids):,} of {len(patients):,} patients.")
+        connection.execute("CREATE TEMP TABLE _subset_subjects (subject_id INTEGER PRIMARY KEY)")
+        connection.executemany("INSERT INTO _subset_subjects VALUES (?)",
+                               ((int(subject_id),) for subject_id in subject_ids))
+
+        for table_name in _order_tables(filters):
+            storage_table = storage[table_name]
+            source_table = f'"{tables[storage_table]}"."{storage_table}"'
+            if table_name == ROOT_TABLE:
+                where = " WHERE subject_id IN (SELECT subject_id FROM temp._subset_subjects)"
+            elif filters[table_name] is None:
+                where = ""
+            else:
+                parent_table, parent_column, column = filters[table_name]
+                where = (f' WHERE "{column}" IN (SELECT "{parent_column}" FROM main."{storage[parent_table]}")')
+            connection.execute(f'INSERT INTO main."{storage_table}" SELECT * FROM {source_table}{where}')
+            report[table_name] = (
+                connection.execute(f"SELECT COUNT(*) FROM {source_table}").fetchone()[0],
+                connection.execute(f'SELECT COUNT(*) FROM main."{storage_table}"').fetchone()[0],
+            )
+            connection.commit()
+
+        # Lookup tables, the filter value catalog and the other internal tables are copied whole
+        for name, schema in tables.items():
+            if name.startswith("_") and not name.startswith(STORAGE_PREFIX):
+                connection.execute(f'INSERT OR IGNORE INTO main."{name}" SELECT * FROM "{schema}"."{name}"')
+        connection.commit()
+
+        for schema, object_type, name, sql in objects:
+            if object_type in ("view", "index") and connection.execute(
+                    "SELECT 1 FROM main.sqlite_master WHERE name = ?", (name,)).fetchone() is None:
+                connection.execute(sql)
+        connection.commit()
+        for schema in schemas:
+            connection.execute(f'DETACH DATABASE "{schema}"')
+        analyze_database(connection)
+        finish_bulk_build(connection)
+    return report
+
+
+def count_orphans(connection):
+    """
+    Counts, for every join in TABLE_RELATIONSHIPS, the rows whose join key has no row in the
+    parent table. A subset built by this module has none.
+
+    Returns:
+        dict: Table name -> orphaned rows, for the tables that have any.
+    """
+    orphans = {}
+    existing = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+    for table_name in existing:
+        parent_table, join_condition = get_table_parent(table_name, None)
+        if parent_table not in existing or is_dictionary_table(table_name):
+            continue
+        parent_column, column = join_condition
+        count = connection.execute(
+            f'SELECT COUNT(*) FROM "{table_name}" WHERE "{column}" IS NOT NULL '
+            f'AND "{column}" NOT IN (SELECT "{parent_column}" FROM "{parent_table}" WHERE "{parent_column}" IS NOT NULL)'
+        ).fetchone()[0]
+        if count:
+            orphans[table_name] = count
+    return orphans
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Builds a smaller, referentially complete copy of MIMIC from a sample of its patients.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--from-db", metavar="DATABASE", help="Subset this built database.")
+    source.add_argument("--from-csv", metavar="DIRECTORY", help="Subset the CSVs under this directory.")
+    parser.add_argument("output", help="The subset database to write, or with --from-csv the directory "
+                                       "for the subset CSVs.")
+    size = parser.add_mutually_exclusive_group(required=True)
+    size.add_argument("--fraction", type=float, help="Share of the patients to keep, such as 0.01.")
+    size.add_argument("--patients", type=int, help="Number of patients to keep.")
+    parser.add_argument("--stratify", default="",
+                        help="Comma-separated patients columns to stratify by, such as gender,anchor_year_group.")
+    parser.add_argument("--seed", type=int, default=0, help="Changes which patients are sampled.")
+    parser.add_argument("--workers", type=int, help="Number of processes subsetting the CSVs.")
+    parser.add_argument("--build", action="store_true",
+                        help="With --from-csv, also build MIMIC_Database.db from the subset CSVs.")
+    arguments = parser.parse_args()
+    stratify_by = [column for column in arguments.stratify.split(",") if column]
+
+    start_time = time.perf_counter()
+    if arguments.from_db:
+        report = subset_database(arguments.from_db, arguments.output, arguments.fraction, arguments.patients,
+                                 stratify_by, arguments.seed)
+        database_path = arguments.output
+    else:
+        report = subset_csvs(arguments.from_csv, arguments.output, arguments.fraction, arguments.patients,
+                             stratify_by, arguments.seed, arguments.workers)
+        database_path = create_database(arguments.output, workers=arguments.workers, resume=False) \
+            if arguments.build else None
+    print_subset_report(report)
+    print(f"Subset written in {time.perf_counter() - start_time:.1f} s")
+    if database_path:
+        with closing(sqlite3.connect(database_path)) as connection:
+            orphans = count_orphans(connection) if not is_sharded(connection) else {}
+        for table_name, count in orphans.items():
+            print(f"{table_name}: {count:,} rows without a parent row")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,688 @@
+import os
+import sys
+import time
+import zlib
+import numpy as np
+import pandas as pd
+from table_schema import load_table_schemas
+from database_shards import get_table_shard
+
+# Patients in the full MIMIC-IV v2.2 release. A scale factor of 0.01 generates 1% of them,
+# and every other table follows from the fan-out below.
+FULL_SCALE_PATIENTS = 299712
+
+# Rows per parent row in MIMIC-IV v2.2: table -> (parent table, mean rows per parent, dispersion).
+# Counts are negative binomial, so a smaller dispersion gives a longer tail: most ICU stays
+# have a few thousand chartevents and a few have tens of thousands. None means exactly one.
+FAN_OUT = {
+    "admissions": ("patients", 1.44, 0.5),
+    "edstays": ("patients", 1.42, 0.4),
+    "omr": ("patients", 21.5, 0.3),
+    "radiology": ("patients", 7.7, 0.4),
+    "icustays": ("admissions", 0.17, 1.0),
+    "diagnoses_icd": ("admissions", 11.0, 2.0),
+    "procedures_icd": ("admissions", 1.55, 0.8),
+    "drgcodes": ("admissions", 1.4, 5.0),
+    "services": ("admissions", 1.09, 10.0),
+    "transfers": ("admissions", 4.4, 3.0),
+    "hcpcsevents": ("admissions", 0.35, 0.3),
+    "labevents": ("admissions", 274.0, 0.7),
+    "microbiologyevents": ("admissions", 7.5, 0.3),
+    "emar": ("admissions", 62.0, 0.5),
+    "pharmacy": ("admissions", 31.5, 0.6),
+    "prescriptions": ("admissions", 36.0, 0.6),
+    "poe": ("admissions", 91.0, 0.6),
+    "discharge": ("admissions", 0.77, 5.0),
+    "chartevents": ("icustays", 4286.0, 0.8),
+    "datetimeevents": ("icustays", 97.0, 0.8),
+    "inputevents": ("icustays", 123.0, 0.7),
+    "ingredientevents": ("icustays", 159.0, 0.7),
+    "outputevents": ("icustays", 58.0, 0.8),
+    "procedureevents": ("icustays", 9.5, 0.8),
+    "diagnosis": ("edstays", 2.1, 3.0),
+    "medrecon": ("edstays", 7.0, 0.8),
+    "pyxis": ("edstays", 3.7, 0.8),
+    "triage": ("edstays", 1.0, None),
+    "vitalsign": ("edstays", 3.7, 1.0),
+    "emar_detail": ("emar", 2.04, 5.0),
+    "poe_detail": ("poe", 0.1, 0.5),
+}
+
+# Dictionary tables keep their full MIMIC-IV size at every scale
+DICTIONARY_ROWS = {
+    "d_items": 4014,
+    "d_labitems": 1622,
+    "d_icd_diagnoses": 109775,
+    "d_icd_procedures": 85257,
+    "d_hcpcs": 89200,
+    "provider": 40508,
+    "caregiver": 15468,
+}
+
+# Ids that must be unique are spread over a 10-million-wide range the way MIMIC's are:
+# column -> (first id, multiplier coprime with the range), so offset + i * multiplier % range
+# never repeats.
+ID_RANGE = 10_000_000
+SCRAMBLED_IDS = {
+    ("patients", "subject_id"): (10_000_000, 7_919_333),
+    ("admissions", "hadm_id"): (20_000_000, 6_113_143),
+    ("icustays", "stay_id"): (30_000_000, 4_102_933),
+    ("edstays", "stay_id"): (30_000_000, 2_718_281),
+}
+
+# Ids that simply count up within their table
+SEQUENTIAL_IDS = {
+    ("labevents", "labevent_id"): 1,
+    ("labevents", "specimen_id"): 1,
+    ("microbiologyevents", "microevent_id"): 1,
+    ("microbiologyevents", "micro_specimen_id"): 1,
+    ("transfers", "transfer_id"): 30_000_000,
+    ("pharmacy", "pharmacy_id"): 1,
+    ("emar", "emar_seq"): 1,
+    ("poe", "poe_seq"): 1,
+    ("discharge", "note_seq"): 1,
+    ("radiology", "note_seq"): 1,
+    ("inputevents", "orderid"): 1,
+    ("ingredientevents", "orderid"): 1,
+    ("procedureevents", "orderid"): 1,
+}
+
+# Key columns a child row copies from its parent row
+INHERITED_COLUMNS = ["subject_id", "hadm_id", "stay_id", "emar_id", "emar_seq", "pharmacy_id", "poe_id", "poe_seq"]
+
+# Dictionary rows a table refers to: table -> (dictionary, {column: dictionary column}).
+# The icu event tables draw from the d_items rows whose linksto names them.
+DICTIONARY_REFERENCES = {
+    "labevents": ("d_labitems", {"itemid": "itemid"}),
+    "diagnoses_icd": ("d_icd_diagnoses", {"icd_code": "icd_code", "icd_version": "icd_version"}),
+    "procedures_icd": ("d_icd_procedures", {"icd_code": "icd_code", "icd_version": "icd_version"}),
+    "hcpcsevents": ("d_hcpcs", {"hcpcs_cd": "code", "short_description": "short_description"}),
+    "diagnosis": ("d_icd_diagnoses", {"icd_code": "icd_code", "icd_version": "icd_version",
+                                      "icd_title": "long_title"}),
+    "chartevents": ("d_items", {"itemid": "itemid", "valueuom": "unitname"}),
+    "datetimeevents": ("d_items", {"itemid": "itemid"}),
+    "inputevents": ("d_items", {"itemid": "itemid", "amountuom": "unitname"}),
+    "ingredientevents": ("d_items", {"itemid": "itemid", "amountuom": "unitname"}),
+    "outputevents": ("d_items", {"itemid": "itemid", "valueuom": "unitname"}),
+    "procedureevents": ("d_items", {"itemid": "itemid", "valueuom": "unitname"}),
+}
+
+# Well known items come first, so the skewed draws make them the most frequent ones
+ANCHOR_ROWS = {
+    "d_items": [
+        (220045, "Heart Rate", "HR", "bpm"),
+        (220210, "Respiratory Rate", "RR", "insp/min"),
+        (220277, "O2 saturation pulseoxymetry", "SpO2", "%"),
+        (220179, "Non Invasive Blood Pressure systolic", "NBPs", "mmHg"),
+        (220180, "Non Invasive Blood Pressure diastolic", "NBPd", "mmHg"),
+        (223761, "Temperature Fahrenheit", "Temperature F", "°F"),
+    ],
+    "d_labitems": [
+        (51221, "Hematocrit"), (50971, "Potassium"), (50983, "Sodium"), (50912, "Creatinine"),
+        (51222, "Hemoglobin"), (51301, "White Blood Cells"),
+    ],
+    "d_icd_diagnoses": [
+        ("4019", 9, "Unspecified essential hypertension"),
+        ("E785", 10, "Hyperlipidemia, unspecified"),
+        ("I10", 10, "Essential (primary) hypertension"),
+        ("J189", 10, "Pneumonia, unspecified organism"),
+        ("4280", 9, "Congestive heart failure, unspecified"),
+        ("E119", 10, "Type 2 diabetes mellitus without complications"),
+    ],
+}
+
+# Share of d_items rows per linksto value
+ITEM_LINKSTO_WEIGHTS = {
+    "chartevents": 0.74, "datetimeevents": 0.05, "ingredientevents": 0.02, "inputevents": 0.08,
+    "outputevents": 0.02, "procedureevents": 0.05, "labevents": 0.04,
+}
+
+# Values of low-cardinality text columns, most frequent first
+VOCABULARIES = {
+    "gender": ["F", "M"],
+    "race": ["WHITE", "BLACK/AFRICAN AMERICAN", "OTHER", "UNKNOWN", "WHITE - OTHER EUROPEAN",
+             "HISPANIC/LATINO - PUERTO RICAN", "ASIAN", "ASIAN - CHINESE", "WHITE - RUSSIAN"],
+    "admission_type": ["EW EMER.", "EU OBSERVATION", "OBSERVATION ADMIT", "URGENT",
+                       "SURGICAL SAME DAY ADMISSION", "DIRECT EMER.", "DIRECT OBSERVATION", "ELECTIVE",
+                       "AMBULATORY OBSERVATION"],
+    "admission_location": ["EMERGENCY ROOM", "PHYSICIAN REFERRAL", "TRANSFER FROM HOSPITAL",
+                           "WALK-IN/SELF REFERRAL", "CLINIC REFERRAL", "PROCEDURE SITE"],
+    "discharge_location": ["HOME", "HOME HEALTH CARE", "SKILLED NURSING FACILITY", "REHAB", "DIED",
+                           "CHRONIC/LONG TERM ACUTE CARE", "HOSPICE"],
+    "insurance": ["Other", "Medicare", "Medicaid"],
+    "language": ["ENGLISH", "?"],
+    "marital_status": ["MARRIED", "SINGLE", "WIDOWED", "DIVORCED"],
+    "anchor_year_group": ["2008 - 2010", "2011 - 2013", "2014 - 2016", "2017 - 2019", "2020 - 2022"],
+    "careunit": ["Emergency Department", "Medicine", "Med/Surg", "Discharge Lounge", "Neurology",
+                 "Medical Intensive Care Unit (MICU)", "Cardiac Vascular Intensive Care Unit (CVICU)"],
+    "first_careunit": ["Medical Intensive Care Unit (MICU)", "Cardiac Vascular Intensive Care Unit (CVICU)",
+                       "Medical/Surgical Intensive Care Unit (MICU/SICU)", "Surgical Intensive Care Unit (SICU)",
+                       "Trauma SICU (TSICU)", "Coronary Care Unit (CCU)", "Neuro Intermediate"],
+    "eventtype": ["transfer", "admit", "discharge", "ED"],
+    "curr_service": ["MED", "CMED", "SURG", "NMED", "ORTHO", "OMED", "TRAUM", "NSURG", "CSURG", "GYN"],
+    "medication": ["Sodium Chloride 0.9%  Flush", "Insulin", "Heparin", "Acetaminophen", "Metoprolol Tartrate",
+                   "Pantoprazole", "Docusate Sodium", "Senna", "Potassium Chloride", "Furosemide"],
+    "drug": ["Insulin", "Sodium Chloride 0.9%  Flush", "Potassium Chloride", "Furosemide", "Acetaminophen",
+             "Magnesium Sulfate", "Heparin", "Docusate Sodium", "Bag", "Metoprolol Tartrate"],
+    "event_txt": ["Administered", "Flushed", "Not Given", "Delayed Administered", "Confirmed", "Stopped"],
+    "route": ["PO", "IV", "SC", "IV DRIP", "PO/NG", "IH", "TP"],
+    "status": ["Discontinued", "Expired", "Active", "Inactive (Due to a change order)"],
+    "order_type": ["Medications", "Lab", "General Care", "Nutrition", "ADT orders", "IV therapy", "Radiology"],
+    "transaction_type": ["New", "D/C", "Change", "H", "Co-sign"],
+    "order_status": ["Inactive", "Active"],
+    "drug_type": ["MAIN", "BASE", "ADDITIVE"],
+    "drg_type": ["HCFA", "APR"],
+    "arrival_transport": ["WALK IN", "AMBULANCE", "UNKNOWN", "OTHER", "HELICOPTER"],
+    "disposition": ["HOME", "ADMITTED", "TRANSFER", "LEFT WITHOUT BEING SEEN", "ELOPED", "EXPIRED"],
+    "flag": ["abnormal"],
+    "priority": ["ROUTINE", "STAT"],
+    "note_type": ["DS", "AD", "RR"],
+    "category": ["Routine Vital Signs", "Labs", "Respiratory", "Alarms", "Neurological", "Cardiovascular",
+                 "Chemistry", "Hematology", "Blood Gas", "Fluids/Intake", "Output", "Medications"],
+    "param_type": ["Numeric", "Text", "Date time", "Solution", "Process", "Numeric with tag", "Checkbox"],
+    "unitname": ["mmHg", "bpm", "%", "mg/dL", "mEq/L", "mL", "insp/min", "°F", "mg", "units"],
+    "fluid": ["Blood", "Urine", "Other Body Fluid", "Ascites", "Pleural"],
+    "statusdescription": ["FinishedRunning", "Stopped", "ChangeDose/Rate", "Paused"],
+    "ordercategoryname": ["02-Fluids (Crystalloids)", "01-Drips", "08-Antibiotics (IV)", "11-Prophylaxis (IV)",
+                          "05-Med Bolus", "14-Oral/Gastric Intake"],
+    "spec_type_desc": ["BLOOD CULTURE", "URINE", "SWAB", "SPUTUM", "MRSA SCREEN"],
+    "test_name": ["Blood Culture, Routine", "URINE CULTURE", "MRSA SCREEN", "GRAM STAIN", "Anaerobic Bottle Gram Stain"],
+    "org_name": ["ESCHERICHIA COLI", "STAPH AUREUS COAG +", "KLEBSIELLA PNEUMONIAE", "ENTEROCOCCUS SP.",
+                 "PSEUDOMONAS AERUGINOSA"],
+    "ab_name": ["GENTAMICIN", "TRIMETHOPRIM/SULFA", "CEFTAZIDIME", "CIPROFLOXACIN", "VANCOMYCIN", "OXACILLIN"],
+    "interpretation": ["S", "R", "I", "P"],
+    "chiefcomplaint": ["Abd pain", "Chest pain", "Dyspnea", "Fever", "Transfer", "Headache", "Dizziness"],
+    "rhythm": ["Sinus Rhythm", "Normal Sinus Rhythm", "Atrial Fibrillation", "Sinus Tachycardia"],
+    "name": ["Acetaminophen", "Ondansetron", "Morphine", "Aspirin", "Atorvastatin", "Lisinopril"],
+}
+VOCABULARY_ALIASES = {
+    "last_careunit": "first_careunit",
+    "prev_service": "curr_service",
+    "amountuom": "unitname",
+    "rateuom": "unitname",
+    "valueuom": "unitname",
+    "dose_unit_rx": "unitname",
+    "form_unit_disp": "unitname",
+}
+
+# Numeric columns with a realistic distribution: column -> (mean, sd, low, high, decimals)
+NUMERIC_DISTRIBUTIONS = {
+    "anchor_age": (58, 19, 18, 91, 0),
+    "temperature": (98.1, 1.0, 93, 106, 1),
+    "heartrate": (84, 17, 30, 200, 0),
+    "resprate": (18, 3.5, 6, 50, 0),
+    "o2sat": (97.6, 2.2, 70, 100, 0),
+    "sbp": (134, 22, 60, 240, 0),
+    "dbp": (77, 14, 30, 140, 0),
+    "acuity": (2.6, 0.7, 1, 5, 0),
+    "pain": (3, 3.5, 0, 10, 0),
+    "patientweight": (82, 22, 30, 250, 1),
+    "icd_version": (9.5, 0.5, 9, 10, 0),
+    "hospital_expire_flag": (0.02, 0.14, 0, 1, 0),
+    "warning": (0.01, 0.1, 0, 1, 0),
+    "seq_num": (5, 4, 1, 39, 0),
+    "drg_severity": (2.3, 1, 1, 4, 0),
+    "drg_mortality": (2.1, 1, 1, 4, 0),
+}
+
+# omr result names, most frequent first, with how their result_value is drawn
+OMR_RESULTS = [
+    ("Blood Pressure", None),
+    ("Weight (Lbs)", (180, 45, 80, 450, 1)),
+    ("BMI (kg/m2)", (28.5, 6.5, 14, 70, 1)),
+    ("Height (Inches)", (66, 4, 50, 80, 1)),
+    ("Blood Pressure Sitting", None),
+    ("Blood Pressure Standing", None),
+    ("Blood Pressure Lying", None),
+    ("Blood Pressure Standing (1 min)", None),
+    ("Blood Pressure Standing (3 mins)", None),
+    ("eGFR", (75, 25, 5, 140, 0)),
+    ("Weight", (82, 20, 35, 200, 1)),
+    ("BMI", (28.5, 6.5, 14, 70, 1)),
+    ("Height", (168, 10, 130, 205, 0)),
+]
+
+NOTE_WORDS = ["patient", "presented", "with", "history", "of", "hypertension", "denies", "chest", "pain",
+              "shortness", "breath", "was", "admitted", "for", "management", "discharged", "home", "on",
+              "medications", "follow-up", "\"stable\"", "in", "no", "acute", "distress", "the", "and",
+              "impression:", "findings:", "normal", "mild", "bilateral", "effusion,", "unchanged.", "\n"]
+NOTE_WORD_COUNTS = {"discharge": 300, "radiology": 90}  # Mean words per note
+
+NULL_FRACTION = 0.02  # Share of missing values in columns that are not keys
+ZIPF_EXPONENT = 1.1  # Skew of the categorical and dictionary draws
+ROWS_PER_BLOCK = 500_000  # Rows generated and written at a time
+
+
+def _table_rng(seed, table_name):
+    # Every table gets its own stream, so changing one generator leaves the others alone
+    return np.random.default_rng([seed, zlib.crc32(table_name.encode())])
+
+
+def _zipf_probabilities(size):
+    weights = 1.0 / np.arange(1, size + 1) ** ZIPF_EXPONENT
+    return weights / weights.sum()
+
+
+def zipf_choice(rng, values, size):
+    """
+    Draws size values, the first ones far more often than the last, like MIMIC's item and
+    code frequencies.
+    """
+    values = np.asarray(values, dtype=object)
+    return values[rng.choice(len(values), size=size, p=_zipf_probabilities(len(values)))]
+
+
+def fan_out_counts(rng, parents, mean, dispersion):
+    """
+    Draws the number of child rows of each parent from a negative binomial with the given mean.
+    """
+    if dispersion is None:
+        return np.ones(parents, dtype=np.int64)
+    return rng.negative_binomial(dispersion, dispersion / (dispersion + mean), size=parents)
+
+
+def _with_nulls(rng, values, fraction=NULL_FRACTION):
+    values = pd.Series(values)
+    return values.mask(rng.random(len(values)) < fraction)
+
+
+def _numeric(rng, size, distribution):
+    mean, sd, low, high, decimals = distribution
+    values = np.clip(rng.normal(mean, sd, size), low, high).round(decimals)
+    return values.astype(np.int64) if decimals == 0 else values
+
+
+def _format_times(values):
+    return pd.Series(np.datetime_as_string(values, unit="s")).str.replace("T", " ", regex=False)
+
+
+def _format_dates(values):
+    return pd.Series(np.datetime_as_string(values, unit="D"))
+
+
+def _notes(rng, size, mean_words):
+    words = np.asarray(NOTE_WORDS, dtype=object)
+    lengths = np.maximum(5, rng.poisson(mean_words, size))
+    return [" ".join(words[rng.integers(0, len(words), length)]) for length in lengths]
+
+
+def build_dictionaries(seed):
+    """
+    Generates the dictionary tables every event table draws its items and codes from.
+
+    Returns:
+        dict: Table name -> DataFrame.
+    """
+    dictionaries = {}
+
+    rng = _table_rng(seed, "d_items")
+    anchors = ANCHOR_ROWS["d_items"]
+    size = DICTIONARY_ROWS["d_items"]
+    used_ids = {row[0] for row in anchors}
+    itemids = [row[0] for row in anchors] + [itemid for itemid in range(220000, 240000)
+                                             if itemid not in used_ids][:size - len(anchors)]
+    linksto = list(ITEM_LINKSTO_WEIGHTS)
+    weights = np.array(list(ITEM_LINKSTO_WEIGHTS.values()))
+    items = pd.DataFrame({
+        "itemid": itemids,
+        "label": [row[1] for row in anchors] + [f"Item {itemid}" for itemid in itemids[len(anchors):]],
+        "abbreviation": [row[2] for row in anchors] + [f"I{itemid}" for itemid in itemids[len(anchors):]],
+        "linksto": ["chartevents"] * len(anchors) + list(rng.choice(linksto, size - len(anchors), p=weights / weights.sum())),
+        "category": ["Routine Vital Signs"] * len(anchors) + list(zipf_choice(rng, VOCABULARIES["category"], size - len(anchors))),
+        "unitname": [row[3] for row in anchors] + list(zipf_choice(rng, VOCABULARIES["unitname"], size - len(anchors))),
+        "param_type": ["Numeric"] * len(anchors) + list(zipf_choice(rng, VOCABULARIES["param_type"], size - len(anchors))),
+    })
+    items["lownormalvalue"] = _with_nulls(rng, rng.uniform(0, 60, size).round(0), 0.8)
+    items["highnormalvalue"] = _with_nulls(rng, rng.uniform(80, 200, size).round(0), 0.8)
+    dictionaries["d_items"] = items
+
+    rng = _table_rng(seed, "d_labitems")
+    anchors = ANCHOR_ROWS["d_labitems"]
+    size = DICTIONARY_ROWS["d_labitems"]
+    used_ids = {row[0] for row in anchors}
+    itemids = [row[0] for row in anchors] + [itemid for itemid in range(50801, 54000)
+                                             if itemid not in used_ids][:size - len(anchors)]
+    dictionaries["d_labitems"] = pd.DataFrame({
+        "itemid": itemids,
+        "label": [row[1] for row in anchors] + [f"Lab {itemid}" for itemid in itemids[len(anchors):]],
+        "fluid": zipf_choice(rng, VOCABULARIES["fluid"], size),
+        "category": zipf_choice(rng, ["Chemistry", "Hematology", "Blood Gas"], size),
+    })
+
+    for table_name, prefix in (("d_icd_diagnoses", "Diagnosis"), ("d_icd_procedures", "Procedure")):
+        rng = _table_rng(seed, table_name)
+        anchors = ANCHOR_ROWS.get(table_name, [])
+        size = DICTIONARY_ROWS[table_name] - len(anchors)
+        versions = np.where(rng.random(size) < 0.45, 9, 10)
+        codes = [f"{number:05d}" if version == 9 else f"{chr(65 + number % 26)}{number // 26:05d}"
+                 for number, version in zip(rng.permutation(size * 4)[:size], versions)]
+        used_codes = {row[0] for row in anchors}
+        keep = [code not in used_codes for code in codes]
+        codes = [code for code, kept in zip(codes, keep) if kept]
+        versions = versions[keep]
+        dictionaries[table_name] = pd.DataFrame({
+            "icd_code": [row[0] for row in anchors] + codes,
+            "icd_version": [row[1] for row in anchors] + list(versions),
+            "long_title": [row[2] for row in anchors] + [f"{prefix} {code}" for code in codes],
+        })
+
+    rng = _table_rng(seed, "d_hcpcs")
+    size = DICTIONARY_ROWS["d_hcpcs"]
+    codes = [f"{chr(65 + number % 26)}{number // 26:04d}" for number in range(size)]
+    dictionaries["d_hcpcs"] = pd.DataFrame({
+        "code": codes,
+        "category": _with_nulls(rng, rng.integers(1, 10, size), 0.5).astype("Int64"),
+        "long_description": [f"Procedure code {code}" for code in codes],
+        "short_description": [f"Proc {code}" for code in codes],
+    })
+
+    dictionaries["provider"] = pd.DataFrame(
+        {"provider_id": [f"P{number:05X}" for number in range(DICTIONARY_ROWS["provider"])]}
+    )
+    dictionaries["caregiver"] = pd.DataFrame({"caregiver_id": np.arange(1, DICTIONARY_ROWS["caregiver"] + 1)})
+    return dictionaries
+
+
+class DatasetGenerator:
+    """
+    Generates a MIMIC-IV shaped set of CSVs from the columns create_tables.sql declares.
+
+    patients are generated first, then every table of FAN_OUT below its parent, so child rows
+    carry their parent's keys and fall inside its time window, and every item and code exists
+    in its dictionary. Values are synthetic; only the shape of the data follows MIMIC.
+    """
+
+    def __init__(self, output_directory, scale_factor=0.001, seed=0, compression=None):
+        """
+        Args:
+            output_directory (str): Where the hosp, icu, ed and note folders are written.
+            scale_factor (float): Fraction of MIMIC-IV's patients to generate.
+            seed (int): Seed of every random draw; the same seed gives the same files.
+            compression (str, optional): "gzip" writes .csv.gz files instead of .csv.
+        """
+        self.output_directory = output_directory
+        self.scale_factor = scale_factor
+        self.seed = seed
+        self.compression = compression
+        self.schemas = load_table_schemas()
+        self.dictionaries = {}
+        self.parents = {}  # Key columns and time window of every table that has children
+        self.row_counts = {}
+
+    def _path(self, table_name):
+        directory = os.path.join(self.output_directory, get_table_shard(table_name))
+        os.makedirs(directory, exist_ok=True)
+        extension = ".csv.gz" if self.compression == "gzip" else ".csv"
+        return os.path.join(directory, table_name + extension)
+
+    def _write(self, table_name, frame, first_block):
+        columns = [column_name for column_name, _ in self.schemas[table_name]]
+        frame[columns].to_csv(self._path(table_name), mode="w" if first_block else "a", header=first_block,
+                              index=False, compression=self.compression)
+        self.row_counts[table_name] = self.row_counts.get(table_name, 0) + len(frame)
+
+    def _reference_rows(self, rng, table_name, size):
+        dictionary_name, columns = DICTIONARY_REFERENCES[table_name]
+        dictionary = self.dictionaries[dictionary_name]
+        if dictionary_name == "d_items":
+            dictionary = dictionary[dictionary["linksto"] == table_name]
+        rows = dictionary.iloc[rng.choice(len(dictionary), size=size, p=_zipf_probabilities(len(dictionary)))]
+        return {column: rows[dictionary_column].to_numpy() for column, dictionary_column in columns.items()}
+
+    def _column(self, rng, table_name, column_name, column_type, size, context):
+        """
+        Draws one column that neither the parent row nor a table-specific rule filled in.
+        """
+        if column_name.endswith("provider_id") and column_type == "TEXT":
+            return _with_nulls(rng, zipf_choice(rng, self.dictionaries["provider"]["provider_id"], size))
+        if column_name == "caregiver_id":
+            return _with_nulls(rng, zipf_choice(rng, self.dictionaries["caregiver"]["caregiver_id"], size)).astype("Int64")
+        vocabulary = VOCABULARIES.get(VOCABULARY_ALIASES.get(column_name, column_name))
+        if vocabulary:
+            return _with_nulls(rng, zipf_choice(rng, vocabulary, size))
+        if column_name in NUMERIC_DISTRIBUTIONS:
+            return _numeric(rng, size, NUMERIC_DISTRIBUTIONS[column_name])
+
+        if column_type == "INTEGER":
+            return _with_nulls(rng, rng.integers(0, 1000, size)).astype("Int64")
+        if column_type == "REAL":
+            return _with_nulls(rng, rng.lognormal(3, 1, size).round(2))
+        if column_type in ("DATETIME", "DATE"):
+            # Each time column follows the one before it, so storetime comes after charttime
+            offsets = rng.exponential(2 * 3600, size).astype("timedelta64[s]")
+            times = context.get("_last_time", context["_time"]) + offsets
+            context["_last_time"] = times
+            return _format_dates(times) if column_type == "DATE" else _with_nulls(rng, _format_times(times))
+        cardinality = 25
+        return _with_nulls(rng, zipf_choice(rng, [f"{column_name} {number}" for number in range(cardinality)], size))
+
+    def _special_columns(self, rng, table_name, size, context):
+        """
+        Columns whose values depend on other columns of the same row.
+        """
+        columns = {}
+        if table_name in DICTIONARY_REFERENCES:
+            columns.update(self._reference_rows(rng, table_name, size))
+
+        if table_name == "patients":
+            anchor_year = rng.integers(2110, 2209, size)
+            columns["anchor_year"] = anchor_year
+            columns["dod"] = _with_nulls(rng, _format_dates(context["_end"]), 0.9)
+        elif table_name == "admissions":
+            columns["admittime"] = _format_times(context["_time"])
+            columns["dischtime"] = _format_times(context["_time_end"])
+            columns["deathtime"] = _with_nulls(rng, _format_times(context["_time_end"]), 0.98)
+            edregtime = context["_time"] - rng.exponential(4 * 3600, size).astype("timedelta64[s]")
+            columns["edregtime"] = _with_nulls(rng, _format_times(edregtime), 0.6)
+            columns["edouttime"] = _with_nulls(rng, _format_times(context["_time"]), 0.6)
+        elif table_name in ("icustays", "edstays"):
+            columns["intime"] = _format_times(context["_time"])
+            columns["outtime"] = _format_times(context["_time_end"])
+            if table_name == "icustays":
+                columns["los"] = ((context["_time_end"] - context["_time"]).astype(np.int64) / 86400).round(6)
+        elif table_name == "omr":
+            results = zipf_choice(rng, range(len(OMR_RESULTS)), size).astype(np.int64)
+            values = np.empty(size, dtype=object)
+            for index, (result_name, distribution) in enumerate(OMR_RESULTS):
+                rows = results == index
+                count = int(rows.sum())
+                if distribution is None:
+                    systolic = _numeric(rng, count, (128, 18, 70, 220, 0))
+                    diastolic = _numeric(rng, count, (76, 11, 35, 130, 0))
+                    values[rows] = [f"{high}/{low}" for high, low in zip(systolic, diastolic)]
+                else:
+                    values[rows] = _numeric(rng, count, distribution).astype(str)
+            columns["result_name"] = np.asarray([name for name, _ in OMR_RESULTS], dtype=object)[results]
+            columns["result_value"] = values
+            columns["seq_num"] = rng.integers(1, 4, size)
+        elif table_name == "chartevents":
+            # Each item has its own typical value
+            means = 20 + (columns["itemid"] * 37 % 180)
+            valuenum = rng.normal(means, means * 0.1).round(1)
+            columns["valuenum"] = valuenum
+            columns["value"] = valuenum.astype(str)
+        elif table_name == "labevents":
+            valuenum = rng.lognormal(2.5, 1, size).round(1)
+            columns["valuenum"] = _with_nulls(rng, valuenum, 0.1)
+            columns["value"] = columns["valuenum"].astype(str).where(columns["valuenum"].notna())
+            columns["hadm_id"] = pd.Series(context["hadm_id"]).mask(rng.random(size) < 0.4).astype("Int64")
+        elif table_name in ("emar", "poe"):
+            sequence_column = "emar_seq" if table_name == "emar" else "poe_seq"
+            id_column = "emar_id" if table_name == "emar" else "poe_id"
+            columns[id_column] = (pd.Series(context["subject_id"]).astype(str) + "-" +
+                                  pd.Series(context[sequence_column]).astype(str)).to_numpy()
+        elif table_name in ("discharge", "radiology"):
+            note_kind = "DS" if table_name == "discharge" else "RR"
+            columns["note_id"] = (pd.Series(context["subject_id"]).astype(str) + f"-{note_kind}-" +
+                                  pd.Series(context["note_seq"]).astype(str)).to_numpy()
+            columns["note_type"] = np.full(size, note_kind, dtype=object)
+            columns["text"] = _notes(rng, size, NOTE_WORD_COUNTS[table_name])
+        elif table_name == "diagnosis":
+            columns["seq_num"] = rng.integers(1, 10, size)
+        return columns
+
+    def _own_ids(self, table_name, start_row, size):
+        ids = {}
+        row_numbers = np.arange(start_row, start_row + size, dtype=np.int64)
+        for (id_table, column_name), (offset, multiplier) in SCRAMBLED_IDS.items():
+            if id_table == table_name:
+                ids[column_name] = offset + row_numbers * multiplier % ID_RANGE
+        for (id_table, column_name), offset in SEQUENTIAL_IDS.items():
+            if id_table == table_name:
+                ids[column_name] = offset + row_numbers
+        return ids
+
+    def _time_window(self, rng, table_name, size, context):
+        """
+        Picks when each row happened within its parent's window, and how long it lasted.
+        """
+        start, end = context.pop("_start"), context.pop("_end")
+        span = np.maximum((end - start).astype(np.int64), 1)
+        context["_time"] = start + (rng.random(size) * span).astype("timedelta64[s]")
+        if table_name == "admissions":
+            length = rng.lognormal(np.log(4 * 86400), 0.8, size)
+        elif table_name == "icustays":
+            length = rng.lognormal(np.log(2.5 * 86400), 0.9, size)
+        elif table_name == "edstays":
+            length = rng.lognormal(np.log(6 * 3600), 0.6, size)
+        else:
+            length = rng.exponential(3600, size)
+        context["_time_end"] = context["_time"] + length.astype("timedelta64[s]")
+        if table_name == "icustays":
+            # An ICU stay ends by the time its admission does
+            context["_time_end"] = np.minimum(context["_time_end"], end)
+        context["_start"], context["_end"] = context["_time"], context["_time_end"]
+
+    def _generate_rows(self, rng, table_name, context, start_row):
+        size = len(next(iter(context.values())))
+        self._time_window(rng, table_name, size, context)
+        context.update(self._own_ids(table_name, start_row, size))
+        context.update(self._special_columns(rng, table_name, size, context))
+
+        frame = {}
+        for column_name, column_type in self.schemas[table_name]:
+            if column_name in context:
+                frame[column_name] = context[column_name]
+            else:
+                frame[column_name] = self._column(rng, table_name, column_name, column_type, size, context)
+        return pd.DataFrame(frame)
+
+    def _keep_parent_context(self, table_name, context):
+        if table_name not in {parent for parent, _, _ in FAN_OUT.values()}:
+            return
+        kept = {column: np.asarray(context[column]) for column in INHERITED_COLUMNS if column in context}
+        kept["_start"], kept["_end"] = context["_start"], context["_end"]
+        if table_name in self.parents:
+            for column, values in kept.items():
+                self.parents[table_name][column] = np.concatenate([self.parents[table_name][column], values])
+        else:
+            self.parents[table_name] = kept
+
+    def generate_patients(self):
+        rng = _table_rng(self.seed, "patients")
+        size = max(10, round(FULL_SCALE_PATIENTS * self.scale_factor))
+        # Each patient's records fall within three years of their anchor year
+        anchor_year = rng.integers(2110, 2209, size)
+        start = (anchor_year - 1970).astype("datetime64[Y]").astype("datetime64[s]")
+        context = {"_start": start, "_end": start + np.timedelta64(3 * 365 * 86400, "s")}
+        context.update(self._own_ids("patients", 0, size))
+        columns = self._special_columns(rng, "patients", size, context)
+        columns["anchor_year"] = anchor_year
+        context.update(columns)
+        frame = {}
+        for column_name, column_type in self.schemas["patients"]:
+            if column_name in context:
+                frame[column_name] = context[column_name]
+            else:
+                frame[column_name] = self._column(rng, "patients", column_name, column_type, size,
+                                                  {"_time": start})
+        self._write("patients", pd.DataFrame(frame), True)
+        self._keep_parent_context("patients", context)
+
+    def generate_child_table(self, table_name):
+        parent_name, mean, dispersion = FAN_OUT[table_name]
+        parent = self.parents[parent_name]
+        rng = _table_rng(self.seed, table_name)
+        parent_rows = len(parent["_start"])
+        counts = fan_out_counts(rng, parent_rows, mean, dispersion)
+
+        # Parents are split into blocks of about ROWS_PER_BLOCK child rows to bound memory
+        block_starts = [0]
+        running = np.cumsum(counts)
+        while block_starts[-1] < parent_rows:
+            limit = (running[block_starts[-1] - 1] if block_starts[-1] else 0) + ROWS_PER_BLOCK
+            block_starts.append(max(block_starts[-1] + 1, int(np.searchsorted(running, limit, side="right"))))
+        block_starts[-1] = parent_rows
+        if parent_rows == 0:
+            # The file is still written, with just its header
+            block_starts = [0, 0]
+
+        rows_written = 0
+        for block_start, block_end in zip(block_starts, block_starts[1:]):
+            parent_index = np.repeat(np.arange(block_start, block_end), counts[block_start:block_end])
+            if not len(parent_index) and rows_written:
+                continue
+            context = {column: values[parent_index] for column, values in parent.items()
+                       if column in INHERITED_COLUMNS or column in ("_start", "_end")}
+            if table_name in ("edstays", "radiology"):
+                context["hadm_id"] = self._linked_admissions(rng, context["subject_id"])
+            frame = self._generate_rows(rng, table_name, context, rows_written)
+            self._write(table_name, frame, rows_written == 0)
+            self._keep_parent_context(table_name, context)
+            rows_written += len(frame)
+
+    def _linked_admissions(self, rng, subject_ids):
+        # About half of ED stays and radiology reports belong to an admission of the same patient
+        admissions = self.parents["admissions"]
+        first_admission = pd.Series(admissions["hadm_id"], index=admissions["subject_id"])
+        first_admission = first_admission[~first_admission.index.duplicated()]
+        hadm_ids = pd.Series(subject_ids).map(first_admission)
+        return hadm_ids.mask(rng.random(len(hadm_ids)) < 0.5).astype("Int64").to_numpy()
+
+    def generate(self):
+        """
+        Writes every table.
+
+        Returns:
+            dict: Rows written per table.
+        """
+        self.dictionaries = build_dictionaries(self.seed)
+        for table_name, frame in self.dictionaries.items():
+            self._write(table_name, frame, True)
+        self.generate_patients()
+        for table_name in FAN_OUT:
+            self.generate_child_table(table_name)
+        return self.row_counts
+
+
+def generate_dataset(output_directory, scale_factor=0.001, seed=0, compression=None):
+    """
+    Writes a synthetic MIMIC-IV shaped dataset that create_database can load.
+
+    Args:
+        output_directory (str): Where the hosp, icu, ed and note folders are written.
+        scale_factor (float): Fraction of MIMIC-IV's 299,712 patients to generate. 0.001 gives
+            about 300 patients and 320,000 chartevents.
+        seed (int): Seed of every random draw.
+        compression (str, optional): "gzip" to write .csv.gz files.
+
+    Returns:
+        dict: Rows written per table.
+    """
+    start_time = time.perf_counter()
+    row_counts = DatasetGenerator(output_directory, scale_factor, seed, compression).generate()
+    seconds = time.perf_counter() - start_time
+    total_rows = sum(row_counts.values())
+    print(f"Generated {total_rows:,} rows in {len(row_counts)} tables in {seconds:.2f} s "
+          f"({total_rows / max(seconds, 1e-9):,.0f} rows/s)")
+    return row_counts
+
+
+if __name__ == "__main__":
+    # synthetic_data.py <output directory> [scale factor] [--gzip]
+    if len(sys.argv) < 2:
+        print("Usage: python synthetic_data.py <output directory> [scale factor] [--gzip]")
+        sys.exit(1)
+    arguments = [argument for argument in sys.argv[1:] if argument != "--gzip"]
+    generate_dataset(arguments[0], float(arguments[1]) if len(arguments) > 1 else 0.001,
+                     compression="gzip" if "--gzip" in sys.argv else None)
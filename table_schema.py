@@ -0,0 +1,115 @@
+import re
+from functools import cache
+
+CREATE_TABLES_PATH = "./sql_scripts/create_tables.sql"
+
+CREATE_TABLE_PATTERN = re.compile(r"CREATE TABLE IF NOT EXISTS (\w+) \((.*?)\);", re.DOTALL)
+
+# pandas dtype used to parse a column of each declared SQL type. Dates and times are kept as
+# the text MIMIC ships them in, which is also how SQLite stores them. INTEGER columns are parsed
+# as float64 because they may be empty and pandas' nullable Int64 parser is several times slower;
+# MIMIC ids are far below 2**53, so the values are exact and are turned back into ints when
+# rows are built (see parallel_ingest.chunk_to_rows).
+PANDAS_DTYPES = {
+    "INTEGER": "float64",
+    "REAL": "float64",
+    "TEXT": "str",
+    "DATE": "str",
+    "DATETIME": "str",
+}
+
+
+@cache
+def load_table_schemas(sql_file_path=CREATE_TABLES_PATH):
+    """
+    Parses create_tables.sql into the columns each table declares.
+
+    Args:
+        sql_file_path (str): Path to the CREATE TABLE script.
+
+    Returns:
+        dict: Table name -> tuple of (column name, SQL type) pairs, in declaration order.
+    """
+    with open(sql_file_path, 'r') as file:
+        sql_script = file.read()
+
+    schemas = {}
+    for match in CREATE_TABLE_PATTERN.finditer(sql_script):
+        columns = []
+        for line in match.group(2).splitlines():
+            parts = line.strip().rstrip(",").split()
+            if len(parts) >= 2:
+                columns.append((parts[0], parts[1].upper()))
+        schemas[match.group(1)] = tuple(columns)
+    return schemas
+
+
+@cache
+def get_create_statement(table_name, sql_file_path=CREATE_TABLES_PATH):
+    """
+    Returns the CREATE TABLE statement for one table from create_tables.sql, or None.
+    """
+    with open(sql_file_path, 'r') as file:
+        sql_script = file.read()
+    for match in CREATE_TABLE_PATTERN.finditer(sql_script):
+        if match.group(1) == table_name:
+            return match.group(0)
+    return None
+
+
+def get_table_columns(table_name):
+    """
+    Returns the declared (column name, SQL type) pairs of a table, or None if it is not declared.
+    """
+    return load_table_schemas().get(table_name)
+
+
+def get_integer_columns(table_name):
+    """
+    Returns the names of a table's columns declared INTEGER.
+    """
+    return frozenset(column_name for column_name, column_type in get_table_columns(table_name) or ()
+                     if column_type == "INTEGER")
+
+
+def get_read_options(table_name, strict=True, columns=None):
+    """
+    Builds the pandas.read_csv options that parse a table's CSV into its declared types.
+    Only declared columns are read, so extra columns in a source never reach the parser's output.
+
+    Args:
+        table_name (str): The table the CSV belongs to.
+        strict (bool): Parse numeric columns as numbers. When False every column is read as
+            text and SQLite's column affinity converts numeric values on insert, which
+            tolerates sources where a declared INTEGER column holds something else.
+        columns (tuple, optional): Read only these of the declared columns, as chosen by a
+            column profile. The parser skips the others without converting them.
+
+    Returns:
+        dict: usecols and dtype options, or an empty dict for tables not in create_tables.sql.
+    """
+    declared_columns = get_table_columns(table_name)
+    if not declared_columns:
+        return {}
+    if columns is not None:
+        declared_columns = [(column_name, column_type) for column_name, column_type in declared_columns
+                            if column_name in columns]
+
+    declared = {column_name for column_name, _ in declared_columns}
+    dtypes = {}
+    for column_name, column_type in declared_columns:
+        dtypes[column_name] = PANDAS_DTYPES.get(column_type, "str") if strict else "str"
+    return {
+        # A callable keeps a source that lacks a declared column loadable
+        "usecols": lambda column_name: column_name in declared,
+        "dtype": dtypes,
+    }
+
+
+def insert_statement(table_name, columns):
+    """
+    Builds the prepared INSERT statement for a batch of rows with the given column order.
+    """
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    return f'INSERT INTO "{table_name}" ({column_list}) VALUES ({placeholders})'
@@ -0,0 +1,174 @@
+import sys
+import sqlite3
+from contextlib import closing
+from datetime import datetime, timezone
+import pandas as pd
+from database_shards import list_tables
+
+# Timestamps that get an integer shadow column holding seconds since 1970-01-01. MIMIC stores
+# times as ISO text, so comparing them is a string comparison and time arithmetic needs
+# julianday() on every row; the shadow columns compare and add as plain integers. The first
+# column of each table is the time its events are looked up by, and is indexed.
+EPOCH_COLUMNS = {
+    "admissions": ["admittime", "dischtime"],
+    "chartevents": ["charttime"],
+    "datetimeevents": ["charttime"],
+    "edstays": ["intime", "outtime"],
+    "emar": ["charttime"],
+    "icustays": ["intime", "outtime"],
+    "inputevents": ["starttime", "endtime"],
+    "labevents": ["charttime"],
+    "microbiologyevents": ["charttime"],
+    "outputevents": ["charttime"],
+    "pharmacy": ["starttime", "stoptime"],
+    "poe": ["ordertime"],
+    "prescriptions": ["starttime", "stoptime"],
+    "procedureevents": ["starttime", "endtime"],
+    "services": ["transfertime"],
+    "transfers": ["intime", "outtime"],
+    "vitalsign": ["charttime"],
+}
+
+SECONDS_PER_HOUR = 3600
+
+
+def get_epoch_column(column_name):
+    """
+    Returns the name of a timestamp's shadow column. It starts with an underscore so the
+    column picker leaves it out.
+    """
+    return f"_{column_name}_epoch"
+
+
+def to_epoch_seconds(timestamp):
+    """
+    Converts an ISO date or date and time, as MIMIC writes them, to seconds since 1970-01-01.
+    Times are taken as UTC, like the shadow columns, since MIMIC's shifted times have no zone.
+    """
+    parsed = datetime.fromisoformat(str(timestamp))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+
+def to_timestamp_text(timestamp):
+    """
+    Writes a timestamp the way MIMIC stores its times, so it compares with them as text.
+    """
+    return datetime.fromisoformat(str(timestamp)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _column_names(connection, table_name):
+    return [row[1] for row in connection.execute(f'PRAGMA table_info("{table_name}")')]
+
+
+def add_epoch_columns(connection, table_names, storage_tables=None):
+    """
+    Adds the shadow columns of the given tables where they are missing. Tables that already
+    hold rows, such as those of a database built before the shadow columns existed, have the
+    new columns filled from their timestamps.
+
+    Args:
+        connection (sqlite3.Connection): A connection to the SQLite database.
+        table_names (list): The tables to add shadow columns to. Tables without timestamps
+            in EPOCH_COLUMNS, and timestamps a column profile left out, are skipped.
+        storage_tables (dict, optional): Table name -> the table its rows are stored in,
+            for dictionary-encoded tables.
+
+    Returns:
+        int: Number of shadow columns added.
+    """
+    columns_added = 0
+    for table_name in table_names:
+        storage_table = (storage_tables or {}).get(table_name, table_name)
+        existing_columns = _column_names(connection, storage_table)
+        for column_name in EPOCH_COLUMNS.get(table_name, []):
+            epoch_column = get_epoch_column(column_name)
+            if column_name not in existing_columns or epoch_column in existing_columns:
+                continue
+            connection.execute(f'ALTER TABLE "{storage_table}" ADD COLUMN {epoch_column} INTEGER')
+            # A no-op on the empty tables of a new build
+            connection.execute(
+                f'UPDATE "{storage_table}" SET {epoch_column} = CAST(strftime(\'%s\', {column_name}) AS INTEGER) '
+                f"WHERE {column_name} IS NOT NULL"
+            )
+            columns_added += 1
+    connection.commit()
+    return columns_added
+
+
+def get_table_epoch_columns(connection, table_name, storage_table=None):
+    """
+    Returns the timestamps of a table whose shadow columns exist, which the parse workers fill.
+    """
+    existing_columns = _column_names(connection, storage_table or table_name)
+    return [column_name for column_name in EPOCH_COLUMNS.get(table_name, [])
+            if get_epoch_column(column_name) in existing_columns]
+
+
+def add_epoch_values(chunk, column_names):
+    """
+    Adds the shadow column of each timestamp to a parsed chunk. Runs in the parse workers.
+    Times that do not parse are left empty, like missing ones.
+
+    Args:
+        chunk (pandas.DataFrame): A parsed chunk. The shadow columns are appended to it.
+        column_names (list): The timestamps to convert, from get_table_epoch_columns.
+    """
+    for column_name in column_names:
+        if column_name not in chunk.columns:
+            continue
+        parsed = pd.to_datetime(chunk[column_name], format="ISO8601", errors="coerce")
+        # Whole seconds, as float64 with NaN for missing times; the writer turns them into ints
+        # like any INTEGER column. True division would leave rounding errors in the last digit.
+        chunk[get_epoch_column(column_name)] = (parsed - pd.Timestamp(0)) // pd.Timedelta(seconds=1)
+
+
+def load_epoch_columns(connection):
+    """
+    Reads which timestamps have shadow columns in the main database and every attached shard.
+
+    Returns:
+        dict: Table name -> list of timestamps with shadow columns. Empty for databases built
+              without them.
+    """
+    epoch_columns = {}
+    for table_name, column_names in EPOCH_COLUMNS.items():
+        try:
+            existing_columns = _column_names(connection, table_name)
+        except sqlite3.OperationalError:
+            continue
+        present = [column_name for column_name in column_names if get_epoch_column(column_name) in existing_columns]
+        if present:
+            epoch_columns[table_name] = present
+    return epoch_columns
+
+
+if __name__ == "__main__":
+    # time_columns.py <database file> adds the shadow columns to a database, or to one shard
+    # of a sharded database, built without them
+    if len(sys.argv) != 2:
+        print("Usage: time_columns.py <database file>")
+        sys.exit(1)
+    from column_encoding import get_storage_table, create_decoding_views
+    from index_builder import build_indexes, get_index_specs, get_time_index_specs, index_name, print_index_report
+    with closing(sqlite3.connect(sys.argv[1])) as connection:
+        tables = [table_name for table_name in EPOCH_COLUMNS
+                  if get_storage_table(connection, table_name) in list_tables(connection, include_internal=True)]
+        added = add_epoch_columns(connection, tables,
+                                  {table_name: get_storage_table(connection, table_name) for table_name in tables})
+        # The decoding views of dictionary-encoded tables pick up the new columns when recreated
+        create_decoding_views(connection)
+        print(f"Added {added} epoch columns.")
+        time_specs = get_time_index_specs()
+        report = build_indexes(connection, time_specs)
+        # The existing indexes of these tables are built again after the time indexes, as
+        # in a new build, so plain joins keep preferring them (see get_index_specs)
+        existing_indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        rebuilt_specs = [(table_name, columns) for table_name, columns in get_index_specs()
+                         if (table_name, columns) not in time_specs and table_name in tables
+                         and index_name(table_name, columns) in existing_indexes]
+        for table_name, columns in rebuilt_specs:
+            connection.execute(f'DROP INDEX "{index_name(table_name, columns)}"')
+        report += build_indexes(connection, rebuilt_specs)
+        print_index_report(report)